@@ -1,5 +1,8 @@
-K = 20  # レーティングの変動の大きさを決める定数。デフォルト16。大きいほど収束が早いがブレが大きい
-INITIAL_RATING = 1500
+import rating_engine
+
+# レーティングのモデルと定数はrating_engine.CIRCUITSで設定する
+RATING_MODEL = rating_engine.create_model("cpt_2023")
+INITIAL_RATING = RATING_MODEL.initial_rating
 
 
 PLAYER_TSV_PATH = "./data/cpt_2023/2023-08-06_evo-2023_entrants.tsv"
@@ -35,9 +35,9 @@ def merge_results():
 if __name__ == "__main__":
     # merge_results()
 
-    ratings_df = ratings.create_rating_data()
+    ratings_df, rank_index, player_ids = ratings.create_rating_data()
 
-    player_data.create_player_data(ratings_df)
+    player_data.create_player_data(ratings_df, rank_index, player_ids)
 
     # team_results_df = team_results.create_team_results_data()
 
@@ -1,8 +1,32 @@
+"""全プレイヤー全試合のレーティングを計算
+
+試合を日付毎に適用し、各日の終了時点のレートをその日に試合をしたプレイヤー毎に
+1行のスナップショットとして出力する (ratings.tsv)。
+1試合毎のレート (ratings_all.tsv) はwrite_all=Trueの場合だけ、分割して書き出す
 """
-"""
+
+import argparse
 
 import conf
+import numpy as np
 import pandas as pd
+import player_stats
+import rating_engine
+
+RATING_COLUMNS = [
+    "date",
+    "tournament",
+    "playerId",
+    "playerTag",
+    "rating",
+    "diff_from_last",
+]
+
+# 初期レートの日付。全ての試合より前とする
+INITIAL_DATE = "2023-08-01"
+
+# ratings_all.tsvに一度に書き出す試合数
+WRITE_CHUNK_SIZE = 4096
 
 
 def init_ratings():
@@ -12,158 +36,225 @@ def init_ratings():
     # tournament_name = fpath.split("/")[-1].split("_")[1]
 
     df = pd.read_csv(fpath, sep="\t")
-    player_ratings = {
-        playerId: conf.INITIAL_RATING for playerId in df["playerId"].tolist()
-    }
+    player_index = pd.Index(df["playerId"])
+
+    ratings_df = pd.DataFrame(
+        {
+            "date": INITIAL_DATE,
+            "tournament": np.nan,
+            "playerId": df["playerId"],
+            "playerTag": df["playerTag"],
+            "rating": conf.INITIAL_RATING,
+            "diff_from_last": 0,
+        }
+    )
 
-    data = []
-    for playerId, tag in zip(df["playerId"].tolist(), df["playerTag"].tolist()):
-        data.append(
-            {
-                "date": "2023-08-01",
-                "playerId": playerId,
-                "playerTag": tag,
-                "rating": conf.INITIAL_RATING,
-                "diff_from_last": 0,
-            }
+    return player_index, ratings_df
+
+
+def replay_daily(player_cnt: int, matches: rating_engine.MatchArray):
+    """試合を日付 (matches.periods) 毎に適用し、各日の終了時点のスナップショットを返す
+
+    プレイヤー毎に最後に試合をした日付と試合の番号を配列で持ち、
+    1日分の適用後にその日に試合をしたプレイヤーのレートを記録する。
+    スナップショットは(日付番号, プレイヤーインデックス, その日の最後の試合の番号,
+    レート, その日のレートの増減)の配列の辞書。
+    各試合の(勝者, 敗者)のレート変動量と、日付毎に更新したレートの順位の索引
+    (player_stats.RankIndex) も返す。索引には最新の日付の試合を適用する前の状態を
+    player_stats.PREV_SNAPSHOTとして保存する
+    """
+    model = conf.RATING_MODEL
+    state = model.create_state(player_cnt)
+    day_start_ratings = model.get_ratings(state).copy()
+    last_days = np.full(player_cnt, -1, dtype=np.int64)
+    last_matches = np.full(player_cnt, -1, dtype=np.int64)
+    winner_diffs = np.empty(len(matches), dtype=np.int64)
+    loser_diffs = np.empty(len(matches), dtype=np.int64)
+    rank_index = player_stats.RankIndex(player_cnt)
+    rank_index.update(np.arange(player_cnt), day_start_ratings)
+
+    snapshots = {"day": [], "player": [], "match": [], "rating": [], "diff": []}
+    for start, end in matches.get_period_bounds():
+        day = matches.periods[start]
+        rank_index.save_snapshot(player_stats.PREV_SNAPSHOT)
+        winners = matches.winners[start:end]
+        losers = matches.losers[start:end]
+        # 1日の中は1試合ずつ適用する (レーティング期間は使わない)
+        day_matches = rating_engine.MatchArray(
+            winners, losers, matches.diff_sets[start:end]
         )
-    ratings_df = pd.DataFrame(data)
+        winner_diffs[start:end], loser_diffs[start:end] = model.replay(
+            state, day_matches
+        )
+
+        match_ids = np.arange(start, end)
+        last_days[winners] = day
+        last_days[losers] = day
+        np.maximum.at(last_matches, winners, match_ids)
+        np.maximum.at(last_matches, losers, match_ids)
 
-    return player_ratings, ratings_df
+        players = np.flatnonzero(last_days == day)
+        ratings = model.get_ratings(state)[players]
+        snapshots["day"].append(np.full(len(players), day))
+        snapshots["player"].append(players)
+        snapshots["match"].append(last_matches[players])
+        snapshots["rating"].append(ratings)
+        snapshots["diff"].append(ratings - day_start_ratings[players])
+        day_start_ratings[players] = ratings
+        rank_index.update(players, ratings)
 
+    snapshots = {
+        key: np.concatenate(values) if values else np.empty(0, dtype=np.int64)
+        for key, values in snapshots.items()
+    }
+    return snapshots, winner_diffs, loser_diffs, rank_index
 
-def get_scale_factor(n: int) -> float:
-    if n == 0 or n == 1:
-        return 1
-    if n == 2:
-        return 1.5
-    return (n + 11) / 8
 
+def interleave_pair(winner_values, loser_values, is_loser_first):
+    """1試合につき2行に並べる。is_loser_firstの試合は敗者、それ以外は勝者を先にする"""
+    first = np.where(is_loser_first, loser_values, winner_values)
+    second = np.where(is_loser_first, winner_values, loser_values)
+    return np.stack([first, second], axis=1).ravel()
 
-def calc_diff_rating(winner_rating, loser_rating, diff_sets):
-    """
-    得失点差を考慮できるWorld Football Elo Ratingを参考
-    https://en.wikipedia.org/wiki/World_Football_Elo_Ratings
+
+def write_all_ratings(
+    path,
+    initial_df,
+    results_df,
+    player_ids,
+    matches,
+    winner_diffs,
+    loser_diffs,
+    winner_tags,
+    loser_tags,
+):
+    """1試合毎の勝者・敗者のレートを新しい順に、WRITE_CHUNK_SIZE試合ずつ書き出す
+
+    同じ試合の2行はレートの高い順 (同じ場合は勝者が先)。初期レートは最後に出力する
     """
-    s = get_scale_factor(diff_sets)
-    expect = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
-    return round(conf.K * s * (1 - expect))
+    model = conf.RATING_MODEL
+    winner_ratings, loser_ratings = rating_engine.calc_rating_history(
+        model.get_ratings(model.create_state(len(player_ids))),
+        matches,
+        winner_diffs,
+        loser_diffs,
+    )
+    dates = results_df["date"].to_numpy()
+    tournaments = results_df["tournament"].to_numpy()
+    match_order = np.lexsort((-results_df["battle_order"].to_numpy(), -matches.periods))
+
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\t".join(RATING_COLUMNS) + "\n")
+        for start in range(0, len(match_order), WRITE_CHUNK_SIZE):
+            rows = match_order[start : start + WRITE_CHUNK_SIZE]
+            is_loser_first = loser_ratings[rows] > winner_ratings[rows]
+
+            def interleave(winner_values, loser_values):
+                return interleave_pair(winner_values, loser_values, is_loser_first)
 
+            chunk_df = pd.DataFrame(
+                {
+                    "date": np.repeat(dates[rows], 2),
+                    "tournament": np.repeat(tournaments[rows], 2),
+                    "playerId": interleave(
+                        player_ids[matches.winners[rows]],
+                        player_ids[matches.losers[rows]],
+                    ),
+                    "playerTag": interleave(winner_tags[rows], loser_tags[rows]),
+                    "rating": interleave(winner_ratings[rows], loser_ratings[rows]),
+                    "diff_from_last": interleave(winner_diffs[rows], loser_diffs[rows]),
+                }
+            )
+            chunk_df.to_csv(f, index=False, header=False, sep="\t", lineterminator="\n")
+        initial_df.to_csv(f, index=False, header=False, sep="\t", lineterminator="\n")
 
-def create_rating_data():
+
+def create_rating_data(write_all=False):
     # TODO all events
 
-    player_ratings, ratings_df = init_ratings()
+    player_index, initial_df = init_ratings()
 
     fpath = "./data/cpt_2023/2023-08-06_evo-2023_sets.tsv"
 
-    # ratings_df.to_csv(conf.RATINGS_TSV_PATH, index=False, sep="\t", lineterminator="\n")
-
     results_df = pd.read_csv(fpath, sep="\t", lineterminator="\n")
 
-    rating_rows = []
-    for row in results_df.itertuples():
-        # get player id, tag
-        winer_id, loser_id = row.entrant1playerId, row.entrant2playerId
-        winer_tag, loser_tag = row.entrant1playerTag, row.entrant2playerTag
-        if row.winnerId == row.entrant2Id:
-            winer_id, loser_id = row.entrant2playerId, row.entrant1playerId
-            winer_tag, loser_tag = row.entrant2playerTag, row.entrant1playerTag
-
-        diff_sets = abs(row.entrant1Score - row.entrant2Score)
-        if row.entrant1Score == -1 or row.entrant2Score == -1:
-            diff_sets = 1
-
-        diff_r = calc_diff_rating(
-            player_ratings[winer_id],
-            player_ratings[loser_id],
-            diff_sets,
-        )
+    # 試合は日付順に並んでいること (1日の中はファイルの順に適用する)
+    day_labels, days = np.unique(results_df["date"].to_numpy(), return_inverse=True)
+    if (np.diff(days) < 0).any():
+        raise Exception("試合結果が日付順に並んでいません。")
+    if (day_labels <= INITIAL_DATE).any():
+        raise Exception(f"{INITIAL_DATE}以前の試合があります。")
 
-        player_ratings[winer_id] += diff_r
-        player_ratings[loser_id] -= diff_r
-
-        # winner
-        new_row = {
-            "date": row.date,
-            "tournament": row.tournament,
-            "battle_order": row.battle_order,
-            "playerId": winer_id,
-            "playerTag": winer_tag,
-            "rating": player_ratings[winer_id],
-            "diff_from_last": diff_r,
-        }
-        rating_rows.append(new_row)
-
-        # loser
-        new_row = {
-            "date": row.date,
-            "tournament": row.tournament,
-            "battle_order": row.battle_order,
-            "playerId": loser_id,
-            "playerTag": loser_tag,
-            "rating": player_ratings[loser_id],
-            "diff_from_last": -diff_r,
-        }
-        rating_rows.append(new_row)
-
-    r_df = pd.DataFrame(rating_rows)
-    ratings_df = pd.concat([ratings_df, r_df], ignore_index=True)
-
-    def latest(values):
-        return values.iloc[0]
-
-    ratings_sumed_by_date_df = (
-        ratings_df.sort_values(by=["date", "battle_order"], ascending=False)
-        .groupby(by=["date", "playerId"])
-        .agg(
-            {
-                "tournament": latest,
-                "playerTag": latest,
-                "rating": latest,
-                "diff_from_last": "sum",
-            }
-        )
-        .reset_index()
+    # 勝者・敗者のプレイヤーを求める
+    is_entrant2_win = (results_df["winnerId"] == results_df["entrant2Id"]).to_numpy()
+    p1_ids = results_df["entrant1playerId"].to_numpy()
+    p2_ids = results_df["entrant2playerId"].to_numpy()
+    p1_tags = results_df["entrant1playerTag"].to_numpy()
+    p2_tags = results_df["entrant2playerTag"].to_numpy()
+    winner_ids = np.where(is_entrant2_win, p2_ids, p1_ids)
+    loser_ids = np.where(is_entrant2_win, p1_ids, p2_ids)
+    winner_tags = np.where(is_entrant2_win, p2_tags, p1_tags)
+    loser_tags = np.where(is_entrant2_win, p1_tags, p2_tags)
+
+    score1 = results_df["entrant1Score"].to_numpy()
+    score2 = results_df["entrant2Score"].to_numpy()
+    diff_sets = np.where((score1 == -1) | (score2 == -1), 1, np.abs(score1 - score2))
+
+    winner_idx = player_index.get_indexer(winner_ids)
+    loser_idx = player_index.get_indexer(loser_ids)
+    if (winner_idx < 0).any() or (loser_idx < 0).any():
+        raise Exception("entrantsに無いプレイヤーの試合があります。")
+
+    matches = rating_engine.MatchArray(winner_idx, loser_idx, diff_sets, days)
+    snapshots, winner_diffs, loser_diffs, rank_index = replay_daily(
+        len(player_index), matches
     )
 
-    ratings_df = ratings_df.sort_values(
-        by=["date", "battle_order", "rating"], ascending=False
+    # スナップショットのタグと大会は、その日の最後の試合のものにする
+    last_matches = snapshots["match"]
+    is_winner = winner_idx[last_matches] == snapshots["player"]
+    daily_df = pd.DataFrame(
+        {
+            "date": day_labels[snapshots["day"]],
+            "tournament": results_df["tournament"].to_numpy()[last_matches],
+            "playerId": player_index.to_numpy()[snapshots["player"]],
+            "playerTag": np.where(
+                is_winner, winner_tags[last_matches], loser_tags[last_matches]
+            ),
+            "rating": snapshots["rating"],
+            "diff_from_last": snapshots["diff"],
+        }
     )
+    ratings_sumed_by_date_df = pd.concat([initial_df, daily_df], ignore_index=True)
     ratings_sumed_by_date_df = ratings_sumed_by_date_df.sort_values(
-        by=["date", "rating"], ascending=False
+        by=["date", "rating", "playerId"], ascending=[False, False, True]
     )
 
-    ratings_df = ratings_df[
-        [
-            "date",
-            "tournament",
-            "playerId",
-            "playerTag",
-            "rating",
-            "diff_from_last",
-        ]
-    ]
-    ratings_sumed_by_date_df = ratings_sumed_by_date_df[
-        [
-            "date",
-            "tournament",
-            "playerId",
-            "playerTag",
-            "rating",
-            "diff_from_last",
-        ]
-    ]
-
-    ratings_df.to_csv(
-        conf.RATINGS_ALL_TSV_PATH, index=False, sep="\t", lineterminator="\n"
-    )
+    if write_all:
+        write_all_ratings(
+            conf.RATINGS_ALL_TSV_PATH,
+            initial_df,
+            results_df,
+            player_index.to_numpy(),
+            matches,
+            winner_diffs,
+            loser_diffs,
+            winner_tags,
+            loser_tags,
+        )
     ratings_sumed_by_date_df.to_csv(
         conf.RATINGS_TSV_PATH, index=False, sep="\t", lineterminator="\n"
     )
 
-    return ratings_sumed_by_date_df
+    # 順位の索引はプレイヤーインデックス (player_index) の順
+    return ratings_sumed_by_date_df, rank_index, player_index.to_numpy()
 
 
 if __name__ == "__main__":
-    create_rating_data()
+    parser = argparse.ArgumentParser(description="cpt_2023のレーティングを計算する")
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="1試合毎のレート (ratings_all.tsv) も出力する",
+    )
+    create_rating_data(write_all=parser.parse_args().all)
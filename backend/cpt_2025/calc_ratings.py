@@ -1,93 +1,235 @@
+import collections
+import csv
+import json
+import os
+import shutil
+
+import match_stream
+import match_table
+import numpy as np
 import pandas as pd
+import player_stats
+import rating_engine
+import rating_history
+import storage
+
+# レーティングのモデルと定数はrating_engine.CIRCUITSで設定する
+# Glicko-2などレーティング期間を使うモデルでは、1イベントを1期間とする
+MODEL = rating_engine.create_model("cpt_2025")
+
+# 前回計算時点のレートを保存するディレクトリ
+# model.json: 計算に使ったモデルと設定値
+# players.tsv: プレイヤー毎のモデルの状態 (レートなど) と勝敗数
+# matches.tsv: 適用済みの試合キーとレート変動量 (適用順。最終行が最後に適用した試合)
+CHECKPOINT_DIR = "data/cpt_2025/rating_checkpoint"
+CHECKPOINT_PLAYER_DTYPES = {"PlayerId": "int64", "WinCnt": "int64", "LoseCnt": "int64"}
+
+# 試合を一意に特定する列
+# レートは試合を古い順に並べて計算する (match_table.MatchTable.get_chronological_order)
+MATCH_KEY_COLUMNS = ["Datetime(UTC)", "Event", "Bracket", "Round", "Player1", "Player2"]
 
-K = 20  # レーティングの変動の大きさを決める定数。デフォルト16。大きいほど収束が早いがブレが大きい
-INITIAL_RATING = 1500
+
+def use_model(model_name: str):
+    """レーティングのモデルをサーキットの設定と異なるものに切り替える"""
+    global MODEL
+    MODEL = rating_engine.create_model("cpt_2025", model_name)
 
 
 def init_ratings():
-    df = pd.read_csv(
-        "data/cpt_2025/all_player.tsv", sep="\t", index_col=False, encoding="utf-8"
-    )
+    """プレイヤー一覧を読み込み、PlayerIdを0始まりの連番インデックスに対応付ける
+
+    レートなどのモデルの状態は連番インデックスで引けるNumPy配列で保持する
+    """
+    df = storage.read_table("players")
 
-    pid_to_result = {}
-    for playerId, tag in zip(df["PlayerId"].tolist(), df["GamerTag"].tolist()):
-        pid_to_result[playerId] = {
-            "PlayerId": playerId,
-            "GamerTag": tag,
-            "Rating": INITIAL_RATING,
-            "WinCnt": 0,
-            "LoseCnt": 0,
-        }
-    return pid_to_result
+    player_index = pd.Index(df["PlayerId"])
+    state = MODEL.create_state(len(player_index))
+    return player_index, state
 
 
-def get_scale_factor(n: int) -> float:
-    if n == 0 or n == 1:
-        return 1
-    if n == 2:
-        return 1.5
-    return (n + 11) / 8
+def to_player_index(player_index: pd.Index, player_ids) -> np.ndarray:
+    """PlayerIdの列を連番インデックスに変換する"""
+    idx = player_index.get_indexer(player_ids)
+    if (idx < 0).any():
+        unknown_ids = pd.unique(np.asarray(player_ids)[idx < 0])
+        raise Exception(f"playerデータの無いプレイヤーIDです。{list(unknown_ids)}")
+    return idx
 
 
-def calc_diff_rating(winner_rating, loser_rating, diff_sets):
+def read_all_matches():
+    return storage.read_table("matches")
+
+
+def read_match_table() -> match_table.MatchTable:
+    """all_matches.tsvを分割して読み込みながらMatchTableに変換する
+
+    ファイル全体のDataFrameは作らない
     """
-    得失点差を考慮できるWorld Football Elo Ratingを参考
-    https://en.wikipedia.org/wiki/World_Football_Elo_Ratings
+    return match_table.MatchTable.from_frames(storage.iter_table("matches"))
+
+
+def get_event_periods(table: match_table.MatchTable, order: np.ndarray):
+    """試合をイベント毎のレーティング期間にまとめる
+
+    イベントは最初の試合が古い順に並べ、イベント内は元の順序(order)を保つ。
+    並べ替えた行番号と、各試合の期間番号を返す
     """
-    s = get_scale_factor(diff_sets)
-    expect = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
-    return round(K * s * (1 - expect))
+    events = table.frame["Event"].cat.codes.to_numpy()[order]
+    periods, _ = pd.factorize(events)
+    period_order = np.argsort(periods, kind="stable")
+    return order[period_order], periods[period_order]
 
 
-def create_rating_data():
-    print("レートを初期化")
-    pid_to_results = init_ratings()
-    print(f"{len(pid_to_results)=}")
+def calc_match_rate_diffs(
+    player_index, state, table: match_table.MatchTable, first_period=0
+):
+    """tableの試合を古い順に適用し、行の並びに対応したレート変動量(勝者側)と、
+    適用順の行番号、レート推移の記録 ((PlayerId, 試合日時, 試合後のレート)の配列) を返す
+
+    レーティング期間を使うモデルでは、期間番号はfirst_periodから始める
+    """
+    order = table.get_chronological_order()
+    periods = None
+    if MODEL.uses_periods:
+        order, periods = get_event_periods(table, order)
+        periods = periods + first_period
+
+    # テーブル内のプレイヤーインデックスをレート配列のインデックスに変換
+    table_to_rating_idx = to_player_index(player_index, table.player_ids)
+    winner_idx = table_to_rating_idx[table.frame["Player1"].to_numpy()[order]]
+    loser_idx = table_to_rating_idx[table.frame["Player2"].to_numpy()[order]]
+    matches = rating_engine.MatchArray(
+        winner_idx, loser_idx, table.calc_diff_sets()[order], periods
+    )
+
+    initial_ratings = MODEL.get_ratings(state).copy()
+    winner_diffs, loser_diffs = MODEL.replay(state, matches)
+    rate_diffs = np.empty(len(table), dtype=np.int64)
+    rate_diffs[order] = winner_diffs
+
+    winner_ratings, loser_ratings = rating_engine.calc_rating_history(
+        initial_ratings, matches, winner_diffs, loser_diffs
+    )
+    history_records = rating_history.interleave_records(
+        table.get_filled_timestamps()[order],
+        player_index[winner_idx],
+        player_index[loser_idx],
+        winner_ratings,
+        loser_ratings,
+    )
+    return rate_diffs, order, history_records
+
+
+def make_players_df(player_index, state, win_cnt, lose_cnt):
+    """プレイヤー毎のモデルの状態と勝敗数のDataFrameを作成する"""
+    players_df = pd.DataFrame(
+        {"PlayerId": player_index, "WinCnt": win_cnt, "LoseCnt": lose_cnt}
+    )
+    for key, column in MODEL.state_columns.items():
+        players_df[column] = state[key]
+    return players_df
+
+
+def load_checkpoint(checkpoint_dir=CHECKPOINT_DIR):
+    """保存済みのレートを読み込む
+
+    存在しない場合や、現在と異なるモデル・設定値で計算されている場合はNoneを返す
+    """
+    config_path = os.path.join(checkpoint_dir, "model.json")
+    players_path = os.path.join(checkpoint_dir, "players.tsv")
+    matches_path = os.path.join(checkpoint_dir, "matches.tsv")
+    if not os.path.exists(players_path) or not os.path.exists(matches_path):
+        return None
+
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        is_same_model = config == MODEL.get_config()
+    else:
+        # model.jsonが無いものはモデルの切り替えに対応する前のElo
+        config = {"model": "elo"}
+        is_same_model = MODEL.name == "elo"
+    if not is_same_model:
+        print(f"保存済みのレートは異なるモデル・設定値で計算されています。{config}")
+        return None
 
-    print("対戦結果データを読み込み")
-    matches_df = pd.read_csv(
-        "data/cpt_2025/all_matches.tsv",
+    players_df = storage.read_tsv(players_path, CHECKPOINT_PLAYER_DTYPES)
+    applied_df = storage.read_tsv(matches_path, storage.MATCH_DTYPES)
+    return players_df, applied_df
+
+
+def save_checkpoint(
+    players_df, applied_df, checkpoint_dir=CHECKPOINT_DIR, append=False
+):
+    """レートを保存する。append=Trueの場合、applied_dfは保存済みの試合に続けて追記する"""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(os.path.join(checkpoint_dir, "model.json"), "w", encoding="utf-8") as f:
+        json.dump(MODEL.get_config(), f, ensure_ascii=False, indent=2)
+    storage.write_tsv(players_df, os.path.join(checkpoint_dir, "players.tsv"))
+    if append:
+        append_checkpoint_matches(applied_df, checkpoint_dir)
+    else:
+        storage.write_tsv(
+            applied_df[MATCH_KEY_COLUMNS + ["RateDiff"]],
+            os.path.join(checkpoint_dir, "matches.tsv"),
+        )
+
+
+def append_checkpoint_matches(applied_df, checkpoint_dir=CHECKPOINT_DIR):
+    """適用済みの試合を保存済みの試合に続けて追記する"""
+    storage.format_for_tsv(applied_df[MATCH_KEY_COLUMNS + ["RateDiff"]]).to_csv(
+        os.path.join(checkpoint_dir, "matches.tsv"),
+        mode="a",
+        index=False,
+        header=False,
         sep="\t",
-        index_col=False,
+        lineterminator="\n",
         encoding="utf-8",
     )
-    print(f"{len(matches_df)=}")
 
-    print("対戦結果データを元にレートを計算")
-    rate_diffs = []
-    for row in matches_df.itertuples():
-        winer_id, loser_id = row.Player1, row.Player2
-        if winer_id not in pid_to_results or loser_id not in pid_to_results:
-            raise Exception(
-                f"playerデータの無いプレイヤーIDです。{winer_id}, {loser_id}"
-            )
 
-        diff_sets = 1
-        try:
-            diff_sets = abs(int(row.Player1Score) - int(row.Player2Score))
-        except Exception:
-            pass
-
-        diff_r = calc_diff_rating(
-            pid_to_results[winer_id]["Rating"],
-            pid_to_results[loser_id]["Rating"],
-            diff_sets,
-        )
+def verify_checkpoint(players_df, applied_df, checkpoint) -> bool:
+    """全試合から再計算した結果と保存済みのレートが一致するか確認する"""
+    cp_players_df, cp_applied_df = checkpoint
 
-        pid_to_results[winer_id]["Rating"] += diff_r
-        pid_to_results[loser_id]["Rating"] -= diff_r
+    merged_players = cp_players_df.merge(
+        players_df, on="PlayerId", how="left", suffixes=("_cp", "")
+    )
+    is_mismatch = np.zeros(len(merged_players), dtype=bool)
+    for column in ["WinCnt", "LoseCnt"] + list(MODEL.state_columns.values()):
+        is_mismatch |= (
+            merged_players[f"{column}_cp"] != merged_players[column]
+        ).to_numpy()
+    player_mismatch = merged_players[is_mismatch]
+
+    merged_matches = cp_applied_df.merge(
+        applied_df[MATCH_KEY_COLUMNS + ["RateDiff"]],
+        on=MATCH_KEY_COLUMNS,
+        how="left",
+        suffixes=("_cp", ""),
+    )
+    # RateDiffはnullable整数 (Int64) のため、比較できない (片方が空の) 試合も不一致とする
+    match_mismatch = merged_matches[
+        (merged_matches["RateDiff_cp"] != merged_matches["RateDiff"]).fillna(True)
+    ]
 
-        pid_to_results[winer_id]["WinCnt"] += 1
-        pid_to_results[loser_id]["LoseCnt"] += 1
+    print(f"{len(player_mismatch)=}, {len(match_mismatch)=}")
+    return len(player_mismatch) == 0 and len(match_mismatch) == 0
 
-        rate_diffs.append(diff_r)
 
+def save_rating_table(players_df, state):
     print("レートデータ作成")
-    ratings_df = pd.DataFrame(pid_to_results.values())
+    # Glicko-2ではRating, RD, Volatilityの列になる
+    outputs = MODEL.get_outputs(state)
+    ratings_df = pd.DataFrame(outputs).assign(
+        PlayerId=players_df["PlayerId"].to_numpy(),
+        WinCnt=players_df["WinCnt"].to_numpy(),
+        LoseCnt=players_df["LoseCnt"].to_numpy(),
+    )
     ratings_df = ratings_df.sort_values(by=["Rating"], ascending=False)
     ratings_df = ratings_df[
-        [
-            "Rating",
+        list(outputs.keys())
+        + [
             # "GamerTag",
             "PlayerId",
             "WinCnt",
@@ -96,24 +238,358 @@ def create_rating_data():
     ]
     print(f"{len(ratings_df)=}")
 
-    print("レートデータをTSVファイルに出力")
-    ratings_df.to_csv(
-        "data/cpt_2025/player_ratings.tsv",
-        index=False,
-        sep="\t",
-        lineterminator="\n",
-        encoding="utf-8",
-    )
+    print("レートデータをファイルに出力")
+    storage.write_table("ratings", ratings_df)
+
+
+def save_rating_data(players_df, state, matches_df, rate_diffs):
+    save_rating_table(players_df, state)
 
-    print("レート差分をmatchesに付加してTSVファイルに出力")
+    print("レート差分をmatchesに付加してファイルに出力")
     matches_df["RateDiff"] = rate_diffs
-    matches_df.to_csv(
-        "data/cpt_2025/all_matches.tsv",
-        index=False,
+    storage.write_table("matches", matches_df)
+
+
+def read_unapplied_head():
+    """all_matches.tsvの先頭に並ぶ、RateDiffが空の (未適用の) 試合を読み込む
+
+    merge_all_events_dataで追加された試合はRateDiffが空になる。
+    ファイルは新しい順のため、未適用の試合が適用済みの試合より新しければ先頭に並ぶ。
+    (未適用の試合, 適用済みの試合数)を返す。
+    RateDiffの列が無い場合や、未適用の試合が先頭以外にもある場合はNoneを返す
+    """
+    tsv_path, dtypes = storage.TABLES["matches"]
+    if "RateDiff" not in pd.read_csv(tsv_path, sep="\t", nrows=0).columns:
+        return None
+    is_new = (
+        pd.read_csv(tsv_path, sep="\t", usecols=["RateDiff"])["RateDiff"]
+        .isna()
+        .to_numpy()
+    )
+    new_cnt = int(is_new.sum())
+    if not is_new[:new_cnt].all():
+        return None
+    new_df = storage.read_tsv(tsv_path, dtypes, nrows=new_cnt)
+    return new_df.drop(columns=["RateDiff"]), len(is_new) - new_cnt
+
+
+def write_event_run(event_path, entry, rate_diffs, run_path):
+    """イベントのmatches.tsvにレート変動量 (行番号毎の配列) を付けて、
+    all_matches.tsvと同じ形式で日時の降順 (日時の不明な試合は最後) に書き出す
+
+    日時の降順に並んだファイルは分割して読み込む。
+    それ以外のファイルは全体を読み込んで並べ替える
+    """
+    chunks = pd.read_csv(
+        event_path,
         sep="\t",
-        lineterminator="\n",
+        index_col=False,
         encoding="utf-8",
+        chunksize=storage.READ_CHUNK_SIZE if entry["order"] == "desc" else None,
+    )
+    if entry["order"] != "desc":
+        chunks = [
+            storage.apply_dtypes(chunks, storage.MATCH_DTYPES).sort_values(
+                by="Datetime(UTC)", ascending=False, kind="stable"
+            )
+        ]
+
+    missing_dfs = []
+    os.makedirs(os.path.dirname(run_path), exist_ok=True)
+    with open(run_path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk = storage.apply_dtypes(chunk, storage.MATCH_DTYPES).assign(
+                RateDiff=rate_diffs[chunk.index.to_numpy()]
+            )
+            is_missing = chunk["Datetime(UTC)"].isna()
+            missing_dfs.append(chunk[is_missing])
+            storage.format_for_tsv(chunk[~is_missing]).to_csv(
+                f, index=False, header=i == 0, sep="\t", lineterminator="\n"
+            )
+        for missing_df in missing_dfs:
+            storage.format_for_tsv(missing_df).to_csv(
+                f, index=False, header=False, sep="\t", lineterminator="\n"
+            )
+
+
+def stream_match_rate_diffs(player_index, state, applied_path, runs_dir):
+    """イベント毎のmatches.tsvを古い順に1試合ずつ読み込みながらレートを計算する
+
+    適用した試合のキーとレート変動量は適用順にapplied_pathへ書き出す。
+    イベントの全試合を適用した時点で、そのイベントの試合をレート変動量付きで
+    runs_dirに書き出す (write_event_run)。
+    プレイヤー毎の勝ち数と負け数の配列、レート推移の記録、
+    書き出したイベント毎のファイルのパスのリストを返す
+    """
+    id_to_index = dict(zip(player_index.tolist(), range(len(player_index))))
+    win_cnt = np.zeros(len(player_index), dtype=np.int64)
+    lose_cnt = np.zeros(len(player_index), dtype=np.int64)
+    pending = collections.deque()  # モデルに渡し、まだ結果を受け取っていない試合
+
+    def to_model_input(match_iter):
+        period, last_event = -1, None
+        for match in match_iter:
+            if match["Event"] != last_event:
+                period, last_event = period + 1, match["Event"]
+            winner = id_to_index.get(int(match["Player1"]))
+            loser = id_to_index.get(int(match["Player2"]))
+            if winner is None or loser is None:
+                unknown_ids = [match["Player1"], match["Player2"]]
+                raise Exception(f"playerデータの無いプレイヤーIDです。{unknown_ids}")
+            win_cnt[winner] += 1
+            lose_cnt[loser] += 1
+            pending.append((match, winner, loser))
+            diff_sets = match_table.calc_diff_set(
+                match["Player1Score"], match["Player2Score"]
+            )
+            yield winner, loser, diff_sets, period
+
+    event_files = match_stream.list_event_files()
+    entries = {path: entry for _, path, entry in event_files}
+    # 適用中のイベントのパスから、(行番号毎のレート変動量, 適用済みの試合数)への辞書
+    event_diffs = {}
+    run_paths = []
+
+    ratings = MODEL.get_ratings(state).tolist()
+    history_ids, history_timestamps, history_ratings = [], [], []
+    match_iter = match_stream.iter_all_matches(
+        by_event=MODEL.uses_periods, event_files=event_files
+    )
+    os.makedirs(os.path.dirname(applied_path), exist_ok=True)
+    with open(applied_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(MATCH_KEY_COLUMNS + ["RateDiff"])
+        for winner_diff, loser_diff in MODEL.replay_stream(
+            state, to_model_input(match_iter)
+        ):
+            match, winner, loser = pending.popleft()
+            writer.writerow(
+                [match[column] for column in MATCH_KEY_COLUMNS] + [winner_diff]
+            )
+
+            ratings[winner] += winner_diff
+            ratings[loser] += loser_diff
+            history_ids += [int(match["Player1"]), int(match["Player2"])]
+            history_timestamps += [match["Timestamp"], match["Timestamp"]]
+            history_ratings += [ratings[winner], ratings[loser]]
+
+            path = match["Path"]
+            if path not in event_diffs:
+                event_diffs[path] = [np.zeros(entries[path]["rows"], np.int64), 0]
+            event_diffs[path][0][match["Row"]] = winner_diff
+            event_diffs[path][1] += 1
+            if event_diffs[path][1] == entries[path]["rows"]:
+                run_path = os.path.join(runs_dir, f"{len(run_paths)}.tsv")
+                write_event_run(path, entries[path], event_diffs.pop(path)[0], run_path)
+                run_paths.append(run_path)
+
+    return (
+        win_cnt,
+        lose_cnt,
+        (history_ids, history_timestamps, history_ratings),
+        run_paths,
+    )
+
+
+def create_rating_data(verify=False, stream=False):
+    """全試合を初期レートから再計算する
+
+    verify=Trueの場合、保存済みのレートと再計算結果が一致するか確認する
+    stream=Trueの場合、all_matches.tsvの代わりにイベント毎のmatches.tsvを
+    古い順に1試合ずつ読み込みながら計算し (match_stream)、
+    all_matches.tsvはレート変動量を付けたイベント毎のファイルを日時の降順に
+    k-way mergeして作り直す
+    """
+    print("レートを初期化")
+    player_index, state = init_ratings()
+    print(f"{len(player_index)=}")
+
+    if stream:
+        print("イベント毎の試合結果を古い順に読み込みながらレートを計算")
+        applied_path = os.path.join(CHECKPOINT_DIR, "matches.tsv.tmp")
+        runs_dir = os.path.join(CHECKPOINT_DIR, "runs.tmp")
+        win_cnt, lose_cnt, history_records, run_paths = stream_match_rate_diffs(
+            player_index, state, applied_path, runs_dir
+        )
+        players_df = make_players_df(player_index, state, win_cnt, lose_cnt)
+        # イベントの追加・削除がall_matches.tsvに反映されていない場合、
+        # 次回のmerge_all_events_dataで試合が重複・欠落するため作り直さない
+        if len(history_records[0]) // 2 != storage.count_rows("matches"):
+            shutil.rmtree(runs_dir, ignore_errors=True)
+            os.remove(applied_path)
+            raise Exception(
+                "all_matches.tsvとイベント毎のmatches.tsvの試合が一致しません。"
+                "merge_all_events_dataを実行してください。"
+            )
+        # 確認する場合だけ、適用済みの試合の全体を読み込む
+        applied_df = storage.read_tsv(applied_path, storage.MATCH_DTYPES, nrows=0)
+        if verify:
+            applied_df = storage.read_tsv(applied_path, storage.MATCH_DTYPES)
+    else:
+        print("対戦結果データを読み込み")
+        table = read_match_table()
+        print(f"{len(table)=}")
+
+        print("対戦結果データを元にレートを計算")
+        rate_diffs, order, history_records = calc_match_rate_diffs(
+            player_index, state, table
+        )
+
+        win_cnt, lose_cnt = player_stats.count_results(
+            to_player_index(player_index, table.get_player1_ids()),
+            to_player_index(player_index, table.get_player2_ids()),
+            len(player_index),
+        )
+        players_df = make_players_df(player_index, state, win_cnt, lose_cnt)
+
+        # レート変動量を付加して出力するため、ここでDataFrameに戻す
+        matches_df = storage.apply_dtypes(table.to_frame(), storage.MATCH_DTYPES)
+        del table
+        applied_df = matches_df[MATCH_KEY_COLUMNS].iloc[order]
+        applied_df = applied_df.assign(RateDiff=rate_diffs[order])
+
+    if verify:
+        checkpoint = load_checkpoint()
+        if checkpoint is None:
+            print("保存済みのレートが無いため確認をスキップ")
+        elif verify_checkpoint(players_df, applied_df, checkpoint):
+            print("保存済みのレートは再計算結果と一致しました")
+        else:
+            print(
+                "保存済みのレートが再計算結果と一致しません。再計算結果で上書きします"
+            )
+
+    if stream:
+        save_rating_table(players_df, state)
+        print("レート差分を付加したイベント毎の試合結果をまとめてファイルに出力")
+        storage.merge_sorted_files("matches", run_paths)
+        shutil.rmtree(runs_dir, ignore_errors=True)
+
+        # 適用済みの試合は分割して読み込みながら保存する
+        save_checkpoint(players_df, applied_df.iloc[:0])
+        with pd.read_csv(
+            applied_path,
+            sep="\t",
+            index_col=False,
+            encoding="utf-8",
+            chunksize=storage.READ_CHUNK_SIZE,
+        ) as reader:
+            for chunk in reader:
+                append_checkpoint_matches(
+                    storage.apply_dtypes(chunk, storage.MATCH_DTYPES)
+                )
+        os.remove(applied_path)
+    else:
+        save_rating_data(players_df, state, matches_df, rate_diffs)
+        save_checkpoint(players_df, applied_df)
+    print("レート推移をファイルに出力")
+    rating_history.RatingHistory.from_records(
+        *history_records, MODEL.initial_rating
+    ).save()
+
+
+def update_rating_data():
+    """保存済みのレートに未適用の試合だけを適用する
+
+    未適用の試合が適用済みの最後の試合より前に行われている場合や、
+    適用済みの試合がall_matches.tsvから消えている場合は全試合を再計算する。
+    レーティング期間を使うモデルでは、適用済みのイベントに試合が追加された場合も再計算する
+
+    未適用の試合がall_matches.tsvの先頭にRateDiffが空の行として並んでいる場合
+    (merge_all_events_dataでイベントを追加した場合) は、その行だけを読み込み、
+    RateDiffを付けて書き直す。それ以外の行と保存済みのレートの試合は読み書きしない
+    """
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        print("保存済みのレートが無いため全試合から計算")
+        return create_rating_data()
+    cp_players_df, cp_applied_df = checkpoint
+    history = rating_history.RatingHistory.load()
+    if history is None:
+        print("保存済みのレート推移が無いため全試合から計算")
+        return create_rating_data()
+
+    print("未適用の試合を読み込み")
+    unapplied_head = read_unapplied_head()
+    if unapplied_head is not None and unapplied_head[1] == len(cp_applied_df):
+        new_df = unapplied_head[0]
+        matches_df = None
+        print(f"未適用の試合数={len(new_df)} (all_matches.tsvの先頭)")
+    else:
+        print("対戦結果データを読み込み")
+        matches_df = read_all_matches().drop(columns=["RateDiff"], errors="ignore")
+        try:
+            matches_df = matches_df.merge(
+                cp_applied_df, on=MATCH_KEY_COLUMNS, how="left", validate="one_to_one"
+            )
+        except pd.errors.MergeError:
+            print("試合キーが重複している試合があるため全試合から再計算")
+            return create_rating_data()
+        is_new = matches_df["RateDiff"].isna().to_numpy()
+        print(f"{len(matches_df)=}, 未適用の試合数={is_new.sum()}")
+
+        if len(matches_df) - is_new.sum() != len(cp_applied_df):
+            print("適用済みの試合が見つからないため全試合から再計算")
+            return create_rating_data()
+        new_df = matches_df[is_new]
+
+    if len(new_df) > 0 and len(cp_applied_df) > 0:
+        last_key = cp_applied_df.loc[cp_applied_df["Datetime(UTC)"].idxmax()]
+        if new_df["Datetime(UTC)"].min() <= last_key["Datetime(UTC)"]:
+            print(
+                f"適用済みの試合 {last_key.to_dict()} より前の試合があるため全試合から再計算"
+            )
+            return create_rating_data()
+        if MODEL.uses_periods and new_df["Event"].isin(cp_applied_df["Event"]).any():
+            print("適用済みのイベントに試合が追加されたため全試合から再計算")
+            return create_rating_data()
+
+    print("保存済みのレートを読み込み")
+    player_index, state = init_ratings()
+    cp_players_df = cp_players_df.set_index("PlayerId").reindex(player_index)
+    for key, column in MODEL.state_columns.items():
+        # 保存後に追加されたプレイヤーは初期状態のまま
+        values = cp_players_df[column]
+        state[key][:] = values.where(values.notna(), state[key]).to_numpy()
+
+    print("未適用の試合からレートを計算")
+    new_rate_diffs, order, history_records = calc_match_rate_diffs(
+        player_index,
+        state,
+        match_table.MatchTable.from_frame(new_df),
+        first_period=cp_applied_df["Event"].nunique(dropna=False),
+    )
+
+    new_win_cnt, new_lose_cnt = player_stats.count_results(
+        to_player_index(player_index, new_df["Player1"]),
+        to_player_index(player_index, new_df["Player2"]),
+        len(player_index),
     )
+    players_df = make_players_df(
+        player_index,
+        state,
+        cp_players_df["WinCnt"].fillna(0).to_numpy(np.int64) + new_win_cnt,
+        cp_players_df["LoseCnt"].fillna(0).to_numpy(np.int64) + new_lose_cnt,
+    )
+    new_applied_df = new_df[MATCH_KEY_COLUMNS].iloc[order]
+    new_applied_df = new_applied_df.assign(RateDiff=new_rate_diffs[order])
+
+    if matches_df is None:
+        save_rating_table(players_df, state)
+        if len(new_df) > 0:
+            print("未適用だった試合にレート差分を付加してファイルに出力")
+            storage.insert_rows(
+                "matches",
+                new_df.assign(RateDiff=new_rate_diffs),
+                drop_head=len(new_df),
+            )
+    else:
+        rate_diffs = matches_df["RateDiff"].to_numpy(copy=True)
+        rate_diffs[is_new] = new_rate_diffs
+        save_rating_data(players_df, state, matches_df, rate_diffs.astype(np.int64))
+    save_checkpoint(players_df, new_applied_df, append=True)
+    print("レート推移をファイルに出力")
+    history.append(*history_records).save()
 
 
 if __name__ == "__main__":
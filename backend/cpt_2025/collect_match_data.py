@@ -1,19 +1,50 @@
-import datetime
+import contextlib
+import csv
+import heapq
 import os
-import re
-import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import match_table
+import numpy as np
 import pandas as pd
 import startgg
 
 PER_PAGE = 20  # 1ページあたりの取得セット数 (API上限に注意。通常50-100)
+PAGE_CHECKPOINT_DIR = "data/startgg_pages"  # 取得途中のページの保存先
+# 取得途中の試合データのファイルで、TSVファイルの列の後に持つ列
+PARTIAL_KEY_COLUMNS = ["SetId", "PhaseGroupIndex", "Page", "Position", "CompletedAt"]
+# 同じセットを複数回取得した場合に、最初に取得したものを判定する列
+PARTIAL_ORDER_COLUMNS = ["PhaseGroupIndex", "Page", "Position"]
+# 取得途中の試合データを一度に読み込む行数
+FINALIZE_CHUNK_SIZE = 8192
 
 # --- GraphQL クエリ ---
-QUERY_SETS = """
-query EventSets($eventSlug: String!, $page: Int!, $perPage: Int!) {
+# start.ggは1クエリあたり10,000セットまでしか取得できないため、
+# イベントのセットはphaseGroup (プール) 単位に分割して取得する
+QUERY_EVENT_PHASE_GROUPS = """
+query EventPhaseGroups($eventSlug: String!) {
   event(slug: $eventSlug) {
     id
     name
+    state # COMPLETEDのイベントはレスポンスを無期限にキャッシュする
+    phaseGroups {
+      id
+    }
+  }
+}
+"""
+
+QUERY_PHASE_GROUP_SETS = """
+query PhaseGroupSets($phaseGroupId: ID!, $page: Int!, $perPage: Int!) {
+  phaseGroup(id: $phaseGroupId) {
+    id
+    phase {
+      event {
+        state # COMPLETEDのイベントはレスポンスを無期限にキャッシュする
+      }
+    }
     sets(
       page: $page
       perPage: $perPage
@@ -69,258 +100,575 @@ query EventSets($eventSlug: String!, $page: Int!, $perPage: Int!) {
 """
 
 
-def parse_scores(display_score_str, winner_id, p1_id, p2_id, p1_name, p2_name):
+def has_both_entrants(set_node) -> bool:
+    """BYEなどプレイヤー情報が不完全なセットはFalse"""
+    slots = set_node.get("slots")
+    return bool(
+        slots
+        and len(slots) >= 2
+        and slots[0].get("entrant")
+        and slots[1].get("entrant")
+    )
+
+
+def flatten_set_nodes(set_nodes):
+    """セットのノードを列毎の配列に変換する
+
+    BYEなどプレイヤー情報が不完全なセットは除く。キャラクター選択は
+    (セットの行番号, EntrantのID, キャラクター名) の縦持ちの配列として返す
     """
-    displayScore文字列からスコアを抽出し、プレイヤー1とプレイヤー2のスコアを返す。
-    DQやForfeitも考慮する。
+    set_nodes = [node for node in set_nodes if has_both_entrants(node)]
+    entrants1 = [node["slots"][0]["entrant"] for node in set_nodes]
+    entrants2 = [node["slots"][1]["entrant"] for node in set_nodes]
+    phases = [(node.get("phaseGroup") or {}).get("phase") or {} for node in set_nodes]
+
+    def to_array(values):
+        return np.array(values, dtype=object)
+
+    columns = {
+        "completedAt": to_array([node.get("completedAt") for node in set_nodes]),
+        "displayScore": to_array(
+            [node.get("displayScore", "N/A") for node in set_nodes]
+        ),
+        "winnerId": to_array([node.get("winnerId") for node in set_nodes]),
+        "fullRoundText": to_array(
+            [node.get("fullRoundText", "N/A") for node in set_nodes]
+        ),
+        "phaseName": to_array([phase.get("name") or "" for phase in phases]),
+        "entrant1Id": to_array([entrant["id"] for entrant in entrants1]),
+        "entrant2Id": to_array([entrant["id"] for entrant in entrants2]),
+        "entrant1Name": to_array([entrant["name"] for entrant in entrants1]),
+        "entrant2Name": to_array([entrant["name"] for entrant in entrants2]),
+        "player1Id": to_array(
+            [entrant["participants"][0]["player"]["id"] for entrant in entrants1]
+        ),
+        "player2Id": to_array(
+            [entrant["participants"][0]["player"]["id"] for entrant in entrants2]
+        ),
+    }
+
+    selections = [
+        (row, selection["entrant"]["id"], selection["character"]["name"])
+        for row, node in enumerate(set_nodes)
+        for game in node.get("games") or []
+        for selection in game.get("selections") or []
+        if selection.get("character") and selection["character"].get("name")
+    ]
+    rows, entrant_ids, characters = zip(*selections) if selections else ([], [], [])
+    return columns, {
+        "row": np.array(rows, dtype=np.int64),
+        "entrantId": to_array(entrant_ids),
+        "character": to_array(characters),
+    }
+
+
+def to_id_array(values) -> np.ndarray:
+    """IDの配列をint64に変換する。Noneなど不明な値は0"""
+    return (
+        pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+        .fillna(0)
+        .to_numpy(np.int64)
+    )
+
+
+def parse_scores(display_scores, winner_ids, p1_ids, p2_ids, p1_names, p2_names):
+    """displayScoreの配列からスコアを抽出し、
+    (P1の数値スコア, P1のスコアの種類, P2の数値スコア, P2のスコアの種類) の配列を返す
+
+    P1, P2はslotsの順。スコアの種類はmatch_table.OUTCOME_*で、DQやForfeitも考慮する
     """
-    s1, s2 = "N/A", "N/A"
-    ds_upper = display_score_str.upper()
+    display_scores = pd.Series(display_scores, dtype=object).fillna("N/A")
+    ds_upper = display_scores.str.upper()
+    n = len(display_scores)
+    p1_wins = (winner_ids == p1_ids) & (winner_ids != 0)
+    p2_wins = (winner_ids == p2_ids) & (winner_ids != 0) & ~p1_wins
+    no_winner = ~p1_wins & ~p2_wins
+
+    values1 = np.zeros(n, dtype=np.int64)
+    values2 = np.zeros(n, dtype=np.int64)
+    outcomes1 = np.full(n, match_table.OUTCOME_UNKNOWN, dtype=np.int8)
+    outcomes2 = np.full(n, match_table.OUTCOME_UNKNOWN, dtype=np.int8)
+
+    def assign(mask, outcome1, outcome2):
+        outcomes1[mask] = outcome1
+        outcomes2[mask] = outcome2
 
     # DQ (Disqualified) や FF (Forfeit) の処理
-    is_special_case = False
-    if "DQ" in ds_upper or "DISQUALIFIED" in ds_upper or "FORFEIT" in ds_upper:
-        is_special_case = True
-        if winner_id == p1_id:
-            s1, s2 = "W (DQ/FF)", "L (DQ/FF)"
-        elif winner_id == p2_id:
-            s1, s2 = "L (DQ/FF)", "W (DQ/FF)"
-        else:  # winnerIdが不明な場合
-            p1_mentioned = p1_name.upper() in ds_upper
-            p2_mentioned = p2_name.upper() in ds_upper
-            if p1_mentioned and not p2_mentioned:  # P1がDQ/FFと推定
-                s1, s2 = "L (DQ/FF)", "W (DQ/FF)"
-            elif p2_mentioned and not p1_mentioned:  # P2がDQ/FFと推定
-                s1, s2 = "W (DQ/FF)", "L (DQ/FF)"
-            else:  # 判断不可
-                s1, s2 = "DQ/FF", "DQ/FF"
-
-    if not is_special_case:
-        # 数値スコアの抽出を試みる (例: "3 - 0", "PlayerA 2 - 1 PlayerB")
-        score_numbers = re.findall(
-            r"\b\d+\b", display_score_str
-        )  # 単語境界を含む数字のみ
-        if len(score_numbers) == 2:
-            val1, val2 = int(score_numbers[0]), int(score_numbers[1])
-            if winner_id == p1_id:  # Player 1 is winner
-                s1, s2 = max(val1, val2), min(val1, val2)
-            elif winner_id == p2_id:  # Player 2 is winner
-                s1, s2 = min(val1, val2), max(val1, val2)
-            else:  # winnerIdがない場合、スコアの出現順で仮に割り当て
-                # (slotsの順序で左側がp1なら、displayScoreの左側がs1)
-                # この部分はAPIのslots配列の順序とdisplayScoreの関連が不明なため、確実ではない。
-                # 一般的には displayScore の左側が slot[0]、右側が slot[1] に対応することが多い。
-                # 今回はp1_id,p2_idとslotsの対応は別途行うため、winnerIdがない場合は
-                # スコアの大小関係だけでは割り当てられない。
-                # displayScore文字列内のプレイヤー名の位置で判断も可能だが複雑になる。
-                # ここでは単純にval1, val2をs1, s2に割り当てる (後でp1/p2に正しく振る)
-                s1, s2 = val1, val2  # この時点では順序は仮
-        elif winner_id:  # 数値スコアが取れないが勝者がいる場合
-            if winner_id == p1_id:
-                s1, s2 = "W", "L"
-            elif winner_id == p2_id:
-                s1, s2 = "L", "W"
-
-    return s1, s2
-
-
-def get_all_matches_data(event_slug, event_name):
-    """指定されたイベントの全試合データを取得する"""
-    all_matches = []
-    current_page = 1
-    total_pages = 1  # 初回リクエストで更新
+    is_special_case = ds_upper.str.contains("DQ|DISQUALIFIED|FORFEIT").to_numpy()
+    dq_win, dq_lose = match_table.OUTCOME_DQ_WIN, match_table.OUTCOME_DQ_LOSE
+    assign(is_special_case & p1_wins, dq_win, dq_lose)
+    assign(is_special_case & p2_wins, dq_lose, dq_win)
+    # winnerIdが不明な場合、displayScoreに名前の含まれる方がDQ/FFと推定する
+    unknown_rows = np.flatnonzero(is_special_case & no_winner)
+    upper_list = ds_upper.tolist()
+    p1_mentioned = np.zeros(n, dtype=bool)
+    p2_mentioned = np.zeros(n, dtype=bool)
+    for i in unknown_rows.tolist():
+        p1_mentioned[i] = p1_names[i].upper() in upper_list[i]
+        p2_mentioned[i] = p2_names[i].upper() in upper_list[i]
+    unknown = is_special_case & no_winner
+    assign(unknown, match_table.OUTCOME_DQ, match_table.OUTCOME_DQ)
+    assign(unknown & p1_mentioned & ~p2_mentioned, dq_lose, dq_win)
+    assign(unknown & p2_mentioned & ~p1_mentioned, dq_win, dq_lose)
+
+    # 数値スコアの抽出 (例: "3 - 0", "PlayerA 2 - 1 PlayerB")。単語境界を含む数字のみ
+    score_numbers = display_scores.str.findall(r"\b\d+\b")
+    has_scores = ~is_special_case & (score_numbers.str.len() == 2).to_numpy()
+    numbers = score_numbers[has_scores]
+    val1 = np.zeros(n, dtype=np.int64)
+    val2 = np.zeros(n, dtype=np.int64)
+    # int64に収まらない桁数の数字もあるため、int8の範囲外の値はSCORE_MAX + 1にそろえる
+    # (match_table.MatchTable.from_encodedでスコアの種類が不明になる)
+    for values, position in [(val1, 0), (val2, 1)]:
+        values[has_scores] = (
+            pd.to_numeric(numbers.str[position])
+            .clip(upper=match_table.SCORE_MAX + 1)
+            .to_numpy(np.int64)
+        )
+    high, low = np.maximum(val1, val2), np.minimum(val1, val2)
+    # 勝者が分かる場合は勝者側を大きいスコアとし、分からない場合は出現順とする
+    values1[has_scores] = np.where(p1_wins, high, np.where(p2_wins, low, val1))[
+        has_scores
+    ]
+    values2[has_scores] = np.where(p1_wins, low, np.where(p2_wins, high, val2))[
+        has_scores
+    ]
+    assign(has_scores, match_table.OUTCOME_SCORE, match_table.OUTCOME_SCORE)
+
+    # 数値スコアが取れないが勝者がいる場合
+    no_scores = ~is_special_case & ~has_scores
+    assign(no_scores & p1_wins, match_table.OUTCOME_WIN, match_table.OUTCOME_LOSE)
+    assign(no_scores & p2_wins, match_table.OUTCOME_LOSE, match_table.OUTCOME_WIN)
+
+    return values1, outcomes1, values2, outcomes2
+
+
+def aggregate_characters(selections, entrant1_ids, entrant2_ids):
+    """セット毎の各プレイヤーの使用キャラクターを名前順に", "で結合した配列を返す
+
+    キャラクター選択の無いプレイヤーは"N/A"。
+    (セット, プレイヤー) 毎の使用キャラクターの集合をビットマスクで表し、
+    同じ組み合わせの文字列は1回だけ作成する
+    """
+    n = len(entrant1_ids)
+    rows = selections["row"]
+    entrant_ids = to_id_array(selections["entrantId"])
+    side = np.where(
+        entrant_ids == entrant1_ids[rows],
+        0,
+        np.where(entrant_ids == entrant2_ids[rows], 1, -1),
+    )
+    is_player = side >= 0
+    # キャラクター名の辞書順の番号
+    names, codes = np.unique(
+        selections["character"][is_player].astype(str), return_inverse=True
+    )
+    # 64キャラクターを超える場合はPythonの整数 (任意精度) でビットマスクを作る
+    mask_dtype = np.uint64 if len(names) <= 64 else object
+    bits = np.array([1 << code for code in range(len(names))], dtype=mask_dtype)
+
+    masks = np.zeros(2 * n, dtype=mask_dtype)
+    np.bitwise_or.at(masks, rows[is_player] * 2 + side[is_player], bits[codes])
+    unique_masks, inverse = np.unique(masks, return_inverse=True)
+    labels = np.array(
+        [
+            ", ".join(names[k] for k in range(len(names)) if int(mask) >> k & 1)
+            or "N/A"
+            for mask in unique_masks.tolist()
+        ],
+        dtype=object,
+    )
+    chars = labels[inverse].reshape(n, 2)
+    return chars[:, 0], chars[:, 1]
+
+
+def normalize_set_nodes(set_nodes, event_name) -> match_table.MatchTable:
+    """セットのノードのリストをmatch_table.MatchTableに変換する
+
+    ノードを列毎の配列にしてから、スコアの抽出・勝者側への入れ替え・
+    キャラクターの集計を配列単位で行う。Player1が勝者となるように並べる
+    """
+    columns, selections = flatten_set_nodes(set_nodes)
+    entrant1_ids = to_id_array(columns["entrant1Id"])
+    entrant2_ids = to_id_array(columns["entrant2Id"])
+    winner_ids = to_id_array(columns["winnerId"])
+
+    score1, outcome1, score2, outcome2 = parse_scores(
+        columns["displayScore"],
+        winner_ids,
+        entrant1_ids,
+        entrant2_ids,
+        columns["entrant1Name"],
+        columns["entrant2Name"],
+    )
+    chars1, chars2 = aggregate_characters(selections, entrant1_ids, entrant2_ids)
+    player1_ids = to_id_array(columns["player1Id"])
+    player2_ids = to_id_array(columns["player2Id"])
+
+    # 試合日時。不明な場合はmatch_table.MISSING_TIMESTAMP
+    completed_at = to_id_array(columns["completedAt"])
+    timestamps = np.where(
+        completed_at != 0, completed_at, match_table.MISSING_TIMESTAMP
+    )
+
+    # Player1が勝者となるように入れ替える
+    swap = (
+        (winner_ids == entrant2_ids) & (winner_ids != 0) & (winner_ids != entrant1_ids)
+    )
+
+    def winner_first(values1, values2):
+        return np.where(swap, values2, values1), np.where(swap, values1, values2)
+
+    player1_ids, player2_ids = winner_first(player1_ids, player2_ids)
+    score1, score2 = winner_first(score1, score2)
+    outcome1, outcome2 = winner_first(outcome1, outcome2)
+    chars1, chars2 = winner_first(chars1, chars2)
+
+    return match_table.MatchTable.from_encoded(
+        timestamps,
+        player1_ids,
+        player2_ids,
+        score1,
+        outcome1,
+        score2,
+        outcome2,
+        {
+            "Event": np.full(len(timestamps), event_name, dtype=object),
+            "Bracket": pd.Series(columns["phaseName"], dtype=object).str.strip(),
+            "Round": columns["fullRoundText"],
+            "Player1Chars": chars1,
+            "Player2Chars": chars2,
+        },
+    )
+
+
+def get_page_checkpoint_dir(event_name):
+    return os.path.join(PAGE_CHECKPOINT_DIR, event_name, "sets")
+
 
+def get_event_phase_groups(event_slug):
+    """イベントの状態 (state) とphaseGroupのIDのリストを返す"""
+    data = startgg.run_query(QUERY_EVENT_PHASE_GROUPS, {"eventSlug": event_slug})
+    if not data or not data.get("event"):
+        raise Exception(f"イベント '{event_slug}' の情報を取得できませんでした。")
+    event = data["event"]
+    return event.get("state"), [
+        phase_group["id"] for phase_group in event["phaseGroups"] or []
+    ]
+
+
+def prepare_page_checkpoint_dir(event_name, event_state, resume=True):
+    """取得途中のページの保存先を用意して返す
+
+    保存済みのページは保存した時点のイベントの状態と共に残す。
+    完了前に保存したページは、イベントが完了 (COMPLETED) した後は内容が古いため破棄する。
+    resume=Falseの場合は常に破棄する
+    """
+    checkpoint_dir = get_page_checkpoint_dir(event_name)
+    state_path = os.path.join(checkpoint_dir, "state.txt")
+    if os.path.exists(checkpoint_dir):
+        saved_state = None
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                saved_state = f.read().strip()
+        if not resume or (event_state == "COMPLETED" and saved_state != "COMPLETED"):
+            shutil.rmtree(checkpoint_dir)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(state_path, "w", encoding="utf-8") as f:
+        f.write(f"{event_state}\n")
+    return checkpoint_dir
+
+
+def get_phase_group_set_nodes(phase_group_id, checkpoint_dir):
+    """phaseGroupの全セットを取得する。取得できなかったページがある場合はNone"""
+    pages = startgg.run_paged_query(
+        QUERY_PHASE_GROUP_SETS,
+        {"phaseGroupId": phase_group_id, "perPage": PER_PAGE},
+        lambda data: (data.get("phaseGroup") or {}).get("sets"),
+        max_workers=1,  # phaseGroup単位で並列に取得するため、ページは順に取得する
+        checkpoint_dir=os.path.join(checkpoint_dir, str(phase_group_id)),
+    )
+    if any(
+        not data or not data.get("phaseGroup") or not data["phaseGroup"].get("sets")
+        for data in pages
+    ):
+        return None
+    return [node for data in pages for node in data["phaseGroup"]["sets"]["nodes"]]
+
+
+def get_all_matches_data(event_slug, event_name, resume=True):
+    """指定されたイベントの全試合データを取得し、match_table.MatchTableで返す
+
+    phaseGroup毎に並列に取得し、セットIDで重複を除いて結合する
+    取得したページはget_page_checkpoint_dir(event_name)に保存される
+    resume=Trueの場合は保存済みのページを再利用し、残りのページだけを取得する
+    (完了前に保存したページはイベントの完了後には再利用しない)
+    全ページを取得できなかった場合は例外を送出する
+    """
     print(f"イベント '{event_slug}' の試合データを取得中...")
 
-    while current_page <= total_pages:
-        print(
-            f"  ページ {current_page}/{total_pages if total_pages > 1 else '?'} を取得中..."
+    event_state, phase_group_ids = get_event_phase_groups(event_slug)
+    checkpoint_dir = prepare_page_checkpoint_dir(event_name, event_state, resume)
+    print(f"  phaseGroup数: {len(phase_group_ids)}")
+
+    with ThreadPoolExecutor(max_workers=startgg.MAX_WORKERS) as executor:
+        phase_group_nodes = list(
+            executor.map(
+                lambda phase_group_id: get_phase_group_set_nodes(
+                    phase_group_id, checkpoint_dir
+                ),
+                phase_group_ids,
+            )
         )
-        variables = {"eventSlug": event_slug, "page": current_page, "perPage": PER_PAGE}
 
-        data = startgg.run_query(QUERY_SETS, variables)
+    failed_phase_groups = [
+        phase_group_id
+        for phase_group_id, nodes in zip(phase_group_ids, phase_group_nodes)
+        if nodes is None
+    ]
+    if failed_phase_groups:
+        raise Exception(
+            f"phaseGroup {failed_phase_groups} のデータ取得に失敗しました "
+            f"({len(phase_group_ids) - len(failed_phase_groups)}/{len(phase_group_ids)}件取得済み)。"
+            "再実行すると取得済みのページの続きから取得します。"
+        )
 
-        if not data or not data.get("event") or not data["event"].get("sets"):
-            print("  データ取得失敗、または試合情報が見つかりませんでした。")
-            break
+    id_to_node = {}
+    for nodes in phase_group_nodes:
+        for set_node in nodes:
+            id_to_node[set_node["id"]] = set_node
+    if not id_to_node:
+        print("  このイベントには完了した試合データがありません。")
+        return match_table.MatchTable.from_records([])
+
+    # 分割前と同じく、最近完了した試合から順に並べる
+    set_nodes = sorted(
+        id_to_node.values(), key=lambda node: node.get("completedAt") or 0, reverse=True
+    )
 
-        sets_page_data = data["event"]["sets"]
-        if current_page == 1:
-            total_pages = sets_page_data["pageInfo"]["totalPages"]
-            # total_items = sets_page_data["pageInfo"]["totalItems"]
-            print(f"  総ページ数: {total_pages}")
-            if total_pages == 0:
-                print("  このイベントには完了した試合データがありません。")
-                break
+    return normalize_set_nodes(set_nodes, event_name)
 
-        for set_node in sets_page_data["nodes"]:
-            if (
-                not set_node.get("slots")
-                or len(set_node["slots"]) < 2
-                or not set_node["slots"][0].get("entrant")
-                or not set_node["slots"][1].get("entrant")
-            ):
-                # print(f"    セット {set_node.get('id', 'N/A')} はプレイヤー情報が不完全なためスキップします (例: BYE)。")
-                continue
-
-            # プレイヤー情報
-            # APIのslots配列は必ずしもP1, P2の順とは限らないため、IDで識別
-            slot1_entrant = set_node["slots"][0]["entrant"]
-            slot2_entrant = set_node["slots"][1]["entrant"]
-
-            # プレイヤー自身のID
-            player1_id = slot1_entrant["participants"][0]["player"]["id"]
-            player2_id = slot2_entrant["participants"][0]["player"]["id"]
-
-            # 便宜上、slot[0] を Player 1、slot[1] を Player 2 とするが、
-            # スコア割り当ては winnerId や displayScore の内容を考慮して行う
-            p1_name = slot1_entrant["name"]
-            p1_id = slot1_entrant["id"]
-            p2_name = slot2_entrant["name"]
-            p2_id = slot2_entrant["id"]
-
-            # スコア情報
-            display_score_str = set_node.get("displayScore", "N/A")
-            winner_id = set_node.get("winnerId")
-
-            # parse_scores は (displayScore内の左側スコア, 右側スコア) を返す想定
-            # それを p1, p2 に正しく割り当てる
-            raw_score1, raw_score2 = parse_scores(
-                display_score_str, winner_id, p1_id, p2_id, p1_name, p2_name
+
+def get_partial_path(output_path):
+    return output_path.replace(".tsv", ".partial.tsv")
+
+
+class PartialMatchWriter:
+    """ページ毎に正規化した試合を、取得途中の試合データのTSVファイルに追記する
+
+    TSVファイルの列に加え、重複除去と並べ替えのためのPARTIAL_KEY_COLUMNSを持つ。
+    1ページ分の行をまとめて書き込むため、取得途中でもファイルはそのまま読み込める。
+    複数スレッドから共有して使う
+    """
+
+    def __init__(self, path, event_name):
+        self.path = path
+        self.event_name = event_name
+        self.lock = threading.Lock()
+        self.row_cnt = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write("\t".join(match_table.TSV_COLUMNS + PARTIAL_KEY_COLUMNS) + "\n")
+
+    def append(self, set_nodes, phase_group_index, page):
+        positions = [i for i, node in enumerate(set_nodes) if has_both_entrants(node)]
+        nodes = [set_nodes[i] for i in positions]
+        df = normalize_set_nodes(nodes, self.event_name).to_frame()
+        df["SetId"] = [node["id"] for node in nodes]
+        df["PhaseGroupIndex"] = phase_group_index
+        df["Page"] = page
+        df["Position"] = positions
+        df["CompletedAt"] = [node.get("completedAt") or 0 for node in nodes]
+        text = df.to_csv(index=False, header=False, sep="\t", lineterminator="\n")
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                f.write(text)
+            self.row_cnt += len(df)
+
+
+def read_partial_chunks(partial_path, usecols=None):
+    """取得途中の試合データをFINALIZE_CHUNK_SIZE行ずつ、値は文字列のまま読み込む"""
+    return pd.read_csv(
+        partial_path,
+        sep="\t",
+        index_col=False,
+        encoding="utf-8",
+        dtype=str,
+        keep_default_na=False,
+        usecols=usecols,
+        chunksize=FINALIZE_CHUNK_SIZE,
+    )
+
+
+def get_partial_keys(df) -> np.ndarray:
+    """(phaseGroupの番号, ページ, ページ内の位置)の行毎の整数の組"""
+    return df[PARTIAL_ORDER_COLUMNS].to_numpy(np.int64)
+
+
+def finalize_partial_matches(partial_path, output_path) -> int:
+    """取得途中の試合データから、セットIDで重複を除き、最近完了した試合から順に並べた
+    TSVファイルを出力する (get_all_matches_dataと同じ並び)。出力した試合数を返す
+
+    ファイル全体は読み込まない。
+    1回目の読み込みでセットID毎に最初に取得した位置の索引を作り、
+    2回目の読み込みで索引の位置の行だけを分割して並べ替えてファイルに書き出し、
+    それらを1行ずつk-way mergeして出力する
+    """
+    # セットIDから、最初に取得した(phaseGroupの番号, ページ, ページ内の位置)への辞書
+    first_keys = {}
+    with read_partial_chunks(partial_path, ["SetId"] + PARTIAL_ORDER_COLUMNS) as reader:
+        for chunk in reader:
+            for set_id, key in zip(chunk["SetId"], map(tuple, get_partial_keys(chunk))):
+                if set_id not in first_keys or key < first_keys[set_id]:
+                    first_keys[set_id] = key
+    if not first_keys:
+        return 0
+
+    # 値は文字列のまま読み込み、そのまま書き戻す
+    runs_dir = f"{output_path}.runs"
+    os.makedirs(runs_dir, exist_ok=True)
+    run_paths = []
+    with read_partial_chunks(partial_path) as reader:
+        for chunk in reader:
+            keys = get_partial_keys(chunk)
+            is_first = np.array(
+                [
+                    first_keys[set_id] == tuple(key)
+                    for set_id, key in zip(chunk["SetId"], keys)
+                ],
+                dtype=bool,
             )
+            chunk, keys = chunk[is_first], keys[is_first]
+            completed_at = chunk["CompletedAt"].to_numpy(np.int64)
+            order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0], -completed_at))
+            run_path = os.path.join(runs_dir, f"{len(run_paths)}.tsv")
+            chunk.iloc[order].to_csv(
+                run_path, index=False, encoding="utf-8", sep="\t", lineterminator="\n"
+            )
+            run_paths.append(run_path)
+
+    def get_sort_key(row):
+        return (-int(row["CompletedAt"]),) + tuple(
+            int(row[column]) for column in PARTIAL_ORDER_COLUMNS
+        )
 
-            score_p1, score_p2 = "N/A", "N/A"
-            # displayScoreが "P1Name S1 - S2 P2Name" の形式か "S1 - S2" の形式かで処理
-            # S1, S2 の順がslot[0], slot[1]に対応すると仮定
-            # スコア文字列が数値の場合は数値に変換
-            try:
-                # プレイヤー名がdisplayScoreの左側か右側かで判断する (より複雑なロジックも可能)
-                # ここではwinnerIdがあるならそれに基づいて割り当て、なければslot順と仮定
-                if winner_id == p1_id:  # p1が勝者
-                    score_p1, score_p2 = (
-                        raw_score1,
-                        raw_score2,
-                    )  # parse_scoresが勝者側にWを割り当てている
-                elif winner_id == p2_id:  # p2が勝者
-                    score_p1, score_p2 = (
-                        raw_score1,
-                        raw_score2,
-                    )  # parse_scoresが勝者側にWを割り当てている
-                else:  # winnerIdがない場合 (例: 引き分け、または特殊なスコア表示)
-                    # parse_scores が "N/A" を返しているか、"DQ/FF" など
-                    score_p1, score_p2 = raw_score1, raw_score2
-                    # もし parse_scores が純粋な数字ペアを返し、slot[0]がp1でない場合、入れ替える
-                    if (
-                        isinstance(raw_score1, int)
-                        and isinstance(raw_score2, int)
-                        and p1_id != slot1_entrant["id"]
-                    ):
-                        score_p1, score_p2 = (
-                            raw_score2,
-                            raw_score1,
-                        )  # これは不要。p1_idは常にslot1_entrant['id']のため
-
-            except ValueError:  # スコアが数値でない場合 (W/L, DQ/FFなど)
-                score_p1, score_p2 = raw_score1, raw_score2
-
-            # 試合日時
-            completed_at_unix = set_node.get("completedAt")
-            match_datetime = "N/A"
-            if completed_at_unix:
-                try:
-                    match_datetime = datetime.datetime.fromtimestamp(
-                        completed_at_unix, tz=datetime.timezone.utc
-                    ).strftime("%Y-%m-%d %H:%M:%S UTC")
-                except TypeError:
-                    match_datetime = "Invalid Timestamp"
-
-            # ブラケット名
-            bracket_name = ""
-            phase_group_node = set_node.get("phaseGroup")
+    match_cnt = 0
+    with contextlib.ExitStack() as stack:
+        readers = [
+            csv.DictReader(
+                stack.enter_context(open(path, "r", encoding="utf-8", newline="")),
+                delimiter="\t",
+            )
+            for path in run_paths
+        ]
+        dst = stack.enter_context(open(output_path, "w", encoding="utf-8", newline=""))
+        writer = csv.DictWriter(
+            dst,
+            fieldnames=match_table.TSV_COLUMNS,
+            delimiter="\t",
+            lineterminator="\n",
+            extrasaction="ignore",
+        )
+        writer.writeheader()
+        for row in heapq.merge(*readers, key=get_sort_key):
+            writer.writerow(row)
+            match_cnt += 1
+    shutil.rmtree(runs_dir)
+    return match_cnt
+
+
+def stream_matches_to_tsv(event_slug, event_name, output_path, resume=True) -> int:
+    """イベントの試合データをページ毎に正規化して取得途中のファイルに追記し、
+    全ページの取得後にoutput_pathへ出力する。出力した試合数を返す
+
+    保持するレスポンスは同時に取得しているphaseGroup毎に1ページ分になる。
+    取得途中のファイル (get_partial_path) は取得に失敗しても残り、そのまま読み込める。
+    取得したページはget_page_checkpoint_dir(event_name)に保存されるため、
+    resume=Trueで再実行すると取得済みのページは保存済みのものから追記し直す
+    """
+    print(f"イベント '{event_slug}' の試合データを1ページずつ取得中...")
+
+    event_state, phase_group_ids = get_event_phase_groups(event_slug)
+    checkpoint_dir = prepare_page_checkpoint_dir(event_name, event_state, resume)
+    print(f"  phaseGroup数: {len(phase_group_ids)}")
+
+    partial_path = get_partial_path(output_path)
+    writer = PartialMatchWriter(partial_path, event_name)
+
+    def collect_phase_group(phase_group_index):
+        """phaseGroupの全ページを追記する。取得できなかったページがある場合はFalse"""
+        phase_group_id = phase_group_ids[phase_group_index]
+        for page, data in startgg.iter_paged_query(
+            QUERY_PHASE_GROUP_SETS,
+            {"phaseGroupId": phase_group_id, "perPage": PER_PAGE},
+            lambda data: (data.get("phaseGroup") or {}).get("sets"),
+            checkpoint_dir=os.path.join(checkpoint_dir, str(phase_group_id)),
+        ):
             if (
-                phase_group_node
-                and phase_group_node.get("phase")
-                and phase_group_node["phase"].get("name")
+                not data
+                or not data.get("phaseGroup")
+                or not data["phaseGroup"].get("sets")
             ):
-                bracket_name += phase_group_node["phase"]["name"].strip()
-
-            # ラウンド名
-            round_name = set_node.get("fullRoundText", "N/A")
-
-            # 使用キャラクター情報
-            p1_chars = set()
-            p2_chars = set()
-            if set_node.get("games"):
-                for game in set_node["games"]:
-                    if game.get("selections"):
-                        for selection in game["selections"]:
-                            if selection.get("character") and selection[
-                                "character"
-                            ].get("name"):
-                                char_name = selection["character"]["name"]
-                                selected_entrant_id = selection["entrant"]["id"]
-                                if selected_entrant_id == p1_id:
-                                    p1_chars.add(char_name)
-                                elif selected_entrant_id == p2_id:
-                                    p2_chars.add(char_name)
-
-            p1_chars_str = ", ".join(sorted(list(p1_chars))) if p1_chars else "N/A"
-            p2_chars_str = ", ".join(sorted(list(p2_chars))) if p2_chars else "N/A"
-
-            if winner_id == p2_id:
-                player1_id, player2_id = player2_id, player1_id
-                p1_chars_str, p2_chars_str = p2_chars_str, p1_chars_str
-                score_p1, score_p2 = score_p2, score_p1
-
-            all_matches.append(
-                {
-                    "Event": event_name,
-                    "Player1": player1_id,
-                    "Player1Chars": p1_chars_str,
-                    "Player1Score": score_p1,
-                    "Player2": player2_id,
-                    "Player2Chars": p2_chars_str,
-                    "Player2Score": score_p2,
-                    "Datetime(UTC)": match_datetime,
-                    "Bracket": bracket_name,
-                    "Round": round_name,
-                    # "Raw Display Score": display_score_str, # デバッグ用
-                    # "Set ID": set_node.get('id') # デバッグ用
-                }
-            )
+                return False
+            writer.append(data["phaseGroup"]["sets"]["nodes"], phase_group_index, page)
+        return True
+
+    with ThreadPoolExecutor(max_workers=startgg.MAX_WORKERS) as executor:
+        succeeded = list(executor.map(collect_phase_group, range(len(phase_group_ids))))
+
+    failed_phase_groups = [
+        phase_group_id
+        for phase_group_id, ok in zip(phase_group_ids, succeeded)
+        if not ok
+    ]
+    if failed_phase_groups:
+        raise Exception(
+            f"phaseGroup {failed_phase_groups} のデータ取得に失敗しました "
+            f"({len(phase_group_ids) - len(failed_phase_groups)}/{len(phase_group_ids)}件取得済み)。"
+            f"取得済みの試合は {partial_path} にあります。"
+            "再実行すると取得済みのページの続きから取得します。"
+        )
 
-        current_page += 1
-        if current_page <= total_pages:
-            # return all_matches
-            time.sleep(startgg.REQUEST_DELAY)  # APIレート制限対策
+    if writer.row_cnt == 0:
+        os.remove(partial_path)
+        return 0
+    match_cnt = finalize_partial_matches(partial_path, output_path)
+    os.remove(partial_path)
+    return match_cnt
 
-    return all_matches
 
+def collect_in_tsv(
+    event_slug,
+    event_name,
+    save_root_dir="data/cpt_2025/events",
+    resume=True,
+    stream=False,
+):
+    """イベントの試合データを取得し、save_root_dir/event_name/matches.tsvに保存する
 
-def collect_in_tsv(event_slug, event_name, save_root_dir="data/cpt_2025/events"):
-    match_data = get_all_matches_data(event_slug, event_name)
+    stream=Trueの場合、ページ毎に正規化してファイルに追記する (stream_matches_to_tsv)
+    """
+    if stream:
+        output_file_path = os.path.join(save_root_dir, event_name, "matches.tsv")
+        match_cnt = stream_matches_to_tsv(
+            event_slug, event_name, output_file_path, resume
+        )
+        if match_cnt > 0:
+            print(f"\n取得した総試合数: {match_cnt}")
+            print(f"試合データを {output_file_path} に保存しました。")
+            shutil.rmtree(get_page_checkpoint_dir(event_name), ignore_errors=True)
+        else:
+            print("試合データを取得できませんでした。")
+        return
 
-    if match_data:
+    match_data = get_all_matches_data(event_slug, event_name, resume)
+
+    if len(match_data) > 0:
         print(f"\n取得した総試合数: {len(match_data)}")
 
-        # Pandas DataFrameに変換してCSVファイルとして保存
-        df = pd.DataFrame(match_data)
-
-        # 列の順序を整える
-        column_order = [
-            "Datetime(UTC)",
-            "Event",
-            "Bracket",
-            "Round",
-            "Player1",
-            "Player2",
-            "Player1Score",
-            "Player2Score",
-            "Player1Chars",
-            "Player2Chars",
-            # "Raw Display Score", "Set ID" # デバッグ用
-        ]
-        df = df[column_order]
+        # TSVファイルと同じ列のDataFrameに変換して保存
+        df = match_data.to_frame()
 
         save_dir = os.path.join(save_root_dir, event_name)
         os.makedirs(save_dir, exist_ok=True)
@@ -334,6 +682,7 @@ def collect_in_tsv(event_slug, event_name, save_root_dir="data/cpt_2025/events")
                 lineterminator="\n",
             )
             print(f"試合データを {output_file_path} に保存しました。")
+            shutil.rmtree(get_page_checkpoint_dir(event_name), ignore_errors=True)
         except Exception as e:
             print(f"CSVファイルへの保存中にエラーが発生しました: {e}")
 
@@ -1,5 +1,4 @@
 import os
-import time
 
 import pandas as pd
 import startgg
@@ -22,6 +21,7 @@ query EventStandings($eventSlug: String!, $page: Int!, $perPage: Int!) {
   event(slug: $eventSlug) {
     id
     name
+    state # COMPLETEDのイベントはレスポンスを無期限にキャッシュする
     entrants(query: {
       page: $page
       perPage: $perPage
@@ -55,21 +55,27 @@ def get_all_event_participants_placements(event_slug, event_name, per_page=75):
     指定されたイベントの全参加者のplayerIdとfinalPlacementを取得する。
     per_page: 1ページあたりの取得件数 (start.ggのAPIは最大100が多いが、75程度が安全)
     """
-    all_participants_info = []
-    current_page = 1
-    total_pages = 1  # 初期値。最初のレスポンスで更新される
-
     print(f"Fetching participant standings for event: {event_slug}")
 
-    while current_page <= total_pages:
-        variables = {"eventSlug": event_slug, "page": current_page, "perPage": per_page}
+    pages = startgg.run_paged_query(
+        EVENT_STANDINGS_QUERY,
+        {"eventSlug": event_slug, "perPage": per_page},
+        lambda data: (data.get("event") or {}).get("entrants"),
+    )
 
-        print(
-            f"Fetching page {current_page}{' of ' + str(total_pages) if total_pages > 1 and current_page > 1 else ''}..."
+    failed_pages = [
+        page for page, response_data in enumerate(pages, start=1) if not response_data
+    ]
+    if failed_pages:
+        # 一部のページが欠けたままplacements.tsvを書き出さないようにする
+        raise Exception(
+            f"{event_slug} の順位のページ {failed_pages} の取得に失敗しました "
+            f"({len(pages) - len(failed_pages)}/{len(pages)}ページ取得済み)。"
+            "再実行すると取得済みのページはキャッシュから読み込みます。"
         )
 
-        response_data = startgg.run_query(EVENT_STANDINGS_QUERY, variables)
-
+    all_participants_info = []
+    for current_page, response_data in enumerate(pages, start=1):
         event_data = response_data.get("event")
         if not event_data:
             print(
@@ -88,13 +94,12 @@ def get_all_event_participants_placements(event_slug, event_name, per_page=75):
                 )
             break
 
-        if current_page == 1:  # 初回リクエスト時のみページ情報等を設定
+        if current_page == 1:  # 初回リクエスト時のみページ情報等を表示
             page_info = entrants_data.get("pageInfo", {})
-            total_pages = page_info.get("totalPages", 1)
             total_entrants = page_info.get("total", 0)
             print(f"Event: {event_data.get('name')}")
             print(
-                f"Total Entrants (teams/individuals): {total_entrants}, Total Pages: {total_pages}"
+                f"Total Entrants (teams/individuals): {total_entrants}, Total Pages: {len(pages)}"
             )
             if total_entrants == 0:
                 print("No entrants registered for this event.")
@@ -120,15 +125,6 @@ def get_all_event_participants_placements(event_slug, event_name, per_page=75):
                     }
                     all_participants_info.append(participant_info)
 
-        if current_page >= total_pages:
-            break  # 全ページ取得完了
-
-        current_page += 1
-
-        # レートリミットを避けるための短い待機 (任意、必要に応じて調整)
-        # break
-        time.sleep(startgg.REQUEST_DELAY)
-
     if not all_participants_info:
         return []
 
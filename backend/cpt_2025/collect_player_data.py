@@ -1,47 +1,110 @@
 import json
-import os
-import time
 
 import pandas as pd
 import startgg
+import storage
 
-QUERY = """
-query PlayerInfo($playerId: ID!) {
-  player(id: $playerId) {
+PLAYER_FIELDS_FRAGMENT = """
+fragment PlayerFields on Player {
+  id
+  gamerTag
+  user {
     id
-    gamerTag
-    user {
-      id
-      discriminator
-      bio
-      birthday
-      location {
-        country
-      }
+    discriminator
+    bio
+    birthday
+    location {
+      country
     }
   }
 }
 """
 
+# 1プレイヤーあたりのオブジェクト数 (player, user, location)
+OBJECTS_PER_PLAYER = 3
+# 1リクエストで取得するプレイヤー数。start.ggの1リクエストあたりのオブジェクト数上限に収める
+PLAYER_BATCH_SIZE = startgg.MAX_OBJECTS_PER_REQUEST // OBJECTS_PER_PLAYER
+# 取得に失敗したバッチを再取得する回数
+BATCH_RETRY_ROUNDS = 2
 
-def get_all_player_ids(placements_tsv_path: str):
-    df_placement = pd.read_csv(
-        placements_tsv_path,
-        sep="\t",
-        encoding="utf-8",
-        index_col=False,
-        dtype={"PlayerId": "str"},
+
+def build_players_query(n_players: int) -> str:
+    """n_players人分のplayerをエイリアス(p0, p1, ...)で並べたクエリを作成する"""
+    params = ", ".join(f"$id{i}: ID!" for i in range(n_players))
+    selections = "\n".join(
+        f"  p{i}: player(id: $id{i}) {{ ...PlayerFields }}" for i in range(n_players)
+    )
+    return (
+        f"query PlayersInfo({params}) {{\n{selections}\n}}\n" + PLAYER_FIELDS_FRAGMENT
     )
-    return set(df_placement.PlayerId.unique())
+
+
+def get_all_player_ids():
+    df_placement = storage.read_table("placements")
+    return set(df_placement.PlayerId.astype("str").unique())
+
+
+def fetch_player_batches(batches: list) -> dict:
+    """プレイヤーIDのバッチ毎にまとめて取得し、プレイヤーIDから情報への辞書を返す
+
+    取得に失敗したバッチは半分に分けて最大BATCH_RETRY_ROUNDS回まで再取得する。
+    それでも失敗したプレイヤー、情報がnullのプレイヤーは辞書に含めない
+    """
+    player_id_to_data = {}
+    for retry in range(BATCH_RETRY_ROUNDS + 1):
+        if retry > 0:
+            print(
+                f"取得に失敗したプレイヤーを{len(batches)}バッチに分けて再取得 ({retry}回目)"
+            )
+        queries = [build_players_query(len(batch)) for batch in batches]
+        variables_list = [
+            {f"id{i}": player_id for i, player_id in enumerate(batch)}
+            for batch in batches
+        ]
+        # 取得済みのプレイヤー情報はplayers.tsvに保存して再取得しないため、
+        # キャッシュも期限切れにしない (再実行時にAPIを呼ばない)
+        responses = startgg.run_queries(queries, variables_list, permanent=True)
+
+        failed_batches = []
+        for batch, response in zip(batches, responses):
+            if response is None:
+                failed_batches.append(batch)
+                continue
+            for i, player_id in enumerate(batch):
+                if response.get(f"p{i}") is not None:
+                    player_id_to_data[player_id] = response[f"p{i}"]
+
+        batches = [
+            half
+            for batch in failed_batches
+            for half in (batch[: (len(batch) + 1) // 2], batch[(len(batch) + 1) // 2 :])
+            if half
+        ]
+        if not batches:
+            break
+    else:
+        failed_ids = [player_id for batch in batches for player_id in batch]
+        print(f"プレイヤー情報の取得に失敗しました。{failed_ids}")
+    return player_id_to_data
 
 
 def fetch_new_players_data(new_player_ids: list) -> list[dict]:
     country_to_code = json.load(open("data/country_code.json", "r", encoding="utf-8"))
 
+    batches = [
+        new_player_ids[i : i + PLAYER_BATCH_SIZE]
+        for i in range(0, len(new_player_ids), PLAYER_BATCH_SIZE)
+    ]
+    print(f"{len(new_player_ids)}人のプレイヤー情報を{len(batches)}リクエストで取得")
+    player_id_to_data = fetch_player_batches(batches)
+
     players_data = []
-    for i, player_id in enumerate(new_player_ids):
-        print(f"プレイヤー {player_id} の情報を取得 ({i + 1}/{len(new_player_ids)})")
-        player_data = startgg.run_query(QUERY, {"playerId": player_id})["player"]
+    for player_id in new_player_ids:
+        player_data = player_id_to_data.get(player_id)
+        if not player_data:
+            # 削除されたプレイヤーなどは情報を取得できないため、保存しない
+            print(f"プレイヤー {player_id} の情報を取得できなかったためスキップします")
+            continue
         country = ""
         birthday = ""
         if (
@@ -62,30 +125,21 @@ def fetch_new_players_data(new_player_ids: list) -> list[dict]:
                 "Birthday": birthday,
             }
         )
-        time.sleep(startgg.REQUEST_DELAY)
     return players_data
 
 
-def collect_in_tsv(
-    placements_tsv_path="data/cpt_2025/all_placements.tsv",
-    player_tsv_path="data/cpt_2025/all_player.tsv",
-):
+def collect_in_tsv():
     print("プレイヤーデータの取得処理を開始")
     print("現取得データのすべてのプレイヤーIDをリストする")
-    all_player_ids = get_all_player_ids(placements_tsv_path)
+    all_player_ids = get_all_player_ids()
     print(f"{len(all_player_ids)=}")
 
     print("データ取得済みのプレイヤーIDをリストする")
     df_player = None
     existing_player_ids = set()
-    if os.path.exists(player_tsv_path):
-        df_player = pd.read_csv(
-            player_tsv_path,
-            sep="\t",
-            encoding="utf-8",
-            index_col=False,
-            dtype={"PlayerId": "str"},
-        )
+    if storage.table_exists("players"):
+        df_player = storage.read_table("players")
+        df_player.PlayerId = df_player.PlayerId.astype("str")
         existing_player_ids = set(df_player.PlayerId.unique())
     print(f"{len(existing_player_ids)=}")
 
@@ -100,6 +154,9 @@ def collect_in_tsv(
     print("プレイヤーデータを所得")
     new_players_data = fetch_new_players_data(list(new_player_ids))
     print(f"{len(new_players_data)=}")
+    if len(new_players_data) == 0:
+        print("取得できたプレイヤーがいないため処理を終了します")
+        return
 
     df_new_player = pd.DataFrame(new_players_data)
 
@@ -124,16 +181,10 @@ def collect_in_tsv(
     df_player = df_player.sort_values(by="PlayerId")
 
     try:
-        df_player.to_csv(
-            player_tsv_path,
-            index=False,
-            encoding="utf-8",
-            sep="\t",
-            lineterminator="\n",
-        )
-        print(f"試合データを {player_tsv_path} に保存しました。")
+        storage.write_table("players", df_player)
+        print("プレイヤーデータを保存しました。")
     except Exception as e:
-        print(f"CSVファイルへの保存中にエラーが発生しました: {e}")
+        print(f"ファイルへの保存中にエラーが発生しました: {e}")
 
 
 if __name__ == "__main__":
@@ -1,61 +1,123 @@
+import json
 import os
 
 import collect_match_data
 import collect_placement_data
 import collect_player_data
 import pandas as pd
+import startgg
+import storage
+from file_signature import get_file_signature
 
+# イベント毎のファイルの読み込み結果とマニフェストの保存先
+MERGE_CACHE_DIR = "data/cpt_2025/merge_cache"
 
-def collect_event_data(event_slug: str, event_name: str):
-    collect_match_data.collect_in_tsv(event_slug, event_name)
+
+def collect_event_data(event_slug: str, event_name: str, stream: bool = False):
+    """stream=Trueの場合、試合結果はページ毎にファイルに追記しながら取得する"""
+    collect_match_data.collect_in_tsv(event_slug, event_name, stream=stream)
     collect_placement_data.collect_placements_in_tsv(event_slug, event_name)
 
 
-def merge_all_events_data(events_dir="data/cpt_2025/events"):
-    df_match = pd.DataFrame()
-    df_placement = pd.DataFrame()
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_event_tsv(path, cache_path, signature, previous):
+    """イベントのTSVを読み込む。前回から変更が無ければ読み込み済みのデータを使う"""
+    if (
+        previous
+        and previous["hash"] == signature["hash"]
+        and os.path.exists(cache_path)
+    ):
+        return pd.read_pickle(cache_path), False
+
+    df = pd.read_csv(path, index_col=False, sep="\t", encoding="utf-8")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    df.to_pickle(cache_path)
+    return df, True
+
+
+def merge_all_events_data(
+    events_dir="data/cpt_2025/events", merge_cache_dir=MERGE_CACHE_DIR
+):
+    """全イベントの試合結果・順位を1ファイルにまとめる
+
+    イベント毎のファイルのサイズ・更新時刻・ハッシュ値をマニフェストに記録し、
+    新規または変更のあったファイルだけを読み込む。
+    前回から新規イベントが追加されただけの場合は、既存のまとめたファイルは読み込まずに、
+    新規イベントの行だけを並び順を保って挿入する (storage.insert_rows)。
+    既存のイベントのファイルが変更・削除された場合は全イベントから作り直す
+    """
+    manifest_path = os.path.join(merge_cache_dir, "manifest.json")
+    manifest = load_manifest(manifest_path)
+    new_manifest = {}
+    event_files = []  # (マニフェストのキー, パス, 読み込み済みデータのパス)
     for event_name in os.listdir(events_dir):
         event_dir = os.path.join(events_dir, event_name)
         if not os.path.isdir(event_dir):
             continue
+        for file_name in ["matches.tsv", "placements.tsv"]:
+            key = f"{event_name}/{file_name}"
+            path = os.path.join(event_dir, file_name)
+            new_manifest[key] = get_file_signature(path, manifest.get(key))
+            cache_path = os.path.join(
+                merge_cache_dir, event_name, file_name.replace(".tsv", ".pkl")
+            )
+            event_files.append((key, path, cache_path))
 
-        df_event_match = pd.read_csv(
-            os.path.join(event_dir, "matches.tsv"),
-            index_col=False,
-            sep="\t",
-            encoding="utf-8",
-        )
-        df_match = pd.concat([df_match, df_event_match])
+    changed_keys = [
+        key
+        for key, signature in manifest.items()
+        if key not in new_manifest or new_manifest[key]["hash"] != signature["hash"]
+    ]
+    added_keys = [key for key in new_manifest if key not in manifest]
+    can_insert = (
+        bool(manifest)
+        and not changed_keys
+        and storage.table_exists("matches")
+        and storage.table_exists("placements")
+    )
 
-        df_event_placement = pd.read_csv(
-            os.path.join(event_dir, "placements.tsv"),
-            index_col=False,
-            sep="\t",
-            encoding="utf-8",
+    match_dfs = []
+    placement_dfs = []
+    parsed_files = []
+    for key, path, cache_path in event_files:
+        if can_insert and key not in added_keys:
+            continue
+        df, parsed = read_event_tsv(
+            path, cache_path, new_manifest[key], manifest.get(key)
         )
-        df_placement = pd.concat([df_placement, df_event_placement])
-
-    df_match = df_match.sort_values(by="Datetime(UTC)", ascending=False)
-    df_match.to_csv(
-        "data/cpt_2025/all_matches.tsv",
-        index=False,
-        encoding="utf-8",
-        sep="\t",
-        lineterminator="\n",
-    )
+        (match_dfs if key.endswith("/matches.tsv") else placement_dfs).append(df)
+        if parsed:
+            parsed_files.append(key)
+    print(f"読み込んだイベントファイル: {parsed_files}")
 
-    df_placement.to_csv(
-        "data/cpt_2025/all_placements.tsv",
-        index=False,
-        encoding="utf-8",
-        sep="\t",
-        lineterminator="\n",
-    )
+    if can_insert:
+        print(f"追加されたイベントファイル: {added_keys}")
+        if match_dfs:
+            storage.insert_rows("matches", pd.concat(match_dfs))
+        if placement_dfs:
+            storage.insert_rows("placements", pd.concat(placement_dfs))
+    else:
+        df_match = pd.concat(match_dfs)
+        df_match = df_match.sort_values(by="Datetime(UTC)", ascending=False)
+        storage.write_table("matches", df_match)
 
+        df_placement = pd.concat(placement_dfs)
+        storage.write_table("placements", df_placement)
 
-def main(event_slug: str, event_name: str):
+    os.makedirs(merge_cache_dir, exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, ensure_ascii=False, indent=2)
+
+
+def main(event_slug: str, event_name: str, stream: bool = False):
     print("大会データを取得")
-    collect_event_data(event_slug, event_name)
+    collect_event_data(event_slug, event_name, stream)
 
     print("取得済み大会データを1ファイルにマージ")
     merge_all_events_data()
@@ -63,6 +125,8 @@ def main(event_slug: str, event_name: str):
     print("新規プレイヤー情報を取得")
     collect_player_data.collect_in_tsv()
 
+    startgg.cache.print_stats()
+
 
 if __name__ == "__main__":
     main(
@@ -0,0 +1,235 @@
+"""UI向けにプレイヤー毎のデータを圧縮済みのJSONファイルに分けて出力する
+
+- players/<PlayerId>.json.gz: プレイヤー情報、大会成績、対戦結果、レート推移
+- ranking.json.gz: レーティング表用の一覧 (レートの高い順)
+- manifest.json: 出力したファイル毎の内容のハッシュ値
+
+内容が前回から変わっていないファイルは書き込まない。
+brotliがインストールされている場合は、gzipの代わりにbrotliで圧縮する (.json.br)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import rating_history
+import storage
+
+try:
+    import brotli
+
+    ENCODING = "br"
+except ImportError:
+    ENCODING = "gz"
+
+EXPORT_DIR = "data/cpt_2025/ui"
+PLAYERS_DIR = "players"
+MANIFEST_NAME = "manifest.json"
+
+SHARD_MATCH_COLUMNS = [
+    "Datetime(UTC)",
+    "Event",
+    "Bracket",
+    "Round",
+    "Player1",
+    "Player2",
+    "Player1Score",
+    "Player2Score",
+    "Player1Chars",
+    "Player2Chars",
+    "RateDiff",
+]
+SHARD_PLACEMENT_COLUMNS = ["Event", "FinalPlacement", "CPTPoint"]
+
+
+def compress(data: bytes) -> bytes:
+    if ENCODING == "br":
+        return brotli.compress(data)
+    # 内容が同じなら同じバイト列になるよう、更新日時は埋め込まない
+    return gzip.compress(data, mtime=0)
+
+
+def to_json_bytes(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def to_column_lists(df: pd.DataFrame) -> dict:
+    """列名から値のリストへの辞書に変換する。欠損値はNone"""
+    df = storage.format_for_tsv(df)
+    return {
+        column: df[column].astype(object).where(df[column].notna(), None).tolist()
+        for column in df.columns
+    }
+
+
+def group_rows(player_ids: np.ndarray, row_player_ids: np.ndarray, rows: np.ndarray):
+    """player_ids毎に、row_player_idsが一致する行番号の配列を返す (行番号の昇順)"""
+    order = np.lexsort((rows, row_player_ids))
+    sorted_ids = row_player_ids[order]
+    starts = np.searchsorted(sorted_ids, player_ids, side="left")
+    ends = np.searchsorted(sorted_ids, player_ids, side="right")
+    sorted_rows = rows[order]
+    return [sorted_rows[start:end] for start, end in zip(starts, ends)]
+
+
+def take(columns: dict, rows) -> dict:
+    return {column: [values[i] for i in rows] for column, values in columns.items()}
+
+
+def create_ranking(ratings_df, players_df, player_data_df) -> dict:
+    ranking_df = ratings_df.merge(
+        players_df[["PlayerId", "GamerTag", "CountryCode"]], how="left"
+    ).merge(player_data_df, on="PlayerId", how="left")
+    ranking_df[["CPTPoint", "TournamentWinCnt"]] = (
+        ranking_df[["CPTPoint", "TournamentWinCnt"]].fillna(0).astype("int64")
+    )
+    return to_column_lists(ranking_df)
+
+
+def create_player_shards(ratings_df, players_df, placements_df, matches_df, history):
+    """(PlayerId, JSONに変換する辞書)を順に返す
+
+    順位は他のプレイヤーの試合でも変わるため含めない (ranking.json.gzの並び順から求める)
+    """
+    player_ids = ratings_df["PlayerId"].to_numpy()
+    sorted_ids = np.sort(player_ids)
+    gamer_tags = dict(
+        zip(
+            players_df["PlayerId"].tolist(),
+            to_column_lists(players_df[["GamerTag"]])["GamerTag"],
+        )
+    )
+    player_columns = to_column_lists(
+        players_df.set_index("PlayerId")
+        .reindex(player_ids)[["GamerTag", "CountryCode", "Birthday"]]
+        .reset_index(drop=True)
+    )
+    # Glicko-2の場合はRD, Volatilityも含める
+    rating_columns = to_column_lists(ratings_df.drop(columns=["PlayerId"]))
+
+    # 対戦結果は勝者側・敗者側の両方のプレイヤーに含める
+    match_rows = np.arange(len(matches_df))
+    player1 = matches_df["Player1"].to_numpy()
+    player2 = matches_df["Player2"].to_numpy()
+    match_groups = group_rows(
+        sorted_ids,
+        np.concatenate([player1, player2]),
+        np.concatenate([match_rows, match_rows]),
+    )
+    match_groups = dict(zip(sorted_ids.tolist(), match_groups))
+    match_columns = to_column_lists(matches_df[SHARD_MATCH_COLUMNS])
+
+    placement_groups = group_rows(
+        sorted_ids, placements_df["PlayerId"].to_numpy(), np.arange(len(placements_df))
+    )
+    placement_groups = dict(zip(sorted_ids.tolist(), placement_groups))
+    placement_columns = to_column_lists(placements_df[SHARD_PLACEMENT_COLUMNS])
+
+    for i, player_id in enumerate(player_ids.tolist()):
+        rows = match_groups[player_id]
+        opponent_ids = set(player1[rows].tolist()) | set(player2[rows].tolist())
+        opponent_ids.discard(player_id)
+        if history is None:
+            curve = {"Timestamp": [], "Rating": []}
+        else:
+            timestamps, ratings = history.get_curve(player_id)
+            curve = {"Timestamp": timestamps.tolist(), "Rating": ratings.tolist()}
+
+        yield player_id, {
+            "PlayerId": player_id,
+            **{column: values[i] for column, values in player_columns.items()},
+            **{column: values[i] for column, values in rating_columns.items()},
+            "Placements": take(placement_columns, placement_groups[player_id]),
+            "Matches": take(match_columns, rows),
+            "Opponents": {
+                str(opponent_id): gamer_tags.get(opponent_id)
+                for opponent_id in sorted(opponent_ids)
+            },
+            "RatingCurve": curve,
+        }
+
+
+def load_manifest(export_dir) -> dict:
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("encoding") != ENCODING:
+        return {}
+    return manifest["files"]
+
+
+def save_manifest(export_dir, files: dict):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"encoding": ENCODING, "files": files}, f, indent=1, sort_keys=True)
+
+
+class ShardWriter:
+    """内容が前回の出力から変わったファイルだけを書き込む"""
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        self.old_files = load_manifest(export_dir)
+        self.files = {}
+        self.written_cnt = 0
+
+    def write(self, name: str, obj):
+        data = to_json_bytes(obj)
+        digest = hashlib.sha1(data).hexdigest()
+        file_name = f"{name}.json.{ENCODING}"
+        self.files[file_name] = digest
+
+        path = os.path.join(self.export_dir, file_name)
+        if self.old_files.get(file_name) == digest and os.path.exists(path):
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compress(data))
+        os.replace(tmp_path, path)
+        self.written_cnt += 1
+
+    def close(self):
+        """今回出力しなかったファイルを削除し、manifestを保存する"""
+        removed = set(self.old_files) - set(self.files)
+        for file_name in removed:
+            path = os.path.join(self.export_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+        save_manifest(self.export_dir, self.files)
+        print(
+            f"出力ファイル数={len(self.files)}, 書き込み={self.written_cnt}, 削除={len(removed)}"
+        )
+
+
+def main(export_dir=EXPORT_DIR):
+    print("UI向けのデータを読み込み")
+    ratings_df = storage.read_table("ratings")
+    players_df = storage.read_table("players")
+    placements_df = storage.read_table("placements")
+    player_data_df = storage.read_table("player_data")
+    matches_df = storage.read_table("matches")
+    history = rating_history.RatingHistory.load()
+    if history is None:
+        print("レート推移が無いため、レート推移は空で出力")
+
+    os.makedirs(os.path.join(export_dir, PLAYERS_DIR), exist_ok=True)
+    writer = ShardWriter(export_dir)
+
+    print("レーティング表用の一覧を出力")
+    writer.write("ranking", create_ranking(ratings_df, players_df, player_data_df))
+
+    print("プレイヤー毎のデータを出力")
+    for player_id, shard in create_player_shards(
+        ratings_df, players_df, placements_df, matches_df, history
+    ):
+        writer.write(f"{PLAYERS_DIR}/{player_id}", shard)
+    writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""ファイルの内容が前回から変わったかを判定するための値"""
+
+import hashlib
+import os
+
+
+def get_file_signature(path, previous=None):
+    """ファイルのサイズ・更新時刻・ハッシュ値を返す
+
+    サイズと更新時刻が前回と同じ場合はハッシュ値の計算を省略する
+    """
+    stat = os.stat(path)
+    if (
+        previous
+        and previous["size"] == stat.st_size
+        and previous["mtime"] == stat.st_mtime_ns
+    ):
+        return previous
+
+    with open(path, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash}
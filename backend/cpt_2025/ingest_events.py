@@ -0,0 +1,161 @@
+"""複数イベントの大会データをまとめて取得し、レートを1回だけ計算する
+
+イベント一覧はTSVファイル (マニフェスト) で渡す。列は以下の通り
+
+- EventSlug: start.ggのイベントのスラッグ (tournament/.../event/...)
+- EventName: 保存先のディレクトリ名、および試合結果のEvent列の値
+- Tier: イベントの区分 (例: premier, regional)。--tierでの絞り込みに使う
+- Date: 開催日 (YYYY-MM-DD)。この順に取得を開始する
+
+各イベントの取得はmain.create_stagesのステージとして並列に実行する。
+start.ggへのリクエストはstartgg.rate_limiterを全スレッドで共有する。
+取得済み (同じスラッグで取得し、ファイルが残っている) のイベントは再取得しない
+
+例:
+    python backend/cpt_2025/ingest_events.py events.tsv --workers 4 --tier premier
+"""
+
+import argparse
+import os
+import time
+
+import calc_ratings
+import main
+import match_stream
+import pandas as pd
+import pipeline
+import rating_engine
+import startgg
+
+MANIFEST_COLUMNS = ["EventSlug", "EventName", "Tier", "Date"]
+
+
+def read_event_manifest(path, tiers=None) -> pd.DataFrame:
+    """マニフェストを読み込み、開催日順に並べて返す。tiersを指定した場合はその区分だけ"""
+    df = pd.read_csv(path, sep="\t", index_col=False, encoding="utf-8", dtype=str)
+    missing = [column for column in MANIFEST_COLUMNS if column not in df.columns]
+    if missing:
+        raise Exception(f"マニフェストに列がありません。{missing}")
+    if df["EventSlug"].isna().any() or df["EventName"].isna().any():
+        raise Exception("EventSlugとEventNameは省略できません。")
+    duplicated = df.loc[df["EventName"].duplicated(), "EventName"].tolist()
+    if duplicated:
+        raise Exception(f"EventNameが重複しています。{duplicated}")
+
+    df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d")
+    if tiers:
+        df = df[df["Tier"].isin(tiers)]
+    return df.sort_values(by=["Date", "EventName"]).reset_index(drop=True)
+
+
+def count_rows(path) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def print_event_summary(events_df: pd.DataFrame, runner: pipeline.Pipeline):
+    """イベント毎の試合数・順位数と取得時間を表示する"""
+    print("\n--- イベント毎の取得結果 ---")
+    for event in events_df.itertuples():
+        event_dir = os.path.join(match_stream.EVENTS_DIR, event.EventName)
+        results = []
+        for kind, label in [("matches", "試合"), ("placements", "順位")]:
+            name = f"collect_{kind}/{event.EventName}"
+            if name in runner.failed:
+                results.append(f"{label}: 失敗")
+                continue
+            status = (
+                f"{runner.elapsed[name]:.1f}秒"
+                if name in runner.elapsed
+                else "取得済み"
+            )
+            count = count_rows(os.path.join(event_dir, f"{kind}.tsv"))
+            results.append(f"{label}: {count}件 ({status})")
+        print(
+            f"{event.Date:%Y-%m-%d} [{event.Tier}] {event.EventName}: "
+            + ", ".join(results)
+        )
+
+
+def ingest(
+    manifest_path,
+    tiers=None,
+    max_workers=4,
+    refetch=False,
+    full_replay=False,
+    model=None,
+    stream=False,
+):
+    if model is not None:
+        calc_ratings.use_model(model)
+
+    events_df = read_event_manifest(manifest_path, tiers)
+    print(f"対象イベント数: {len(events_df)}")
+    events = list(zip(events_df["EventSlug"], events_df["EventName"]))
+    stages = main.create_stages(events, full_replay, stream)
+
+    force = set()
+    if refetch:
+        force |= {stage.name for stage in stages if stage.name.startswith("collect_")}
+    if full_replay:
+        force.add("ratings")
+
+    started_at = time.perf_counter()
+    runner = pipeline.Pipeline(stages)
+    try:
+        ran = runner.run(force=force, max_workers=max_workers)
+        print(f"実行したステージ: {ran}")
+    finally:
+        print_event_summary(events_df, runner)
+        print(f"合計時間: {time.perf_counter() - started_at:.1f}秒")
+        startgg.cache.print_stats()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="マニフェストの全イベントの大会データを取得し、レートを計算する"
+    )
+    parser.add_argument("manifest", help="イベント一覧のTSVファイル")
+    parser.add_argument(
+        "--tier", action="append", help="取得するイベントの区分 (複数指定可)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="同時に実行するステージ数"
+    )
+    parser.add_argument(
+        "--refetch", action="store_true", help="取得済みのイベントも再取得する"
+    )
+    parser.add_argument(
+        "--full-replay",
+        action="store_true",
+        help="全試合からレートを再計算し、保存済みのレートと照合する",
+    )
+    parser.add_argument(
+        "--model",
+        choices=sorted(rating_engine.MODELS),
+        help="レーティングモデル (省略時はrating_engine.CIRCUITSの設定)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "試合結果をページ毎にファイルに追記しながら取得し、"
+            "全試合の再計算をイベント毎の試合結果から1試合ずつ行う"
+        ),
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ingest(
+        args.manifest,
+        tiers=args.tier,
+        max_workers=args.workers,
+        refetch=args.refetch,
+        full_replay=args.full_replay,
+        model=args.model,
+        stream=args.stream,
+    )
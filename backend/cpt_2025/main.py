@@ -1,13 +1,154 @@
+import os
+
 import calc_ratings
+import collect_match_data
+import collect_placement_data
+import collect_player_data
 import collect_startgg_data
+import export_ui_data
+import match_stream
+import pipeline
+import player_data
+import rating_history
+import startgg
+import storage
+
+MATCHES_PATH, _ = storage.TABLES["matches"]
+PLACEMENTS_PATH, _ = storage.TABLES["placements"]
+PLAYERS_PATH, _ = storage.TABLES["players"]
+RATINGS_PATH, _ = storage.TABLES["ratings"]
+PLAYER_DATA_PATH, _ = storage.TABLES["player_data"]
+
+
+def create_collect_stages(
+    event_slug: str, event_name: str, stream: bool = False
+) -> list[pipeline.Stage]:
+    """1イベントの試合結果と順位を取得するステージ。2つは並列に実行できる
+
+    stream=Trueの場合、試合結果はページ毎に正規化してファイルに追記しながら取得する
+
+    取得済み (同じスラッグとイベント名で取得し、ファイルが残っている) の場合は実行しない。
+    start.ggのデータの変更は検知できないため、開催中のイベントなどを再取得する場合は
+    Pipeline.runのforceにステージ名を指定する
+    """
+    event_dir = os.path.join(match_stream.EVENTS_DIR, event_name)
+    event_params = {"event_slug": event_slug, "event_name": event_name}
+    return [
+        pipeline.Stage(
+            f"collect_matches/{event_name}",
+            lambda: collect_match_data.collect_in_tsv(
+                event_slug, event_name, stream=stream
+            ),
+            outputs=[os.path.join(event_dir, "matches.tsv")],
+            params=event_params,
+        ),
+        pipeline.Stage(
+            f"collect_placements/{event_name}",
+            lambda: collect_placement_data.collect_placements_in_tsv(
+                event_slug, event_name
+            ),
+            outputs=[os.path.join(event_dir, "placements.tsv")],
+            params=event_params,
+        ),
+    ]
+
+
+def create_stages(
+    events: list[tuple[str, str]], full_replay: bool = False, stream: bool = False
+) -> list[pipeline.Stage]:
+    """events ((event_slug, event_name)のリスト) を取得した後、
+    マージ・プレイヤー情報の取得・レート計算・プレイヤー毎の集計・UI向けのデータ出力を
+    1回ずつ行うステージ
+    """
+    if full_replay:
+
+        def calc():
+            calc_ratings.create_rating_data(verify=True, stream=stream)
+
+    else:
+        calc = calc_ratings.update_rating_data
+
+    collect_stages = []
+    for event_slug, event_name in events:
+        collect_stages += create_collect_stages(event_slug, event_name, stream)
+
+    return collect_stages + [
+        pipeline.Stage(
+            "merge",
+            collect_startgg_data.merge_all_events_data,
+            inputs=[match_stream.EVENTS_DIR],
+            outputs=[MATCHES_PATH, PLACEMENTS_PATH],
+        ),
+        pipeline.Stage(
+            "players",
+            collect_player_data.collect_in_tsv,
+            inputs=[PLACEMENTS_PATH],
+            outputs=[PLAYERS_PATH],
+        ),
+        pipeline.Stage(
+            "ratings",
+            calc,
+            inputs=[MATCHES_PATH, PLAYERS_PATH],
+            # all_matches.tsvにはレート変動量を付加する
+            outputs=[
+                RATINGS_PATH,
+                rating_history.HISTORY_PATH,
+                MATCHES_PATH,
+                calc_ratings.CHECKPOINT_DIR,
+            ],
+            params=calc_ratings.MODEL.get_config(),
+        ),
+        pipeline.Stage(
+            "player_data",
+            player_data.main,
+            inputs=[PLACEMENTS_PATH],
+            outputs=[PLAYER_DATA_PATH],
+        ),
+        pipeline.Stage(
+            "export",
+            export_ui_data.main,
+            inputs=[
+                MATCHES_PATH,
+                PLACEMENTS_PATH,
+                PLAYERS_PATH,
+                RATINGS_PATH,
+                PLAYER_DATA_PATH,
+                rating_history.HISTORY_PATH,
+            ],
+            outputs=[os.path.join(export_ui_data.EXPORT_DIR, "manifest.json")],
+        ),
+    ]
+
+
+def main(
+    event_slug: str,
+    event_name: str,
+    full_replay: bool = False,
+    model: str = None,
+    stream: bool = False,
+    force=(),
+):
+    """大会データの収集からUI向けのデータ出力までを、入力に変更のあったステージだけ実行する
+
+    modelを指定した場合、rating_engine.MODELSのモデルでレートを計算する (例: "glicko2")
+    full_replay=Trueの場合、全イベントの試合結果からレートを再集計し、保存済みのレートと照合する
+    stream=Trueの場合、試合結果はページ毎にファイルに追記しながら取得し、
+    全試合の再集計はイベント毎の試合結果を古い順に読み込みながら行う
+    forceに含まれるステージ (例: "collect_matches/<event_name>") は入力に変更が無くても実行する
+    """
+    if model is not None:
+        calc_ratings.use_model(model)
 
+    force = set(force)
+    if full_replay:
+        force.add("ratings")
 
-def main(event_slug: str, event_name: str):
-    print(f"{event_name} の大会データを収集")
-    collect_startgg_data.main(event_slug, event_name)
+    print(f"{event_name} の大会データを収集し、レートを計算")
+    stages = create_stages([(event_slug, event_name)], full_replay, stream)
+    ran = pipeline.Pipeline(stages).run(force=force)
+    print(f"実行したステージ: {ran}")
 
-    print("全イベントの試合結果からレートを再集計")
-    calc_ratings.create_rating_data()
+    startgg.cache.print_stats()
 
 
 if __name__ == "__main__":
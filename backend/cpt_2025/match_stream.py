@@ -0,0 +1,266 @@
+"""イベント毎のmatches.tsvを古い順に1試合ずつ読み出す
+
+all_matches.tsvを読み込まずに、イベント毎のファイルを日時でk-way mergeする。
+各イベントのファイルは1行ずつ読み、同じ日時の試合だけをまとめて並べ替えて返すため、
+同時に保持するのは読み込み中のイベント毎に同じ日時の試合だけになる。
+イベント毎の最初と最後の試合の日時と並び順はインデックスに保存し、
+変更の無いファイルは再び走査しない
+"""
+
+import calendar
+import csv
+import heapq
+import json
+import os
+import time
+
+import match_table
+
+EVENTS_DIR = "data/cpt_2025/events"
+INDEX_PATH = "data/cpt_2025/merge_cache/stream_index.json"
+MAX_TIMESTAMP = 2**63 - 1
+
+# ファイルの末尾から読み込む際の1回の読み込みサイズ
+REVERSE_BLOCK_SIZE = 65536
+
+# storage.read_tsv (pandas) で欠損値として読み込まれる値
+MISSING_VALUES = {"", "N/A", "NA", "NaN", "nan", "null", "None"}
+
+
+def parse_timestamp(value) -> int:
+    if value in MISSING_VALUES:
+        return match_table.MISSING_TIMESTAMP
+    try:
+        return calendar.timegm(time.strptime(value, match_table.DATETIME_FORMAT))
+    except ValueError:
+        return match_table.MISSING_TIMESTAMP
+
+
+def get_text_key(value):
+    """カテゴリ列の比較用キー。不明な値は最後に並べる"""
+    if value in MISSING_VALUES:
+        return (1, "")
+    return (0, value)
+
+
+def get_sort_key(match: dict, filled_timestamp: int) -> tuple:
+    """match_table.MatchTable.get_chronological_orderと同じ順序になるキー"""
+    bracket = None if match["Bracket"] in MISSING_VALUES else match["Bracket"]
+    round_text = None if match["Round"] in MISSING_VALUES else match["Round"]
+    score1, outcome1 = match_table.encode_score(match["Player1Score"])
+    score2, outcome2 = match_table.encode_score(match["Player2Score"])
+    return (
+        filled_timestamp,
+        match_table.get_bracket_order(bracket),
+        match_table.get_round_order(round_text),
+        get_text_key(match["Event"]),
+        get_text_key(match["Bracket"]),
+        get_text_key(match["Round"]),
+        int(match["Player1"]),
+        int(match["Player2"]),
+        outcome1,
+        score1,
+        outcome2,
+        score2,
+    )
+
+
+def scan_event_file(path) -> dict:
+    """ファイルを1行ずつ読み、インデックスの項目を返す
+
+    - first, last: 最初と最後の試合の日時。日時の無い場合はNone
+    - order: 日時の無い試合を除いた並び順 ("asc", "desc", 並んでいない場合はNone)
+    - rows: 試合数
+    """
+    first, last, previous = None, None, None
+    is_asc, is_desc = True, True
+    rows = 0
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+        for match in reader:
+            rows += 1
+            t = parse_timestamp(match["Datetime(UTC)"])
+            if t == match_table.MISSING_TIMESTAMP:
+                continue
+            first = t if first is None else min(first, t)
+            last = t if last is None else max(last, t)
+            if previous is not None:
+                is_asc &= previous <= t
+                is_desc &= previous >= t
+            previous = t
+        # 改行を含む値があると、末尾から1行ずつ読み込めない
+        is_single_line = reader.line_num == rows + 1
+
+    order = None
+    if is_single_line:
+        order = "desc" if is_desc else "asc" if is_asc else None
+    return {"first": first, "last": last, "order": order, "rows": rows}
+
+
+def load_index(events_dir=EVENTS_DIR, index_path=INDEX_PATH) -> dict:
+    """イベント毎のファイルのパスからインデックスの項目への辞書を返す
+
+    サイズ・更新時刻が前回と異なるファイルだけを走査し、インデックスを保存し直す
+    """
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+    new_index = {}
+    for event_name in sorted(os.listdir(events_dir)):
+        path = os.path.join(events_dir, event_name, "matches.tsv")
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        entry = index.get(path)
+        if (
+            entry is None
+            or entry["size"] != stat.st_size
+            or entry["mtime"] != stat.st_mtime_ns
+        ):
+            entry = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                **scan_event_file(path),
+            }
+        new_index[path] = entry
+
+    if new_index != index:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(new_index, f, ensure_ascii=False, indent=2)
+    return new_index
+
+
+def iter_lines_reversed(path, block_size=REVERSE_BLOCK_SIZE):
+    """ファイルの行を末尾から順に返す (ヘッダーも最後に返す)"""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + rest).split(b"\n")
+            rest = lines[0]
+            for line in reversed(lines[1:]):
+                yield line.rstrip(b"\r").decode("utf-8")
+        yield rest.rstrip(b"\r").decode("utf-8")
+
+
+def is_missing_datetime(match: dict) -> bool:
+    return parse_timestamp(match["Datetime(UTC)"]) == match_table.MISSING_TIMESTAMP
+
+
+def iter_event_rows(path, entry):
+    """1イベントの試合を(ファイル内の行番号, 試合)で、日時の古い順 (日時の無い試合は最後) に返す
+
+    日時の降順に並んだファイルは末尾から、昇順のファイルは先頭から1行ずつ読み込む。
+    日時順に並んでいないファイルは全体を読み込んで並べ替える
+    """
+    missing = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+        header = reader.fieldnames
+        if entry["order"] != "desc":
+            rows = enumerate(reader)
+            if entry["order"] is None:
+                rows = sorted(
+                    rows, key=lambda row: parse_timestamp(row[1]["Datetime(UTC)"])
+                )
+            for row in rows:
+                if is_missing_datetime(row[1]):
+                    missing.append(row)
+                else:
+                    yield row
+            yield from missing
+            return
+
+    row_number = entry["rows"]
+    for line in iter_lines_reversed(path):
+        if row_number == 0:
+            break
+        if not line:
+            continue
+        row_number -= 1
+        match = dict(zip(header, next(csv.reader([line], delimiter="\t"))))
+        if is_missing_datetime(match):
+            missing.append((row_number, match))
+        else:
+            yield row_number, match
+    yield from reversed(missing)
+
+
+def iter_event_matches(path, entry):
+    """1イベントの試合を古い順に(キー, 試合)で返す
+
+    同じ日時の試合だけをまとめてキーで並べ替える。
+    日時の無い試合はイベントの最後の試合と同時刻とする。
+    試合の辞書には、その日時 (UNIX時間) を"Timestamp"、
+    ファイルのパスを"Path"、ファイル内の行番号 (0始まり) を"Row"として追加する
+    """
+    last_timestamp = MAX_TIMESTAMP if entry["last"] is None else entry["last"]
+    group = []
+    for row_number, match in iter_event_rows(path, entry):
+        t = parse_timestamp(match["Datetime(UTC)"])
+        if t == match_table.MISSING_TIMESTAMP:
+            t = last_timestamp
+        if group and group[0][0][0] != t:
+            group.sort(key=lambda item: item[0])
+            yield from group
+            group = []
+        match.update(Timestamp=t, Path=path, Row=row_number)
+        group.append((get_sort_key(match, t), match))
+    group.sort(key=lambda item: item[0])
+    yield from group
+
+
+def list_event_files(events_dir=EVENTS_DIR):
+    """(最初の試合の日時, パス, インデックスの項目)を最初の試合の日時順に返す"""
+    event_files = []
+    for path, entry in load_index(events_dir).items():
+        first = MAX_TIMESTAMP if entry["first"] is None else entry["first"]
+        event_files.append((first, path, entry))
+    event_files.sort(key=lambda item: (item[0], item[1]))
+    return event_files
+
+
+def iter_all_matches(events_dir=EVENTS_DIR, by_event=False, event_files=None):
+    """全イベントの試合を古い順に1試合ずつ返す
+
+    by_event=Trueの場合は、イベントを最初の試合の日時順に並べ、1イベントずつ全試合を返す
+    (イベントをレーティング期間とするモデル用)
+    event_filesを省略した場合はlist_event_filesで求める
+    """
+    if event_files is None:
+        event_files = list_event_files(events_dir)
+    if by_event:
+        for _, path, entry in event_files:
+            for _, match in iter_event_matches(path, entry):
+                yield match
+        return
+
+    heap = []
+    seq = 0
+    pending = iter(event_files)
+    next_event = next(pending, None)
+    while heap or next_event is not None:
+        # 次のイベントの最初の試合が先頭の試合以前の日時なら、そのイベントを読み込み始める
+        while next_event is not None and (not heap or next_event[0] <= heap[0][0][0]):
+            _, path, entry = next_event
+            event_iter = iter_event_matches(path, entry)
+            item = next(event_iter, None)
+            if item is not None:
+                heapq.heappush(heap, (item[0], seq, item[1], event_iter))
+                seq += 1
+            next_event = next(pending, None)
+        if not heap:
+            continue
+
+        _, _, match, event_iter = heapq.heappop(heap)
+        yield match
+        item = next(event_iter, None)
+        if item is not None:
+            heapq.heappush(heap, (item[0], seq, item[1], event_iter))
+            seq += 1
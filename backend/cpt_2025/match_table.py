@@ -0,0 +1,400 @@
+"""試合結果を省メモリな型で保持するテーブル
+
+TSVファイルの1行(1試合)を以下の列で表す
+
+- Timestamp: 試合日時 (UNIX時間, int64)。不明な場合はMISSING_TIMESTAMP
+- Event, Bracket, Round, Player1Chars, Player2Chars: カテゴリ型
+- Player1, Player2: player_ids配列へのインデックス (int32)。Player1が勝者
+- Player1Score, Player2Score: 数値スコア (int8)。数値でない場合は0。
+  int8の範囲外の数値はスコアの種類をOUTCOME_UNKNOWNとする
+- Player1Outcome, Player2Outcome: スコアの種類 (int8, OUTCOME_*)
+"""
+
+import collections
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S UTC"
+MISSING_TIMESTAMP = -1
+
+# スコアの種類
+OUTCOME_SCORE = 0  # 数値スコア
+OUTCOME_WIN = 1  # "W"
+OUTCOME_LOSE = 2  # "L"
+OUTCOME_DQ_WIN = 3  # "W (DQ/FF)"
+OUTCOME_DQ_LOSE = 4  # "L (DQ/FF)"
+OUTCOME_DQ = 5  # "DQ/FF" (どちらがDQ/FFか不明)
+OUTCOME_UNKNOWN = 6  # "N/A"
+
+OUTCOME_TO_LABEL = {
+    OUTCOME_WIN: "W",
+    OUTCOME_LOSE: "L",
+    OUTCOME_DQ_WIN: "W (DQ/FF)",
+    OUTCOME_DQ_LOSE: "L (DQ/FF)",
+    OUTCOME_DQ: "DQ/FF",
+    OUTCOME_UNKNOWN: "N/A",
+}
+LABEL_TO_OUTCOME = {label: outcome for outcome, label in OUTCOME_TO_LABEL.items()}
+
+# 数値スコアとして保持できる範囲 (int8)
+SCORE_MIN = int(np.iinfo(np.int8).min)
+SCORE_MAX = int(np.iinfo(np.int8).max)
+
+CATEGORY_COLUMNS = ["Event", "Bracket", "Round", "Player1Chars", "Player2Chars"]
+
+# TSVファイルでの列の順序
+TSV_COLUMNS = [
+    "Datetime(UTC)",
+    "Event",
+    "Bracket",
+    "Round",
+    "Player1",
+    "Player2",
+    "Player1Score",
+    "Player2Score",
+    "Player1Chars",
+    "Player2Chars",
+]
+
+
+# 同時刻の試合はブラケット, ラウンドの順に並べる (cpt_2023のBRAKET_ORDER, ROUND_ORDERと同じ並び)
+UNKNOWN_ORDER = 999999
+ROUND_ORDER = {
+    "Winners Quarter-Final": 100,
+    "Winners Semi-Final": 101,
+    "Winners Final": 102,
+    "Losers Quarter-Final": 300,
+    "Losers Semi-Final": 301,
+    "Losers Final": 302,
+    "Grand Final": 400,
+    "Grand Final Reset": 401,
+}
+
+
+def get_bracket_order(bracket) -> int:
+    """ブラケット名 (phase名) の大会内での順番
+
+    "Round 1", "ROUND 2", "Round3"はその番号、"Pools"は1、"Top 24"などは人数の多い順に
+    Roundの後に並べる。それ以外は最後とする
+    """
+    if not isinstance(bracket, str):
+        return UNKNOWN_ORDER
+    m = re.fullmatch(r"round\s*(\d+)", bracket.strip(), flags=re.IGNORECASE)
+    if m:
+        return int(m.group(1))
+    if bracket.strip().lower() == "pools":
+        return 1
+    m = re.fullmatch(r"top\s*(\d+)", bracket.strip(), flags=re.IGNORECASE)
+    if m:
+        return 100000 - int(m.group(1))
+    return UNKNOWN_ORDER
+
+
+def get_round_order(round_text) -> int:
+    """ラウンド名のブラケット内での順番。Winners, Losers, Grand Finalの順に並べる"""
+    if not isinstance(round_text, str):
+        return UNKNOWN_ORDER
+    if round_text in ROUND_ORDER:
+        return ROUND_ORDER[round_text]
+    m = re.fullmatch(r"(Winners|Losers) Round (\d+)", round_text)
+    if m:
+        return (0 if m.group(1) == "Winners" else 200) + int(m.group(2))
+    return UNKNOWN_ORDER
+
+
+def encode_score(value):
+    """スコアを(数値スコア, スコアの種類)に変換する
+
+    数値スコアがSCORE_MIN..SCORE_MAXの範囲外の場合は不明 (OUTCOME_UNKNOWN) とする
+    """
+    score = None
+    if isinstance(value, (int, np.integer)):
+        score = int(value)
+    # 欠損値を含む数値の列は浮動小数点数として読み込まれる (3.0など)
+    elif isinstance(value, (float, np.floating)) and float(value).is_integer():
+        score = int(value)
+    elif isinstance(value, str):
+        if value.isdigit():
+            score = int(value)
+        elif value in LABEL_TO_OUTCOME:
+            return 0, LABEL_TO_OUTCOME[value]
+    if score is None or not SCORE_MIN <= score <= SCORE_MAX:
+        return 0, OUTCOME_UNKNOWN
+    return score, OUTCOME_SCORE
+
+
+def encode_scores(scores: pd.Series):
+    """スコア列を数値スコアとスコアの種類の配列に変換する
+
+    スコアの種類は少ないため、ユニーク値だけを変換してから展開する
+    """
+    codes, uniques = pd.factorize(scores, use_na_sentinel=False)
+    encoded = [encode_score(value) for value in uniques]
+    values = np.array([v for v, _ in encoded], dtype=np.int8)
+    outcomes = np.array([o for _, o in encoded], dtype=np.int8)
+    return values[codes], outcomes[codes]
+
+
+def to_score_arrays(scores, outcomes):
+    """数値スコアとスコアの種類の配列をint8にする
+
+    範囲外の数値スコアはint8に変換すると値が変わるため、0とし、スコアの種類はOUTCOME_UNKNOWNとする
+    """
+    scores = np.asarray(scores, dtype=np.int64)
+    outcomes = np.asarray(outcomes, dtype=np.int8)
+    out_of_range = (scores < SCORE_MIN) | (scores > SCORE_MAX)
+    if not out_of_range.any():
+        return scores.astype(np.int8), outcomes
+    return (
+        np.where(out_of_range, 0, scores).astype(np.int8),
+        np.where(out_of_range, OUTCOME_UNKNOWN, outcomes).astype(np.int8),
+    )
+
+
+def calc_diff_set(value1, value2) -> int:
+    """1試合分のスコア差。DQ/FFなど数値でないスコアの試合は1とする"""
+    score1, outcome1 = encode_score(value1)
+    score2, outcome2 = encode_score(value2)
+    if outcome1 != OUTCOME_SCORE or outcome2 != OUTCOME_SCORE:
+        return 1
+    return abs(score1 - score2)
+
+
+def decode_scores(values: np.ndarray, outcomes: np.ndarray) -> list:
+    return [
+        int(v) if o == OUTCOME_SCORE else OUTCOME_TO_LABEL[o]
+        for v, o in zip(values.tolist(), outcomes.tolist())
+    ]
+
+
+def encode_datetimes(datetimes: pd.Series) -> np.ndarray:
+    """試合日時の列をUNIX時間に変換する"""
+    if not pd.api.types.is_datetime64_any_dtype(datetimes):
+        datetimes = pd.to_datetime(
+            datetimes, format=DATETIME_FORMAT, errors="coerce", utc=True
+        )
+    epoch = pd.Timestamp(0, tz="UTC")
+    seconds = (datetimes - epoch) // pd.Timedelta(seconds=1)
+    return seconds.fillna(MISSING_TIMESTAMP).to_numpy(np.int64)
+
+
+def decode_datetimes(timestamps: np.ndarray) -> list:
+    return [
+        (
+            datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc).strftime(
+                DATETIME_FORMAT
+            )
+            if t != MISSING_TIMESTAMP
+            else "N/A"
+        )
+        for t in timestamps.tolist()
+    ]
+
+
+def concat_categories(parts: list) -> pd.Categorical:
+    """カテゴリ型の列のリストを連結する
+
+    値ごとの文字列を作らずに、各列のカテゴリのコードを連結後のカテゴリのコードに変換する
+    """
+    labels = {}
+    codes = []
+    for values in parts:
+        mapping = np.array(
+            [labels.setdefault(label, len(labels)) for label in values.cat.categories]
+            + [-1],
+            dtype=np.int64,
+        )
+        codes.append(mapping[values.cat.codes.to_numpy()])
+    return pd.Categorical.from_codes(np.concatenate(codes), categories=list(labels))
+
+
+class MatchTable:
+    def __init__(self, frame: pd.DataFrame, player_ids: np.ndarray):
+        self.frame = frame
+        self.player_ids = player_ids
+
+    def __len__(self):
+        return len(self.frame)
+
+    @classmethod
+    def from_frame(cls, matches_df: pd.DataFrame) -> "MatchTable":
+        """TSVファイルと同じ列を持つDataFrameから作成する"""
+        return cls.from_frames([matches_df])
+
+    @classmethod
+    def from_frames(cls, frames) -> "MatchTable":
+        """TSVファイルと同じ列を持つDataFrameを順に変換して連結する
+
+        ファイルを分割して読み込んだDataFrame (storage.iter_table) を渡すと、
+        ファイル全体のDataFrameを作らずに作成できる
+        """
+        columns = collections.defaultdict(list)
+        for df in frames:
+            score1, outcome1 = encode_scores(df["Player1Score"])
+            score2, outcome2 = encode_scores(df["Player2Score"])
+            columns["timestamps"].append(encode_datetimes(df["Datetime(UTC)"]))
+            columns["player1_ids"].append(df["Player1"].to_numpy(np.int64))
+            columns["player2_ids"].append(df["Player2"].to_numpy(np.int64))
+            columns["score1"].append(score1)
+            columns["outcome1"].append(outcome1)
+            columns["score2"].append(score2)
+            columns["outcome2"].append(outcome2)
+            for column in CATEGORY_COLUMNS:
+                columns[column].append(df[column].astype("category"))
+        if not columns:
+            return cls.from_records([])
+
+        def concat(key):
+            return np.concatenate(columns[key])
+
+        return cls.from_encoded(
+            concat("timestamps"),
+            concat("player1_ids"),
+            concat("player2_ids"),
+            concat("score1"),
+            concat("outcome1"),
+            concat("score2"),
+            concat("outcome2"),
+            {column: concat_categories(columns[column]) for column in CATEGORY_COLUMNS},
+        )
+
+    @classmethod
+    def from_encoded(
+        cls,
+        timestamps,
+        player1_ids,
+        player2_ids,
+        score1,
+        outcome1,
+        score2,
+        outcome2,
+        categories: dict,
+    ) -> "MatchTable":
+        """変換済みの列から作成する。categoriesはCATEGORY_COLUMNSの列名から値の配列への辞書"""
+        codes, player_ids = pd.factorize(
+            np.concatenate(
+                [np.asarray(player1_ids, np.int64), np.asarray(player2_ids, np.int64)]
+            )
+        )
+        n = len(codes) // 2
+        score1, outcome1 = to_score_arrays(score1, outcome1)
+        score2, outcome2 = to_score_arrays(score2, outcome2)
+        frame = pd.DataFrame(
+            {
+                "Timestamp": np.asarray(timestamps, dtype=np.int64),
+                "Player1": codes[:n].astype(np.int32),
+                "Player2": codes[n:].astype(np.int32),
+                "Player1Score": score1,
+                "Player2Score": score2,
+                "Player1Outcome": outcome1,
+                "Player2Outcome": outcome2,
+            }
+        )
+        for column in CATEGORY_COLUMNS:
+            # ソート順が文字列と同じになるようカテゴリを辞書順に並べる
+            values = pd.Series(categories[column]).astype("category")
+            frame[column] = values.cat.set_categories(
+                sorted(values.cat.categories)
+            ).array
+        return cls(frame, np.asarray(player_ids, dtype=np.int64))
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "MatchTable":
+        """TSVファイルの1行を表す辞書のリストから作成する"""
+        return cls.from_frame(pd.DataFrame(records, columns=TSV_COLUMNS))
+
+    def to_frame(self) -> pd.DataFrame:
+        """TSVファイルと同じ列を持つDataFrameに変換する"""
+        frame = self.frame
+        return pd.DataFrame(
+            {
+                "Datetime(UTC)": decode_datetimes(frame["Timestamp"].to_numpy()),
+                "Event": frame["Event"].astype(object),
+                "Bracket": frame["Bracket"].astype(object),
+                "Round": frame["Round"].astype(object),
+                "Player1": self.player_ids[frame["Player1"].to_numpy()],
+                "Player2": self.player_ids[frame["Player2"].to_numpy()],
+                "Player1Score": decode_scores(
+                    frame["Player1Score"].to_numpy(),
+                    frame["Player1Outcome"].to_numpy(),
+                ),
+                "Player2Score": decode_scores(
+                    frame["Player2Score"].to_numpy(),
+                    frame["Player2Outcome"].to_numpy(),
+                ),
+                "Player1Chars": frame["Player1Chars"].astype(object),
+                "Player2Chars": frame["Player2Chars"].astype(object),
+            },
+            columns=TSV_COLUMNS,
+        )
+
+    def get_player1_ids(self) -> np.ndarray:
+        return self.player_ids[self.frame["Player1"].to_numpy()]
+
+    def get_player2_ids(self) -> np.ndarray:
+        return self.player_ids[self.frame["Player2"].to_numpy()]
+
+    def calc_diff_sets(self) -> np.ndarray:
+        """スコア差の配列を返す。DQ/FFなど数値でないスコアの試合は1とする"""
+        frame = self.frame
+        is_score = (frame["Player1Outcome"].to_numpy() == OUTCOME_SCORE) & (
+            frame["Player2Outcome"].to_numpy() == OUTCOME_SCORE
+        )
+        diff_sets = np.abs(
+            frame["Player1Score"].to_numpy(np.int64)
+            - frame["Player2Score"].to_numpy(np.int64)
+        )
+        return np.where(is_score, diff_sets, 1)
+
+    def get_chronological_order(self) -> np.ndarray:
+        """試合を古い順に並べた行番号を返す
+
+        日時, ブラケットの順番, ラウンドの順番, Event, Bracket, Round, Player1, Player2,
+        スコアの順に比較する。日時が不明な試合は同じEventの最後の試合と同時刻とし、
+        カテゴリが不明な行はそれぞれ最後に並べる。
+        match_stream.get_sort_keyと同じ順序になる
+        """
+        frame = self.frame
+        keys = [self.get_filled_timestamps()]
+        for column, get_order in [
+            ("Bracket", get_bracket_order),
+            ("Round", get_round_order),
+        ]:
+            orders = np.array(
+                [get_order(value) for value in frame[column].cat.categories]
+                + [UNKNOWN_ORDER],
+                dtype=np.int64,
+            )
+            keys.append(orders[frame[column].cat.codes.to_numpy()])
+        for column in ["Event", "Bracket", "Round"]:
+            codes = frame[column].cat.codes.to_numpy()
+            keys.append(np.where(codes < 0, len(frame[column].cat.categories), codes))
+        keys.append(self.get_player1_ids())
+        keys.append(self.get_player2_ids())
+        for column in [
+            "Player1Outcome",
+            "Player1Score",
+            "Player2Outcome",
+            "Player2Score",
+        ]:
+            keys.append(frame[column].to_numpy())
+        return np.lexsort(keys[::-1])
+
+    def get_filled_timestamps(self) -> np.ndarray:
+        """日時が不明な試合を同じEventの最後の試合の日時で埋める
+
+        Event内に日時の分かる試合が無い場合は全試合の最後とする
+        """
+        timestamps = self.frame["Timestamp"].to_numpy()
+        is_missing = timestamps == MISSING_TIMESTAMP
+        if not is_missing.any():
+            return timestamps
+        codes = self.frame["Event"].cat.codes.to_numpy() + 1
+        event_max = np.full(codes.max() + 1, MISSING_TIMESTAMP, dtype=np.int64)
+        np.maximum.at(event_max, codes, timestamps)
+        filled = event_max[codes]
+        filled = np.where(filled == MISSING_TIMESTAMP, np.iinfo(np.int64).max, filled)
+        return np.where(is_missing, filled, timestamps)
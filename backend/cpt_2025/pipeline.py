@@ -0,0 +1,191 @@
+"""cpt_2025のデータ作成処理を、ステージの依存関係に沿って実行する
+
+各ステージは入力と出力のファイル (またはディレクトリ) を宣言する。
+前のステージの出力を入力に含むステージは、そのステージの後に実行する。
+依存関係の無いステージはスレッドで並列に実行する。
+
+実行したステージの入力のハッシュ値とパラメータをビルドマニフェストに記録する。
+次回の実行時に、入力とパラメータが変わっておらず出力が揃っているステージは実行しない。
+入力のファイルが無いステージ (start.ggからの取得など) は、パラメータが同じで出力が揃っていれば実行しない。
+ステージ自身が入力を書き換える場合 (ratingsによるall_matches.tsvへのRateDiffの付加など) に
+次回も実行されないよう、入力のハッシュ値はステージの実行後に記録する
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from file_signature import get_file_signature
+
+BUILD_MANIFEST_PATH = "data/cpt_2025/build_manifest.json"
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), params=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        # 入力ファイル以外で結果に影響する値 (イベント名やレーティングモデルの設定など)
+        self.params = params or {}
+
+
+def load_build_manifest(path=BUILD_MANIFEST_PATH) -> dict:
+    if not os.path.exists(path):
+        return {"files": {}, "stages": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_build_manifest(manifest: dict, path=BUILD_MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def list_files(path) -> list:
+    """pathがディレクトリの場合は配下の全ファイル、ファイルの場合はpathだけを返す"""
+    if not os.path.isdir(path):
+        return [path] if os.path.exists(path) else []
+    files = []
+    for root, _, file_names in os.walk(path):
+        files += [os.path.join(root, file_name) for file_name in file_names]
+    return sorted(files)
+
+
+def hash_params(params: dict) -> str:
+    data = json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def get_dependencies(stages: list[Stage]) -> dict:
+    """ステージ名から、そのステージより前にあり入力を出力するステージ名の集合への辞書を返す"""
+
+    def overlaps(input_path, output_path):
+        input_path = os.path.normpath(input_path)
+        output_path = os.path.normpath(output_path)
+        return (
+            input_path == output_path
+            or input_path.startswith(output_path + os.sep)
+            or output_path.startswith(input_path + os.sep)
+        )
+
+    dependencies = {}
+    for i, stage in enumerate(stages):
+        dependencies[stage.name] = {
+            other.name
+            for other in stages[:i]
+            if any(overlaps(p, q) for p in stage.inputs for q in other.outputs)
+        }
+    return dependencies
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], manifest_path=BUILD_MANIFEST_PATH):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise Exception(f"ステージ名が重複しています。{names}")
+        self.stages = {stage.name: stage for stage in stages}
+        self.dependencies = get_dependencies(stages)
+        self.manifest_path = manifest_path
+        self.manifest = load_build_manifest(manifest_path)
+        # 直近のrunでの、ステージ名から実行時間 (秒) と失敗の理由
+        self.elapsed = {}
+        self.failed = {}
+
+    def get_input_hashes(self, stage: Stage) -> dict:
+        """入力毎のハッシュ値を返す。ディレクトリは配下の全ファイルのハッシュ値から求める"""
+        input_hashes = {}
+        for input_path in stage.inputs:
+            file_hashes = []
+            for path in list_files(input_path):
+                signature = get_file_signature(path, self.manifest["files"].get(path))
+                self.manifest["files"][path] = signature
+                file_hashes.append(
+                    [os.path.relpath(path, input_path), signature["hash"]]
+                )
+            input_hashes[input_path] = hash_params(file_hashes)
+        return input_hashes
+
+    def needs_run(self, stage: Stage) -> bool:
+        record = self.manifest["stages"].get(stage.name)
+        if record is None:
+            return True
+        if any(not os.path.exists(path) for path in stage.outputs):
+            return True
+        if record["params"] != hash_params(stage.params):
+            return True
+        return record["inputs"] != self.get_input_hashes(stage)
+
+    def record(self, stage: Stage):
+        self.manifest["stages"][stage.name] = {
+            "params": hash_params(stage.params),
+            "inputs": self.get_input_hashes(stage),
+        }
+        save_build_manifest(self.manifest, self.manifest_path)
+
+    def run(self, force=(), max_workers=4) -> list:
+        """全ステージを実行し、実際に実行したステージ名のリストを返す
+
+        forceに含まれるステージは入力が変わっていなくても実行する。
+        失敗したステージがあっても、それに依存しないステージは実行を続け、
+        最後に失敗したステージをまとめて例外として送出する
+        """
+        unknown = set(force) - set(self.stages)
+        if unknown:
+            raise Exception(f"存在しないステージです。{sorted(unknown)}")
+
+        done = set()
+        failed = self.failed = {}
+        ran = []
+        running = {}
+        started_at = {}
+        self.elapsed = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(done) + len(failed) < len(self.stages):
+                for name, stage in self.stages.items():
+                    if name in done or name in failed or name in running.values():
+                        continue
+                    if self.dependencies[name] & set(failed):
+                        failed[name] = "依存するステージが失敗"
+                        continue
+                    if not self.dependencies[name] <= done:
+                        continue
+                    if len(running) >= max_workers:
+                        break
+                    if name not in force and not self.needs_run(stage):
+                        print(f"[{name}] 入力に変更が無いためスキップ")
+                        done.add(name)
+                        continue
+                    print(f"[{name}] 実行")
+                    started_at[name] = time.perf_counter()
+                    running[executor.submit(stage.func)] = name
+
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    self.elapsed[name] = time.perf_counter() - started_at[name]
+                    progress = f"{len(done) + len(failed) + 1}/{len(self.stages)}"
+                    try:
+                        future.result()
+                    except BaseException as e:
+                        # 失敗したステージは記録しないため、次回の実行で再度実行される
+                        # (collect_placements_in_tsvはexit()するためSystemExitも捕捉する)
+                        print(
+                            f"[{name}] 失敗 ({progress}, {self.elapsed[name]:.1f}秒): {e!r}"
+                        )
+                        failed[name] = repr(e)
+                        continue
+                    print(f"[{name}] 完了 ({progress}, {self.elapsed[name]:.1f}秒)")
+                    self.record(self.stages[name])
+                    done.add(name)
+                    ran.append(name)
+
+        if failed:
+            raise Exception(f"失敗したステージがあります。{failed}")
+        return ran
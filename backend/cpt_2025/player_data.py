@@ -0,0 +1,32 @@
+"""大会成績からプレイヤー毎の集計値を求める
+
+- CPTPoint: 獲得したCPTポイントの合計
+- TournamentWinCnt: 優勝した大会数
+
+レートとは独立に求めるため、パイプラインではレート計算と別のステージとし、
+大会成績 (all_placements.tsv) が変わった場合だけ実行する
+"""
+
+import storage
+
+
+def calc_player_data(placements_df):
+    player_data_df = placements_df.groupby("PlayerId", as_index=False).agg(
+        CPTPoint=("CPTPoint", "sum"),
+        TournamentWinCnt=("FinalPlacement", lambda s: int((s == 1).sum())),
+    )
+    return player_data_df
+
+
+def main():
+    print("大会成績を読み込み")
+    placements_df = storage.read_table("placements")
+
+    print("プレイヤー毎の集計値を出力")
+    player_data_df = calc_player_data(placements_df)
+    print(f"{len(player_data_df)=}")
+    storage.write_table("player_data", player_data_df)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""プレイヤー毎のレート推移
+
+レート計算で各試合の適用後のレートを記録し、プレイヤー毎にまとめて保存する。
+
+- player_ids: PlayerIdの昇順
+- offsets: player_ids[i]の記録はoffsets[i]からoffsets[i + 1]の範囲
+- timestamp_deltas, rating_deltas: プレイヤー毎に(日時, 試合後のレート)を適用順に並べ、
+  直前の記録との差分にしたもの。各プレイヤーの最初の記録は差分ではなく値そのもの
+
+イベントをレーティング期間とするモデルでは、期間の重なるイベントの試合が日時の順に
+適用されない。レートの推移は適用順のままにし、各記録の日時は
+そのプレイヤーのその記録までに適用した試合の最も遅い日時とする。
+これにより日時はプレイヤー毎に昇順になり、日時の二分探索を行える
+
+読み込み時に差分を戻すため、PlayerIdの検索と日時の検索はどちらも二分探索になる
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+HISTORY_PATH = "data/cpt_2025/rating_history.npz"
+
+
+def segment_diff(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """区間毎に直前の値との差分にする。区間の先頭は値そのもの"""
+    deltas = np.diff(values, prepend=0)
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    deltas[starts] = values[starts]
+    return deltas
+
+
+def segment_cumsum(deltas: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """segment_diffの逆変換"""
+    totals = np.cumsum(deltas)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    # 区間の先頭の直前までの累積和を引く
+    base = np.where(starts > 0, totals[np.maximum(starts - 1, 0)], 0)
+    return totals - np.repeat(base, lengths)
+
+
+def interleave_records(
+    timestamps, winner_ids, loser_ids, winner_ratings, loser_ratings
+):
+    """試合毎の勝者・敗者の値を、1試合につき勝者, 敗者の順の記録に並べる"""
+
+    def interleave(winner_values, loser_values):
+        return np.stack([winner_values, loser_values], axis=1).ravel()
+
+    return (
+        interleave(winner_ids, loser_ids),
+        np.repeat(timestamps, 2),
+        interleave(winner_ratings, loser_ratings),
+    )
+
+
+class RatingHistory:
+    def __init__(self, player_ids, offsets, timestamps, ratings, initial_rating):
+        self.player_ids = player_ids
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.ratings = ratings
+        self.initial_rating = initial_rating
+
+    @classmethod
+    def from_records(cls, player_ids, timestamps, ratings, initial_rating):
+        """適用順に並べた(PlayerId, 試合日時, 試合後のレート)の配列から作成する
+
+        プレイヤー毎の記録は適用順のまま並べ、日時はそれまでの記録の最も遅い日時にする
+        """
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        order = np.argsort(player_ids, kind="stable")
+        sorted_ids = player_ids[order]
+        unique_ids, counts = np.unique(sorted_ids, return_counts=True)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        timestamps = (
+            pd.Series(np.asarray(timestamps, dtype=np.int64)[order])
+            .groupby(sorted_ids)
+            .cummax()
+            .to_numpy()
+        )
+        return cls(
+            unique_ids,
+            offsets,
+            timestamps,
+            np.asarray(ratings, dtype=np.int64)[order],
+            initial_rating,
+        )
+
+    def to_records(self):
+        """(PlayerId, 試合日時, 試合後のレート)の配列に戻す"""
+        player_ids = np.repeat(self.player_ids, np.diff(self.offsets))
+        return player_ids, self.timestamps, self.ratings
+
+    def append(self, player_ids, timestamps, ratings) -> "RatingHistory":
+        """記録を追加したRatingHistoryを返す。追加する記録は既存の記録より後に適用したもの"""
+        old_ids, old_timestamps, old_ratings = self.to_records()
+        return RatingHistory.from_records(
+            np.concatenate([old_ids, player_ids]),
+            np.concatenate([old_timestamps, timestamps]),
+            np.concatenate([old_ratings, ratings]),
+            self.initial_rating,
+        )
+
+    def save(self, path=HISTORY_PATH):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            player_ids=self.player_ids,
+            offsets=self.offsets,
+            timestamp_deltas=segment_diff(self.timestamps, self.offsets),
+            rating_deltas=segment_diff(self.ratings, self.offsets).astype(np.int32),
+            initial_rating=np.int64(self.initial_rating),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=HISTORY_PATH) -> "RatingHistory":
+        """保存済みのレート推移を読み込む。存在しない場合はNoneを返す"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            offsets = data["offsets"]
+            history = cls(
+                data["player_ids"],
+                offsets,
+                segment_cumsum(data["timestamp_deltas"], offsets),
+                segment_cumsum(data["rating_deltas"].astype(np.int64), offsets),
+                int(data["initial_rating"]),
+            )
+            is_start = np.zeros(len(history.timestamps), dtype=bool)
+            is_start[offsets[:-1][offsets[:-1] < offsets[1:]]] = True
+            is_sorted = (data["timestamp_deltas"][~is_start] >= 0).all()
+        # 日時をそれまでの記録の最も遅い日時にせずに保存していた場合は作り直す
+        if not is_sorted:
+            history = cls.from_records(*history.to_records(), history.initial_rating)
+        return history
+
+    def get_range(self, player_id):
+        """player_idの記録の範囲を返す。記録が無い場合は(0, 0)"""
+        i = np.searchsorted(self.player_ids, player_id)
+        if i == len(self.player_ids) or self.player_ids[i] != player_id:
+            return 0, 0
+        return self.offsets[i], self.offsets[i + 1]
+
+    def get_curve(self, player_id):
+        """プレイヤーの(日時, 試合後のレート)の配列を適用順に返す"""
+        start, end = self.get_range(player_id)
+        return self.timestamps[start:end], self.ratings[start:end]
+
+    def get_rating_at(self, player_id, timestamp) -> int:
+        """timestampの時点のレート (日時がtimestamp以前の記録を適用した後のレート) を返す"""
+        start, end = self.get_range(player_id)
+        i = np.searchsorted(self.timestamps[start:end], timestamp, side="right")
+        if i == 0:
+            return self.initial_rating
+        return int(self.ratings[start + i - 1])
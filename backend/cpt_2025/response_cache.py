@@ -0,0 +1,133 @@
+"""start.gg APIのレスポンスをディスクにキャッシュする
+
+キャッシュのキーはクエリ文字列と変数から計算したハッシュ値で、
+1レスポンスを1つのgzip圧縮JSONファイルとして保存する。
+
+- 完了済み(COMPLETED)イベントのレスポンスは内容が変わらないため期限切れにしない
+- それ以外のレスポンスはttl秒経過すると期限切れとする
+- 合計サイズがmax_bytesを超えた場合、最後に参照されてから時間が経ったものから削除する
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = "data/startgg_cache"
+# 完了前のイベントは試合や順位が更新されるため、短い時間で期限切れにする
+DEFAULT_TTL = 60 * 5  # 5分
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def is_completed_event(data) -> bool:
+    """レスポンスが完了済みイベントのものか判定する
+
+    イベント直下 (event.state) とphaseGroup経由 (phaseGroup.phase.event.state) に対応
+    """
+    if not isinstance(data, dict):
+        return False
+    event = data.get("event")
+    if not event and data.get("phaseGroup"):
+        event = (data["phaseGroup"].get("phase") or {}).get("event")
+    return bool(event) and event.get("state") == "COMPLETED"
+
+
+class ResponseCache:
+    def __init__(
+        self, cache_dir=CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.total_bytes = None  # 初回の書き込み時に集計する
+
+    def make_key(self, query, variables) -> str:
+        payload = json.dumps(
+            {"query": query, "variables": variables}, sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_path(self, key) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def get(self, query, variables):
+        """キャッシュ済みのレスポンスを返す。無い、または期限切れの場合はNone"""
+        path = self.get_path(self.make_key(query, variables))
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        if not entry["permanent"] and time.time() - entry["saved_at"] > self.ttl:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        os.utime(path)  # LRUのために参照時刻を更新
+        with self.lock:
+            self.hits += 1
+        return entry["data"]
+
+    def put(self, query, variables, data, permanent=False):
+        """レスポンスを保存する
+
+        permanent=True、または完了済みイベントのレスポンスは期限切れにしない
+        """
+        path = self.get_path(self.make_key(query, variables))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entry = {
+            "saved_at": time.time(),
+            "permanent": permanent or is_completed_event(data),
+            "data": data,
+        }
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        # 上書きする場合は元のファイルのサイズを合計から除く
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, _, size in self.list_entries())
+            else:
+                self.total_bytes += os.path.getsize(path) - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def list_entries(self):
+        """(最終参照時刻, パス, サイズ)のリストを返す"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(".json.gz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def evict(self):
+        """合計サイズがmax_bytes以下になるまで古いものから削除する"""
+        for _, path, size in sorted(self.list_entries()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+
+    def print_stats(self):
+        print(f"キャッシュ: ヒット {self.hits}件, ミス {self.misses}件")
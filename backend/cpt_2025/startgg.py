@@ -1,8 +1,14 @@
+import collections
+import gzip
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+import response_cache
+from requests.adapters import HTTPAdapter
 
 API_TOKEN = os.getenv("STARTGG_API_TOKEN")
 
@@ -15,16 +21,75 @@ HEADERS = {
     "Accept": "application/json",
     "User-Agent": "PythonStartGGClient/1.0",  # 任意ですが推奨
 }
-REQUEST_DELAY = 60 / 80  # リクエスト間の遅延時間（秒）
+RATE_LIMIT_REQUESTS = 80  # start.ggのレート制限: 60秒あたり80リクエスト
+RATE_LIMIT_PERIOD = 60
+MAX_OBJECTS_PER_REQUEST = 1000  # 1リクエストで取得できるオブジェクト数の上限
+MAX_WORKERS = 8  # 同時に実行するリクエスト数
 
 
-def run_query(query, variables):
-    """GraphQLクエリを実行し、結果を返す"""
+class SlidingWindowLimiter:
+    """直近period秒間のリクエスト数をmax_requests以下にするレート制限
+
+    送信した時刻を記録し、period秒より前の記録を除いた数で判定する。
+    最初から一度に送れる数もmax_requestsまでになる。
+    429が返された場合は、Retry-Afterの秒数まで全スレッドの送信を止める (pause)。
+    複数スレッドから共有して使う
+    """
+
+    def __init__(self, max_requests: int, period: float):
+        self.max_requests = max_requests
+        self.period = period
+        self.sent_at = collections.deque()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """1リクエスト分の送信枠を取得する。無ければ空くまで待機する"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent_at and self.sent_at[0] <= now - self.period:
+                    self.sent_at.popleft()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif len(self.sent_at) < self.max_requests:
+                    self.sent_at.append(now)
+                    return
+                else:
+                    wait = self.sent_at[0] + self.period - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """seconds秒間、全スレッドの送信を止める"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+rate_limiter = SlidingWindowLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+
+session = requests.Session()
+session.headers.update(HEADERS)
+session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+
+cache = response_cache.ResponseCache()
+
+
+def run_query(query, variables, use_cache=True, permanent=False):
+    """GraphQLクエリを実行し、結果を返す
+
+    use_cache=Trueの場合、キャッシュ済みのレスポンスがあればAPIを呼ばずにそれを返す
+    permanent=Trueの場合、保存したレスポンスを期限切れにしない
+    """
+    if use_cache:
+        cached = cache.get(query, variables)
+        if cached is not None:
+            return cached
 
     for attempt in range(3):  # 簡易リトライ処理 (最大3回)
         try:
-            response = requests.post(
-                API_URL, json={"query": query, "variables": variables}, headers=HEADERS
+            rate_limiter.acquire()
+            response = session.post(
+                API_URL, json={"query": query, "variables": variables}
             )
             response.raise_for_status()  # HTTPエラーがあれば例外を発生
             data = response.json()
@@ -32,11 +97,19 @@ def run_query(query, variables):
                 print(f"GraphQL Errors (attempt {attempt+1}): {data['errors']}")
                 # 特定のエラーコード(例:レート制限)なら待機時間を増やすなどの処理も可能
             else:
+                if use_cache:
+                    save_to_cache(query, variables, data.get("data"), permanent)
                 return data.get("data")
         except requests.exceptions.HTTPError as e:
             print(
                 f"HTTP Error (attempt {attempt+1}): {e.response.status_code} - {e.response.text[:200]}"
             )
+            if e.response.status_code == 429:
+                # レート制限を超えた場合は、指定された時間だけ全スレッドの送信を止める
+                retry_after = get_retry_after(e.response)
+                print(f"レート制限のため{retry_after:.0f}秒待機します")
+                rate_limiter.pause(retry_after)
+                continue
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt+1}): {e}")
         except json.JSONDecodeError as e:
@@ -52,3 +125,125 @@ def run_query(query, variables):
             time.sleep(5 * (attempt + 1))  # 指数バックオフ
 
     return None
+
+
+def get_retry_after(response) -> float:
+    """429のレスポンスのRetry-After (秒数) を返す。無い場合はRATE_LIMIT_PERIOD秒"""
+    try:
+        return max(float(response.headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return float(RATE_LIMIT_PERIOD)
+
+
+def save_to_cache(query, variables, data, permanent=False):
+    """レスポンスをキャッシュに保存する
+
+    保存に失敗しても (ディスクの容量不足や権限など) 取得したレスポンスは使えるため、
+    エラーを表示して続行する
+    """
+    try:
+        cache.put(query, variables, data, permanent=permanent)
+    except Exception as e:
+        print(f"キャッシュの保存に失敗しました: {e}")
+
+
+def run_queries(queries, variables_list, max_workers=MAX_WORKERS, permanent=False):
+    """複数のGraphQLクエリを並列に実行し、variables_listの順に結果を返す
+
+    queriesは全リクエスト共通のクエリ文字列、またはリクエスト毎のクエリのリスト
+    レート制限は全スレッドで共有される
+    """
+    if isinstance(queries, str):
+        queries = [queries] * len(variables_list)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                lambda query, variables: run_query(
+                    query, variables, permanent=permanent
+                ),
+                queries,
+                variables_list,
+            )
+        )
+
+
+def get_page_path(checkpoint_dir, page):
+    return os.path.join(checkpoint_dir, f"page_{page:05d}.json.gz")
+
+
+def load_saved_page(checkpoint_dir, page):
+    """保存済みのページを読み込む。無い場合はNone"""
+    try:
+        with gzip.open(
+            get_page_path(checkpoint_dir, page), "rt", encoding="utf-8"
+        ) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_page(checkpoint_dir, page, data):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = get_page_path(checkpoint_dir, page)
+    with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def fetch_page(query, variables, page, checkpoint_dir=None):
+    """1ページ分を取得する。checkpoint_dirに保存済みのページがあればそれを返す"""
+    if checkpoint_dir:
+        data = load_saved_page(checkpoint_dir, page)
+        if data is not None:
+            return data
+    data = run_query(query, {**variables, "page": page})
+    if data and checkpoint_dir:
+        save_page(checkpoint_dir, page, data)
+    return data
+
+
+def run_paged_query(
+    query, variables, get_connection, max_workers=MAX_WORKERS, checkpoint_dir=None
+):
+    """ページングされたGraphQLクエリの全ページを取得する
+
+    1ページ目のpageInfo.totalPagesから総ページ数を取得し、
+    残りのページを並列に取得する。variablesにはpage以外の変数を渡す
+    get_connectionはレスポンスからpageInfoとnodesを持つ要素を取り出す関数
+
+    checkpoint_dirを指定した場合、取得したページを届いた順にファイルに保存し、
+    保存済みのページは再取得しない。途中で失敗しても再実行すれば続きから取得できる
+
+    ページ番号順にレスポンスのリストを返す。取得に失敗したページはNoneとなる
+    """
+    first_page = fetch_page(query, variables, 1, checkpoint_dir)
+    connection = get_connection(first_page) if first_page else None
+    if not connection:
+        return [first_page]
+
+    total_pages = connection["pageInfo"]["totalPages"] or 0
+    print(f"  総ページ数: {total_pages}")
+    if total_pages <= 1:
+        return [first_page]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [first_page] + list(
+            executor.map(
+                lambda page: fetch_page(query, variables, page, checkpoint_dir),
+                range(2, total_pages + 1),
+            )
+        )
+
+
+def iter_paged_query(query, variables, get_connection, checkpoint_dir=None):
+    """run_paged_queryと同じく全ページを取得するが、1ページずつ順に(ページ番号, レスポンス)を返す
+
+    前のページを処理してから次のページを取得するため、保持するレスポンスは1ページ分になる
+    """
+    data = fetch_page(query, variables, 1, checkpoint_dir)
+    connection = get_connection(data) if data else None
+    total_pages = (connection["pageInfo"]["totalPages"] or 0) if connection else 1
+    yield 1, data
+    for page in range(2, total_pages + 1):
+        yield page, fetch_page(query, variables, page, checkpoint_dir)
@@ -0,0 +1,339 @@
+"""cpt_2025のデータファイルの読み書き
+
+pyarrowがインストールされている場合、各テーブルは列の型を明示したParquetファイルとして保存し、
+読み込みもParquetから行う。UIで使用するため、同じ内容のTSVファイルも出力する。
+Parquetファイルが無い、またはTSVファイルの方が新しい場合はTSVファイルから読み込む。
+"""
+
+import contextlib
+import csv
+import heapq
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet
+
+    USE_PARQUET = True
+except ImportError:
+    USE_PARQUET = False
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S UTC"
+# 日時が不明な (読み込み時に日時に変換できなかった) 値のTSVファイルでの表記
+MISSING_DATETIME = "N/A"
+
+MATCH_DTYPES = {
+    "Datetime(UTC)": "datetime",
+    "Event": "category",
+    "Bracket": "category",
+    "Round": "category",
+    "Player1": "int64",
+    "Player2": "int64",
+    "Player1Score": "category",
+    "Player2Score": "category",
+    "Player1Chars": "category",
+    "Player2Chars": "category",
+    # レート計算前の試合は空
+    "RateDiff": "Int64",
+}
+
+PLACEMENT_DTYPES = {
+    "Event": "category",
+    "FinalPlacement": "Int64",
+    "CPTPoint": "int64",
+    "PlayerId": "int64",
+}
+
+PLAYER_DTYPES = {
+    "PlayerId": "int64",
+    "GamerTag": "string",
+    "CountryCode": "category",
+    "Birthday": "string",
+}
+
+RATING_DTYPES = {
+    "Rating": "int64",
+    # Glicko-2の場合のみ
+    "RD": "int64",
+    "Volatility": "float64",
+    # TrueSkillの場合のみ
+    "Sigma": "int64",
+    "PlayerId": "int64",
+    "WinCnt": "int64",
+    "LoseCnt": "int64",
+}
+
+PLAYER_DATA_DTYPES = {
+    "PlayerId": "int64",
+    "CPTPoint": "int64",
+    "TournamentWinCnt": "int64",
+}
+
+TABLES = {
+    "matches": ("data/cpt_2025/all_matches.tsv", MATCH_DTYPES),
+    "placements": ("data/cpt_2025/all_placements.tsv", PLACEMENT_DTYPES),
+    "players": ("data/cpt_2025/all_player.tsv", PLAYER_DTYPES),
+    "ratings": ("data/cpt_2025/player_ratings.tsv", RATING_DTYPES),
+    "player_data": ("data/cpt_2025/player_data.tsv", PLAYER_DATA_DTYPES),
+}
+
+
+# iter_tableで一度に読み込む行数
+READ_CHUNK_SIZE = 8192
+
+# 行の並び順の基準の列 (降順)。ここに無いテーブルは行を末尾に追加する
+SORT_COLUMNS = {"matches": "Datetime(UTC)"}
+
+
+def get_parquet_path(tsv_path: str) -> str:
+    return os.path.splitext(tsv_path)[0] + ".parquet"
+
+
+def format_category_value(value) -> str:
+    """カテゴリの値を文字列にする。整数の浮動小数点数 (欠損値を含む整数の列) は整数の表記にする"""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def to_string_category(values: pd.Series) -> pd.Series:
+    """値を文字列にそろえたカテゴリ型にする
+
+    イベント毎のファイルでは、数値だけの列は整数、"W"などを含む列は文字列として読み込まれるため、
+    まとめると整数と文字列が混ざる。カテゴリを辞書順に並べられるよう文字列にそろえる
+    """
+    codes, uniques = pd.factorize(values)
+    labels = np.array(
+        [format_category_value(value) for value in uniques] + [np.nan], dtype=object
+    )
+    return pd.Series(labels[codes], index=values.index).astype("category")
+
+
+def apply_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """列の型を変換する。dtypesに無い列はそのまま"""
+    df = df.copy()
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype == "datetime":
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = pd.to_datetime(
+                    df[column], format=DATETIME_FORMAT, errors="coerce", utc=True
+                )
+        elif dtype == "category":
+            # ソート順が文字列と同じになるようカテゴリを辞書順に並べる
+            df[column] = to_string_category(df[column])
+            df[column] = df[column].cat.set_categories(
+                sorted(df[column].cat.categories)
+            )
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def format_for_tsv(df: pd.DataFrame) -> pd.DataFrame:
+    """TSVファイルに出力できる形式に変換する"""
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            # 日時が不明な値は空にせず、MISSING_DATETIMEとして残す
+            df[column] = (
+                df[column].dt.strftime(DATETIME_FORMAT).fillna(MISSING_DATETIME)
+            )
+    return df
+
+
+def read_tsv(path: str, dtypes: dict, nrows=None) -> pd.DataFrame:
+    """TSVファイルを読み込む。nrowsを指定した場合は先頭のnrows行だけを読み込む"""
+    # float_precision="round_trip": 保存した浮動小数点数をそのまま読み戻す
+    df = pd.read_csv(
+        path,
+        sep="\t",
+        index_col=False,
+        encoding="utf-8",
+        float_precision="round_trip",
+        nrows=nrows,
+    )
+    return apply_dtypes(df, dtypes)
+
+
+def write_tsv(df: pd.DataFrame, path: str):
+    format_for_tsv(df).to_csv(
+        path,
+        index=False,
+        sep="\t",
+        lineterminator="\n",
+        encoding="utf-8",
+    )
+
+
+def table_exists(name: str) -> bool:
+    tsv_path, _ = TABLES[name]
+    return os.path.exists(tsv_path) or os.path.exists(get_parquet_path(tsv_path))
+
+
+def use_parquet_file(tsv_path: str) -> bool:
+    """TSVファイルの代わりにParquetファイルから読み込むか"""
+    parquet_path = get_parquet_path(tsv_path)
+    return (
+        USE_PARQUET
+        and os.path.exists(parquet_path)
+        and (
+            not os.path.exists(tsv_path)
+            or os.path.getmtime(parquet_path) >= os.path.getmtime(tsv_path)
+        )
+    )
+
+
+def read_table(name: str) -> pd.DataFrame:
+    tsv_path, dtypes = TABLES[name]
+    if use_parquet_file(tsv_path):
+        return apply_dtypes(pd.read_parquet(get_parquet_path(tsv_path)), dtypes)
+    return read_tsv(tsv_path, dtypes)
+
+
+def iter_table(name: str, chunksize: int = READ_CHUNK_SIZE):
+    """read_tableと同じ内容を、chunksize行ずつのDataFrameとして順に返す"""
+    tsv_path, dtypes = TABLES[name]
+    if use_parquet_file(tsv_path):
+        parquet_file = pyarrow.parquet.ParquetFile(get_parquet_path(tsv_path))
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield apply_dtypes(batch.to_pandas(), dtypes)
+        return
+    with pd.read_csv(
+        tsv_path,
+        sep="\t",
+        index_col=False,
+        encoding="utf-8",
+        float_precision="round_trip",
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            yield apply_dtypes(chunk, dtypes)
+
+
+def write_table(name: str, df: pd.DataFrame):
+    """UI向けのTSVファイルと、Parquetファイルに出力する"""
+    tsv_path, dtypes = TABLES[name]
+    df = apply_dtypes(df, dtypes)
+    write_tsv(df, tsv_path)
+    if USE_PARQUET:
+        # TSVより後に書き込み、次回の読み込みでParquetが使われるようにする
+        df.to_parquet(get_parquet_path(tsv_path), index=False)
+
+
+def get_sort_value(value: str):
+    """並び順の列の値の比較用キー。空の値とMISSING_DATETIMEは最後 (降順で最小) にする"""
+    is_missing = value in ("", MISSING_DATETIME)
+    return (not is_missing, "" if is_missing else value)
+
+
+def insert_rows(name: str, df: pd.DataFrame, drop_head: int = 0):
+    """TSVファイルの全体を読み込まずに、dfの行を追加する
+
+    既存の行は1行ずつそのままコピーし、dfの行はSORT_COLUMNSの列の降順になる位置に
+    挿入する (同じ値の場合は既存の行を先にする)。並び順の列が無いテーブルは末尾に追加する。
+    drop_headを指定した場合は、既存の先頭のdrop_head行を除く。
+    dfに無い列は空になり、既存のファイルに無い列は出力しない。
+    Parquetファイルは全体の書き直しが必要なため削除し、次回のwrite_tableで作り直す
+    """
+    tsv_path, dtypes = TABLES[name]
+    with open(tsv_path, "r", encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f, delimiter="\t"))
+
+    buffer = io.StringIO()
+    format_for_tsv(apply_dtypes(df, dtypes)).reindex(columns=header).to_csv(
+        buffer, index=False, header=False, sep="\t", lineterminator="\n"
+    )
+    new_rows = list(csv.reader(io.StringIO(buffer.getvalue()), delimiter="\t"))
+    sort_column = SORT_COLUMNS.get(name)
+    if sort_column in header:
+        position = header.index(sort_column)
+        new_rows.sort(key=lambda row: get_sort_value(row[position]), reverse=True)
+    else:
+        position = None
+
+    tmp_path = f"{tsv_path}.tmp"
+    with (
+        open(tsv_path, "r", encoding="utf-8", newline="") as src,
+        open(tmp_path, "w", encoding="utf-8", newline="") as dst,
+    ):
+        reader = csv.reader(src, delimiter="\t")
+        writer = csv.writer(dst, delimiter="\t", lineterminator="\n")
+        writer.writerow(next(reader))
+        i = 0
+        for row_number, row in enumerate(reader):
+            if row_number < drop_head:
+                continue
+            if position is not None:
+                value = get_sort_value(row[position])
+                while (
+                    i < len(new_rows) and get_sort_value(new_rows[i][position]) > value
+                ):
+                    writer.writerow(new_rows[i])
+                    i += 1
+            writer.writerow(row)
+        writer.writerows(new_rows[i:])
+    os.replace(tmp_path, tsv_path)
+    remove_parquet(tsv_path)
+
+
+def remove_parquet(tsv_path: str):
+    """TSVファイルだけを書き直した場合に、古くなったParquetファイルを削除する"""
+    parquet_path = get_parquet_path(tsv_path)
+    if os.path.exists(parquet_path):
+        os.remove(parquet_path)
+
+
+def count_rows(name: str) -> int:
+    """テーブルの行数。ファイル全体のDataFrameは作らない"""
+    tsv_path, _ = TABLES[name]
+    if use_parquet_file(tsv_path):
+        parquet_file = pyarrow.parquet.ParquetFile(get_parquet_path(tsv_path))
+        return parquet_file.metadata.num_rows
+    if not os.path.exists(tsv_path):
+        return 0
+    with open(tsv_path, "r", encoding="utf-8", newline="") as f:
+        return max(sum(1 for _ in csv.reader(f, delimiter="\t")) - 1, 0)
+
+
+def merge_sorted_files(name: str, paths: list):
+    """SORT_COLUMNSの列の降順に並んだTSVファイル (ヘッダー付き) を1行ずつk-way mergeして、
+    テーブルのTSVファイルに出力する
+
+    同じ値の行はpathsの順に並べる。列は最初のファイルのヘッダーの順にする。
+    Parquetファイルは削除し、次回のwrite_tableで作り直す
+    """
+    tsv_path, _ = TABLES[name]
+    sort_column = SORT_COLUMNS[name]
+    tmp_path = f"{tsv_path}.tmp"
+    with contextlib.ExitStack() as stack:
+        readers = [
+            csv.DictReader(
+                stack.enter_context(open(path, "r", encoding="utf-8", newline="")),
+                delimiter="\t",
+            )
+            for path in paths
+        ]
+        dst = stack.enter_context(open(tmp_path, "w", encoding="utf-8", newline=""))
+        writer = csv.DictWriter(
+            dst,
+            fieldnames=readers[0].fieldnames if readers else [],
+            delimiter="\t",
+            lineterminator="\n",
+            restval="",
+            extrasaction="ignore",
+        )
+        writer.writeheader()
+        writer.writerows(
+            heapq.merge(
+                *readers,
+                key=lambda row: get_sort_value(row[sort_column]),
+                reverse=True,
+            )
+        )
+    os.replace(tmp_path, tsv_path)
+    remove_parquet(tsv_path)
@@ -0,0 +1,226 @@
+"""Eloのパラメータの組み合わせ毎に、試合結果の予測の精度を求める
+
+全試合を1回だけ読み込んで共有メモリに置き、パラメータの組み合わせを
+プロセスプールで分担して計算する。各組み合わせでは全試合を古い順に適用し、
+各試合の適用前のレートから求めた勝者の勝率の予測を評価する
+
+- LogLoss: -log(予測した勝者の勝率) の平均 (小さいほど良い)
+- Brier: (1 - 予測した勝者の勝率)^2 の平均 (小さいほど良い)
+- Accuracy: 勝者の方を高く予測した試合の割合 (同じ予測は0.5と数える)
+
+パラメータは以下の2つ。値は複数指定でき、start:stop:stepで範囲も指定できる (stopを含む)
+
+- K: rating_engine.EloModelのk
+- ScaleWeight: セット数の差による倍率 (rating_engine.get_scale_factor) の効き方。
+  倍率を 1 + ScaleWeight * (倍率 - 1) にする。1で現在の計算と同じ、0でセット数の差を無視
+
+初期レートは、Eloでは全員が同じ値のためレートの差 (予測) に影響せず、対象にしない
+
+例:
+    python backend/cpt_2025/sweep_params.py --k 4:52:4 --scale-weight 0:2:0.1 --workers 8
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import calc_ratings
+import numpy as np
+import pandas as pd
+import rating_engine
+
+SWEEP_TSV_PATH = "data/cpt_2025/param_sweep.tsv"
+PARAM_COLUMNS = ["K", "ScaleWeight"]
+SCORE_COLUMNS = ["LogLoss", "Brier", "Accuracy", "MatchCnt"]
+
+# 共有メモリ上の試合データの行 (いずれもint64、列が試合)
+SHARED_ROWS = ["winners", "losers", "diff_sets", "is_scored"]
+
+# ワーカープロセス毎に、共有メモリから作る試合データ
+worker_matches = None
+worker_is_scored = None
+worker_player_cnt = 0
+worker_shm = None
+
+
+class SweepEloModel(rating_engine.EloModel):
+    def __init__(self, k, scale_weight):
+        # 初期レートは予測に影響しないため、現在の設定値にする
+        initial_rating = rating_engine.CIRCUITS["cpt_2025"]["params"]["initial_rating"]
+        super().__init__(k=k, initial_rating=initial_rating)
+        self.scale_weight = scale_weight
+
+    def get_k_scales(self, diff_sets: np.ndarray) -> np.ndarray:
+        scales = rating_engine.get_scale_factors(diff_sets)
+        return self.k * (1 + self.scale_weight * (scales - 1))
+
+
+def parse_values(texts, value_type) -> list:
+    """値の指定 (例: 20, 4:52:4) を値のリストにする。範囲はstopを含む"""
+    values = []
+    for text in texts:
+        if ":" not in text:
+            values.append(value_type(text))
+            continue
+        start, stop, step = (float(v) for v in text.split(":"))
+        if step <= 0:
+            raise Exception(f"範囲の間隔は正の値にしてください。{text}")
+        cnt = int(np.floor((stop - start) / step + 1e-9)) + 1
+        values += [value_type(round(start + i * step, 10)) for i in range(cnt)]
+    return sorted(set(values))
+
+
+def create_grid(ks, scale_weights) -> list[dict]:
+    return [
+        {"K": k, "ScaleWeight": scale_weight}
+        for k, scale_weight in itertools.product(ks, scale_weights)
+    ]
+
+
+def load_matches(min_games=0):
+    """全試合を適用順に並べ、(勝者, 敗者, セット数の差, 評価する試合か)の配列と
+    プレイヤー数を返す
+
+    両プレイヤーともそれ以前にmin_games試合以上している試合だけを評価する
+    """
+    table = calc_ratings.read_match_table()
+    order = table.get_chronological_order()
+    winners = table.frame["Player1"].to_numpy(np.int64)[order]
+    losers = table.frame["Player2"].to_numpy(np.int64)[order]
+    diff_sets = table.calc_diff_sets()[order]
+
+    # 1試合につき勝者, 敗者の順に並べ、それぞれの過去の試合数を数える
+    players = np.stack([winners, losers], axis=1).ravel()
+    game_cnts = pd.Series(players).groupby(players).cumcount().to_numpy()
+    is_scored = (game_cnts.reshape(-1, 2) >= min_games).all(axis=1)
+    return (winners, losers, diff_sets, is_scored), len(table.player_ids)
+
+
+def create_shared_matches(arrays) -> shared_memory.SharedMemory:
+    n = len(arrays[0])
+    shm = shared_memory.SharedMemory(create=True, size=max(len(arrays) * n * 8, 1))
+    block = np.ndarray((len(arrays), n), dtype=np.int64, buffer=shm.buf)
+    for i, values in enumerate(arrays):
+        block[i] = values
+    return shm
+
+
+def init_worker(shm_name, match_cnt, player_cnt):
+    """ワーカープロセスで共有メモリの試合データを参照する (コピーしない)"""
+    global worker_matches, worker_is_scored, worker_player_cnt, worker_shm
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray(
+        (len(SHARED_ROWS), match_cnt), dtype=np.int64, buffer=worker_shm.buf
+    )
+    rows = dict(zip(SHARED_ROWS, block))
+    worker_matches = rating_engine.MatchArray(
+        rows["winners"], rows["losers"], rows["diff_sets"]
+    )
+    worker_is_scored = rows["is_scored"].astype(bool)
+    worker_player_cnt = player_cnt
+
+
+def evaluate(params: dict) -> dict:
+    """1つのパラメータの組み合わせで全試合を適用し、予測の精度を返す"""
+    model = SweepEloModel(params["K"], params["ScaleWeight"])
+    state = model.create_state(worker_player_cnt)
+    initial_ratings = model.get_ratings(state).copy()
+    winner_diffs, loser_diffs = model.replay(state, worker_matches)
+    winner_ratings, loser_ratings = rating_engine.calc_rating_history(
+        initial_ratings, worker_matches, winner_diffs, loser_diffs
+    )
+
+    # 適用前のレートから求めた勝者の勝率
+    gaps = (loser_ratings - loser_diffs) - (winner_ratings - winner_diffs)
+    expects = 1 / (1 + 10 ** (gaps[worker_is_scored] / 400))
+    return {
+        **params,
+        "LogLoss": float(-np.mean(np.log(np.maximum(expects, 1e-15)))),
+        "Brier": float(np.mean((1 - expects) ** 2)),
+        "Accuracy": float(np.mean((expects > 0.5) + 0.5 * (expects == 0.5))),
+        "MatchCnt": int(len(expects)),
+    }
+
+
+def sweep(grid: list[dict], min_games=0, max_workers=None) -> pd.DataFrame:
+    """grid (パラメータの辞書のリスト) の全ての組み合わせを評価し、LogLossの昇順で返す"""
+    print("対戦結果データを読み込み")
+    arrays, player_cnt = load_matches(min_games)
+    match_cnt = len(arrays[0])
+    if not arrays[3].any():
+        raise Exception(f"評価する試合がありません。{min_games=}")
+    print(f"{match_cnt=}, 評価する試合数={int(arrays[3].sum())}, {player_cnt=}")
+
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(grid) // (max_workers * 4))
+    print(f"パラメータの組み合わせ数={len(grid)}, {max_workers=}")
+    started_at = time.perf_counter()
+    shm = create_shared_matches(arrays)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(shm.name, match_cnt, player_cnt),
+        ) as executor:
+            results = list(executor.map(evaluate, grid, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+    print(f"計算時間: {time.perf_counter() - started_at:.1f}秒")
+
+    return (
+        pd.DataFrame(results, columns=PARAM_COLUMNS + SCORE_COLUMNS)
+        .sort_values(by=["LogLoss"] + PARAM_COLUMNS, kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def print_results(results_df: pd.DataFrame, top_n=10):
+    print(f"\n--- LogLossの小さい順に上位{top_n}件 ---")
+    print(results_df.head(top_n).to_string(index=False))
+
+    # 現在の設定 (rating_engine.CIRCUITS) の結果
+    params = rating_engine.CIRCUITS["cpt_2025"]["params"]
+    current = results_df[
+        (results_df["K"] == params["k"]) & (results_df["ScaleWeight"] == 1)
+    ]
+    if len(current):
+        print("\n--- 現在の設定 ---")
+        print(current.to_string())
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Eloのパラメータの組み合わせ毎に試合結果の予測の精度を求める"
+    )
+    parser.add_argument("--k", nargs="+", default=["4:60:4"], help="K")
+    parser.add_argument(
+        "--scale-weight",
+        nargs="+",
+        default=["0:2:0.25"],
+        help="セット数の差による倍率の効き方 (1で現在の計算と同じ)",
+    )
+    parser.add_argument(
+        "--min-games",
+        type=int,
+        default=0,
+        help="両プレイヤーがそれ以前にこの試合数以上している試合だけを評価する",
+    )
+    parser.add_argument("--workers", type=int, help="プロセス数 (省略時はCPU数)")
+    parser.add_argument("--output", default=SWEEP_TSV_PATH, help="結果のTSVファイル")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    grid = create_grid(
+        parse_values(args.k, int),
+        parse_values(args.scale_weight, float),
+    )
+    results_df = sweep(grid, min_games=args.min_games, max_workers=args.workers)
+    results_df.to_csv(args.output, index=False, sep="\t", lineterminator="\n")
+    print(f"結果を出力: {args.output}")
+    print_results(results_df)
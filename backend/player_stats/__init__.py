@@ -0,0 +1,8 @@
+"""各サーキット共通のプレイヤー毎の集計
+
+試合結果やレート推移から、プレイヤー毎の値を1回のグループ化でまとめて求める
+"""
+
+from .rank_index import RankIndex
+from .results import count_results, resolve_winners, summarize_results
+from .summary import PREV_SNAPSHOT, SUMMARY_COLUMNS, summarize_ratings
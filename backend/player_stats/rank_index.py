@@ -0,0 +1,190 @@
+"""レートの高い順の順位を更新しながら求める索引
+
+整数のレート毎のプレイヤー数をFenwick木で持つ。
+レートは整数 (整数値の浮動小数点数も可) とし、小数部のあるレートは例外にする。
+順位は自分より高いレートのプレイヤー数 + 1 とする (rank(method="min")と同じ)。
+
+- update: プレイヤーのレートの変更 (1人あたりO(log R)、Rはレートの範囲の幅)
+- get_ranks: プレイヤーの現在の順位 (1人あたりO(log R))
+- top: 上位k人
+- save_snapshot / get_ranks_at: 保存した時点 (日付など) での、あるレートの順位
+
+レートの範囲外のレートが追加された場合は、範囲を広げて作り直す
+"""
+
+import numpy as np
+
+# 範囲を作り直す際に、追加されたレートの前後に空けておく幅
+RANGE_MARGIN = 256
+
+
+def to_int_ratings(ratings) -> np.ndarray:
+    """レートを整数の配列にする。切り捨てると順位が変わるため、小数部のある値は例外にする"""
+    ratings = np.asarray(ratings)
+    if not np.issubdtype(ratings.dtype, np.integer):
+        is_fraction = ~(ratings == np.round(ratings))
+        if is_fraction.any():
+            raise Exception(
+                f"レートは整数にしてください。{ratings[is_fraction][:5].tolist()}"
+            )
+    return ratings.astype(np.int64)
+
+
+def lowbit(positions: np.ndarray) -> np.ndarray:
+    return positions & -positions
+
+
+class FenwickTree:
+    """位置1..sizeの度数の木。配列の位置をまとめて加算・累積和できる"""
+
+    def __init__(self, counts: np.ndarray):
+        # tree[i]は(i - lowbit(i), i]の度数の和
+        self.size = len(counts)
+        totals = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        positions = np.arange(1, self.size + 1)
+        self.tree = np.zeros(self.size + 1, dtype=np.int64)
+        self.tree[1:] = totals[positions] - totals[positions - lowbit(positions)]
+
+    def copy(self) -> "FenwickTree":
+        tree = FenwickTree(np.zeros(0, dtype=np.int64))
+        tree.size = self.size
+        tree.tree = self.tree.copy()
+        return tree
+
+    def add(self, positions, deltas):
+        positions = np.asarray(positions, dtype=np.int64).copy()
+        deltas = np.asarray(deltas, dtype=np.int64)
+        while True:
+            valid = positions <= self.size
+            if not valid.any():
+                return
+            positions, deltas = positions[valid], deltas[valid]
+            np.add.at(self.tree, positions, deltas)
+            positions += lowbit(positions)
+
+    def prefix_sums(self, positions) -> np.ndarray:
+        """位置1..positionsの度数の和。positionsは0..sizeの範囲に丸める"""
+        positions = np.clip(np.asarray(positions, dtype=np.int64), 0, self.size)
+        totals = np.zeros(len(positions), dtype=np.int64)
+        while True:
+            valid = positions > 0
+            if not valid.any():
+                return totals
+            totals[valid] += self.tree[positions[valid]]
+            positions[valid] -= lowbit(positions[valid])
+
+    def search(self, count: int) -> int:
+        """累積和がcount以上になる最小の位置 (1 <= count <= 全体の度数)"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            if position + step <= self.size and self.tree[position + step] < count:
+                position += step
+                count -= self.tree[position]
+            step >>= 1
+        return position + 1
+
+
+class RankIndex:
+    """プレイヤーインデックス (0始まりの連番) 毎の現在のレートと、その順位の索引"""
+
+    def __init__(self, player_cnt: int):
+        self.ratings = np.zeros(player_cnt, dtype=np.int64)
+        # 一度もupdateしていないプレイヤーは順位の対象外
+        self.present = np.zeros(player_cnt, dtype=bool)
+        self.min_rating = 0
+        self.tree = FenwickTree(np.zeros(0, dtype=np.int64))
+        # ラベルから(その時点の木, min_rating)への辞書
+        self.snapshots = {}
+
+    def __len__(self):
+        """順位の対象のプレイヤー数"""
+        return int(self.present.sum())
+
+    def to_positions(self, ratings) -> np.ndarray:
+        return to_int_ratings(ratings) - self.min_rating + 1
+
+    def rebuild(self, min_rating: int, max_rating: int):
+        self.min_rating = min_rating - RANGE_MARGIN
+        size = max_rating + RANGE_MARGIN - self.min_rating + 1
+        counts = np.bincount(
+            self.to_positions(self.ratings[self.present]) - 1, minlength=size
+        )
+        self.tree = FenwickTree(counts)
+
+    def update(self, players, ratings):
+        """playersのレートをratingsに変更する。playersに重複は無いこと"""
+        players = np.asarray(players, dtype=np.int64)
+        ratings = to_int_ratings(ratings)
+        if len(players) == 0:
+            return
+        if len(np.unique(players)) != len(players):
+            raise Exception("同じプレイヤーのレートを一度に複数回変更できません。")
+
+        min_rating, max_rating = int(ratings.min()), int(ratings.max())
+        if (
+            min_rating < self.min_rating
+            or max_rating >= self.min_rating + self.tree.size
+        ):
+            current = self.ratings[self.present]
+            if len(current):
+                min_rating = min(min_rating, int(current.min()))
+                max_rating = max(max_rating, int(current.max()))
+            self.rebuild(min_rating, max_rating)
+
+        removed = players[self.present[players]]
+        self.tree.add(
+            np.concatenate(
+                [self.to_positions(self.ratings[removed]), self.to_positions(ratings)]
+            ),
+            np.concatenate(
+                [np.full(len(removed), -1), np.ones(len(players), dtype=np.int64)]
+            ),
+        )
+        self.ratings[players] = ratings
+        self.present[players] = True
+
+    def get_rating_ranks(self, ratings) -> np.ndarray:
+        """現在の対象のプレイヤーの中での、ratingsのレートの順位"""
+        return self.count_above(self.tree, self.min_rating, ratings) + 1
+
+    def get_ranks(self, players) -> np.ndarray:
+        """playersの現在の順位。対象外のプレイヤーは0"""
+        players = np.asarray(players, dtype=np.int64)
+        ranks = self.get_rating_ranks(self.ratings[players])
+        return np.where(self.present[players], ranks, 0)
+
+    def top(self, k: int) -> np.ndarray:
+        """レートの高い順に上位k人 (同じレートはプレイヤーインデックス順) を返す
+
+        k人目のレートを木から求め、そのレート以上のプレイヤーを並べる。
+        k人目と同じレートのプレイヤーが複数いる場合もk人までとする
+        """
+        total = len(self)
+        k = min(k, total)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        # k番目に高いレート = 低い方から(total - k + 1)番目のレート
+        position = self.tree.search(total - k + 1)
+        threshold = self.min_rating + position - 1
+        players = np.flatnonzero(self.present & (self.ratings >= threshold))
+        order = np.lexsort((players, -self.ratings[players]))
+        return players[order][:k]
+
+    def save_snapshot(self, label):
+        """現在の順位の状態をlabel (日付など) として保存する"""
+        self.snapshots[label] = (self.tree.copy(), self.min_rating)
+
+    def get_ranks_at(self, label, ratings) -> np.ndarray:
+        """save_snapshotで保存した時点の対象のプレイヤーの中での、ratingsのレートの順位"""
+        if label not in self.snapshots:
+            raise Exception(f"保存されていない時点です。{label}")
+        tree, min_rating = self.snapshots[label]
+        return self.count_above(tree, min_rating, ratings) + 1
+
+    @staticmethod
+    def count_above(tree: FenwickTree, min_rating: int, ratings) -> np.ndarray:
+        """treeの中で、ratingsより高いレートのプレイヤー数"""
+        positions = to_int_ratings(ratings) - min_rating + 1
+        total = tree.prefix_sums(np.array([tree.size]))[0]
+        return total - tree.prefix_sums(positions)
@@ -0,0 +1,51 @@
+"""試合結果からプレイヤー毎の勝敗数を求める
+
+プレイヤーを0始まりの連番インデックスにし、勝者・敗者の配列に対するbincountで数える
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def resolve_winners(is_entrant2_win, entrant1_ids, entrant2_ids):
+    """エントラント1・2のIDの配列から、(勝者のIDの配列, 敗者のIDの配列)を返す"""
+    is_entrant2_win = np.asarray(is_entrant2_win, dtype=bool)
+    entrant1_ids = np.asarray(entrant1_ids)
+    entrant2_ids = np.asarray(entrant2_ids)
+    return (
+        np.where(is_entrant2_win, entrant2_ids, entrant1_ids),
+        np.where(is_entrant2_win, entrant1_ids, entrant2_ids),
+    )
+
+
+def count_results(winner_idx, loser_idx, player_cnt: int):
+    """勝者・敗者の連番インデックスの配列から、(勝ち数の配列, 負け数の配列)を返す"""
+    return (
+        np.bincount(winner_idx, minlength=player_cnt),
+        np.bincount(loser_idx, minlength=player_cnt),
+    )
+
+
+def summarize_results(player_ids, winner_ids, loser_ids) -> pd.DataFrame:
+    """player_ids毎の勝率 (win_rate)、試合数 (game_n)、勝ち数 (win_n)、負け数 (lose_n)
+
+    行はplayer_idsの順。試合の無いプレイヤーは全て0とする。
+    player_ids以外のプレイヤーの勝敗は数えない
+    """
+    player_index = pd.Index(player_ids)
+    player_cnt = len(player_index)
+
+    # player_idsに無いプレイヤーは末尾の余分なインデックスで数え、最後に除く
+    def to_index(ids):
+        idx = player_index.get_indexer(ids)
+        return np.where(idx < 0, player_cnt, idx)
+
+    win_n, lose_n = count_results(
+        to_index(winner_ids), to_index(loser_ids), player_cnt + 1
+    )
+    win_n, lose_n = win_n[:player_cnt], lose_n[:player_cnt]
+    game_n = win_n + lose_n
+    win_rate = np.divide(win_n, game_n, out=np.zeros(player_cnt), where=game_n > 0)
+    return pd.DataFrame(
+        {"win_rate": win_rate, "game_n": game_n, "win_n": win_n, "lose_n": lose_n}
+    )
@@ -0,0 +1,104 @@
+"""レート推移からプレイヤー毎のレートと順位をまとめて求める
+
+レート推移を(プレイヤー, 日付)で1回だけ並べ替え、プレイヤー毎の区間に対する
+reduceatで最新・最高・最低のレートと前回 (最新の日付より前) の記録を求める。
+順位はrank_index.RankIndexを前回のレートから最新のレートに更新して求める。
+レート計算中に日付毎に更新した索引を渡した場合は、作り直さずにその索引から求める
+"""
+
+import numpy as np
+import pandas as pd
+
+from .rank_index import RankIndex
+
+# レート計算中に更新する索引で、最新の日付の試合を適用する前の状態を保存するラベル
+PREV_SNAPSHOT = "prev"
+
+SUMMARY_COLUMNS = [
+    "last_game_date",
+    "latest_rating",
+    "best_rating",
+    "worst_rating",
+    "diff_rating",
+    "rank",
+    "diff_rank",
+]
+
+
+def summarize_ratings(
+    ratings_df: pd.DataFrame, key: str, rank_index: RankIndex = None, rank_keys=None
+) -> pd.DataFrame:
+    """key列 (プレイヤー) 毎にSUMMARY_COLUMNSの値を求める
+
+    ratings_dfは日付毎のレート (date, key, rating, diff_from_last) で、dateは日時型。
+    同じプレイヤーの同じ日付の記録が複数ある場合は、後の行を最新とする。
+
+    - diff_rating: 最新の日付 (全体) に試合をしたプレイヤーはその日のレートの増減、
+      それ以外は0
+    - rank: 最新のレートの順位
+    - diff_rank: 最新の日付より前の時点の順位からの変化 (上がった場合は正)。
+      前の時点の記録が無いプレイヤー、diff_ratingが0のプレイヤーは0
+
+    rank_indexを渡した場合は、レート計算中に日付毎に更新した索引から順位を求める。
+    rank_indexは全プレイヤーの最新のレートを持ち、最新の日付の試合を適用する前に
+    PREV_SNAPSHOTとしてsave_snapshotしたもの。rank_keysはプレイヤーインデックス毎のkey列の値
+
+    戻り値はkey列の昇順
+    """
+    codes, keys = pd.factorize(ratings_df[key], sort=True)
+    dates = ratings_df["date"].to_numpy()
+    order = np.lexsort((dates, codes))
+    codes = codes[order]
+    dates = dates[order]
+    ratings = ratings_df["rating"].to_numpy()[order]
+    diffs = ratings_df["diff_from_last"].to_numpy()[order]
+
+    # プレイヤー毎の区間 [starts, ends)。区間内は日付の昇順
+    starts = np.flatnonzero(np.diff(codes, prepend=-1) != 0)
+    lasts = np.append(starts[1:], len(codes)) - 1
+    latest_date = dates.max()
+
+    last_dates = dates[lasts]
+    latest_ratings = ratings[lasts]
+    is_updated = last_dates == latest_date
+    diff_ratings = np.where(is_updated, diffs[lasts], 0)
+
+    # 最新の日付より前の最後の記録。無い場合は区間の開始位置より前の値になる
+    rows = np.arange(len(codes))
+    prevs = np.maximum.reduceat(np.where(dates != latest_date, rows, -1), starts)
+    has_prev = prevs >= starts
+
+    if rank_index is None:
+        # 前の時点のレートで順位の索引を作り、最新の日付に試合をしたプレイヤーだけ更新する
+        players = np.arange(len(starts))
+        rank_index = RankIndex(len(starts))
+        rank_index.update(players[has_prev], ratings[prevs[has_prev]])
+        prev_ranks = rank_index.get_ranks(players)
+        rank_index.update(players[is_updated], latest_ratings[is_updated])
+        ranks = rank_index.get_ranks(players)
+    else:
+        players = pd.Index(rank_keys).get_indexer(keys)
+        if (players < 0).any():
+            raise Exception(f"索引に無いプレイヤーです。{list(keys[players < 0])}")
+        if not np.array_equal(rank_index.ratings[players], latest_ratings):
+            raise Exception("索引のレートが最新のレートと一致しません。")
+        prev_ranks = np.zeros(len(players), dtype=np.int64)
+        prev_ranks[has_prev] = rank_index.get_ranks_at(
+            PREV_SNAPSHOT, ratings[prevs[has_prev]]
+        )
+        ranks = rank_index.get_ranks(players)
+
+    diff_ranks = np.where(has_prev & (diff_ratings != 0), prev_ranks - ranks, 0)
+
+    return pd.DataFrame(
+        {
+            key: keys,
+            "last_game_date": last_dates,
+            "latest_rating": latest_ratings,
+            "best_rating": np.maximum.reduceat(ratings, starts),
+            "worst_rating": np.minimum.reduceat(ratings, starts),
+            "diff_rating": diff_ratings,
+            "rank": ranks,
+            "diff_rank": diff_ranks,
+        }
+    )
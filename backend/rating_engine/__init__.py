@@ -0,0 +1,17 @@
+"""各サーキット共通のレーティング計算エンジン
+
+試合データをcore.MatchArrayに正規化し、サーキットの設定 (circuits.CIRCUITS) に
+応じたモデルで計算する
+"""
+
+from .circuits import CIRCUITS, MODELS, create_model
+from .core import (
+    MatchArray,
+    RatingModel,
+    calc_rating_history,
+    get_scale_factor,
+    get_scale_factors,
+)
+from .elo import EloModel
+from .glicko2 import Glicko2Model
+from .trueskill import TrueSkillModel
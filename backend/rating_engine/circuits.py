@@ -0,0 +1,50 @@
+"""サーキット毎のレーティング設定
+
+model: MODELSのキー
+params: モデルのコンストラクタに渡す引数
+"""
+
+from .elo import EloModel
+from .glicko2 import Glicko2Model
+from .trueskill import TrueSkillModel
+
+MODELS = {
+    EloModel.name: EloModel,
+    Glicko2Model.name: Glicko2Model,
+    TrueSkillModel.name: TrueSkillModel,
+}
+
+CIRCUITS = {
+    "cpt_2023": {
+        "model": "elo",
+        "params": {"k": 20, "initial_rating": 1500},
+    },
+    "cpt_2025": {
+        "model": "elo",
+        "params": {"k": 20, "initial_rating": 1500},
+    },
+    "sfl_2023": {
+        # SFLだけだと試合数が少ないため大きめを設定
+        # チーム戦では同じ勝ち数の場合を引き分けとする
+        "model": "elo",
+        "params": {"k": 32, "initial_rating": 1500, "allow_draws": True},
+    },
+}
+
+
+def create_model(circuit: str, model: str = None, **params):
+    """サーキットの設定からモデルを作成する
+
+    modelを指定した場合はサーキットの設定と異なるモデルを使う (paramsは初期レートのみ引き継ぐ)
+    """
+    if circuit not in CIRCUITS:
+        raise Exception(f"サーキットの設定がありません。{circuit}")
+    config = CIRCUITS[circuit]
+    if model is None or model == config["model"]:
+        model = config["model"]
+        params = {**config["params"], **params}
+    else:
+        params = {"initial_rating": config["params"]["initial_rating"], **params}
+    if model not in MODELS:
+        raise Exception(f"未対応のモデルです。{model}")
+    return MODELS[model](**params)
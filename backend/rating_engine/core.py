@@ -0,0 +1,148 @@
+"""レーティング計算の共通部分
+
+各サーキットの試合データはMatchArrayに正規化してからモデルに渡す
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+# RatingModel.replay_streamで一度にまとめて計算する試合数
+STREAM_CHUNK_SIZE = 4096
+
+
+class MatchArray:
+    """適用順に並べた試合データ
+
+    - winners, losers: 勝者・敗者のプレイヤーインデックス (0始まりの連番)
+    - diff_sets: 勝者と敗者の取得セット数の差。DQ/FFなどスコアが無い試合は1とする
+    - periods: レーティング期間 (イベントなど) の番号。昇順に並べる
+      Noneの場合は1試合を1期間とする
+    """
+
+    def __init__(self, winners, losers, diff_sets, periods=None):
+        self.winners = np.asarray(winners, dtype=np.int64)
+        self.losers = np.asarray(losers, dtype=np.int64)
+        self.diff_sets = np.asarray(diff_sets, dtype=np.int64)
+        if periods is None:
+            periods = np.arange(len(self.winners))
+        self.periods = np.asarray(periods, dtype=np.int64)
+        if (np.diff(self.periods) < 0).any():
+            raise Exception("periodsは昇順に並べてください。")
+
+    def __len__(self):
+        return len(self.winners)
+
+    def get_period_bounds(self) -> list[tuple[int, int]]:
+        """期間毎の(開始位置, 終了位置)のリストを返す"""
+        starts = np.flatnonzero(np.diff(self.periods, prepend=-1) != 0)
+        ends = np.append(starts[1:], len(self))
+        return list(zip(starts.tolist(), ends.tolist()))
+
+
+def get_scale_factor(n: int) -> float:
+    if n == 0 or n == 1:
+        return 1
+    if n == 2:
+        return 1.5
+    return (n + 11) / 8
+
+
+def get_scale_factors(diff_sets: np.ndarray) -> np.ndarray:
+    """get_scale_factorの配列版"""
+    diff_sets = np.asarray(diff_sets)
+    return np.where(
+        diff_sets <= 1, 1.0, np.where(diff_sets == 2, 1.5, (diff_sets + 11) / 8)
+    )
+
+
+class RatingModel(ABC):
+    """レーティングモデルの基底クラス
+
+    プレイヤー毎の状態 (レートなど) はプレイヤーインデックスで引ける配列の辞書で持つ。
+    サブクラスはcreate_state, get_ratings, replayを実装する
+    """
+
+    name = ""
+    # Trueの場合、MatchArray.periods毎にまとめて計算する
+    uses_periods = False
+    # 状態のキーと、ファイルに保存する際の列名
+    state_columns = {"rating": "Rating"}
+
+    def __init__(self, initial_rating=1500, allow_draws=False):
+        self.initial_rating = initial_rating
+        # Trueの場合、セット数の差が0の試合を引き分けとして扱う
+        self.allow_draws = allow_draws
+
+    @abstractmethod
+    def create_state(self, n_players: int) -> dict:
+        """n_players人分の初期状態を返す"""
+
+    @abstractmethod
+    def get_ratings(self, state: dict) -> np.ndarray:
+        """表示用のレート (整数) を返す"""
+
+    def get_outputs(self, state: dict) -> dict:
+        """レートファイルに出力する列を返す"""
+        return {"Rating": self.get_ratings(state)}
+
+    def get_config(self) -> dict:
+        """モデル名と設定値を返す。保存済みの状態と同じ設定か確認するために使う"""
+        return {"model": self.name, **vars(self)}
+
+    @abstractmethod
+    def replay(self, state: dict, matches: MatchArray):
+        """試合を順番に適用してstateを更新し、各試合の(勝者, 敗者)のレート変動量を返す
+
+        変動量は表示用のレートの差とする。複数の試合をまとめて計算する期間では、
+        期間中の変動量をそのプレイヤーの期間内で最後の試合に計上する
+        """
+
+    def replay_stream(self, state: dict, match_iter, chunk_size=STREAM_CHUNK_SIZE):
+        """(勝者, 敗者, セット数の差, 期間)の反復を順番に適用し、
+        各試合の(勝者, 敗者)のレート変動量を1試合ずつ返すジェネレータ
+
+        chunk_size試合ずつMatchArrayにまとめてreplayする。
+        期間を使うモデルでは期間の途中では区切らない
+        """
+        chunk = []
+        for match in match_iter:
+            if len(chunk) >= chunk_size and (
+                not self.uses_periods or match[3] != chunk[-1][3]
+            ):
+                yield from self.replay_chunk(state, chunk)
+                chunk = []
+            chunk.append(match)
+        if chunk:
+            yield from self.replay_chunk(state, chunk)
+
+    def replay_chunk(self, state: dict, chunk: list):
+        winners, losers, diff_sets, periods = zip(*chunk)
+        matches = MatchArray(
+            winners, losers, diff_sets, periods if self.uses_periods else None
+        )
+        winner_diffs, loser_diffs = self.replay(state, matches)
+        return zip(winner_diffs.tolist(), loser_diffs.tolist())
+
+    def get_draws(self, matches: MatchArray) -> np.ndarray:
+        if not self.allow_draws:
+            return np.zeros(len(matches), dtype=bool)
+        return matches.diff_sets == 0
+
+
+def calc_rating_history(
+    initial_ratings: np.ndarray,
+    matches: MatchArray,
+    winner_diffs: np.ndarray,
+    loser_diffs: np.ndarray,
+):
+    """各試合の適用後の(勝者, 敗者)のレートを返す"""
+    players = np.stack([matches.winners, matches.losers], axis=1).ravel()
+    diffs = np.stack([winner_diffs, loser_diffs], axis=1).ravel()
+    ratings = (
+        pd.Series(diffs).groupby(players).cumsum().to_numpy()
+        + np.asarray(initial_ratings)[players]
+    )
+    ratings = ratings.reshape(-1, 2)
+    return ratings[:, 0], ratings[:, 1]
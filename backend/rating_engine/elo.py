@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from .core import MatchArray, RatingModel, get_scale_factors
+
+
+class EloModel(RatingModel):
+    """
+    得失点差を考慮できるWorld Football Elo Ratingを参考
+    https://en.wikipedia.org/wiki/World_Football_Elo_Ratings
+    """
+
+    name = "elo"
+
+    def __init__(self, k=20, initial_rating=1500, allow_draws=False):
+        super().__init__(initial_rating, allow_draws)
+        # レーティングの変動の大きさを決める定数。デフォルト16。大きいほど収束が早いがブレが大きい
+        self.k = k
+
+    def create_state(self, n_players: int) -> dict:
+        return {"rating": np.full(n_players, self.initial_rating, dtype=np.int64)}
+
+    def get_ratings(self, state: dict) -> np.ndarray:
+        return state["rating"]
+
+    def get_k_scales(self, diff_sets: np.ndarray) -> np.ndarray:
+        """試合毎の変動の大きさ (K * セット数の差による倍率)"""
+        return self.k * get_scale_factors(diff_sets)
+
+    def replay(self, state: dict, matches: MatchArray):
+        """対戦結果を順番に適用してレートを更新する
+
+        変動量はレート差・係数・引き分けかどうかの組にのみ依存するため、計算済みの値を使い回す
+        """
+        k_scales = self.get_k_scales(matches.diff_sets)
+        scale_codes, scale_values = pd.factorize(k_scales)
+        n_scales = len(scale_values)
+        scale_values = scale_values.tolist()
+
+        ratings = state["rating"]
+        rates = ratings.tolist()
+        rate_diffs = []
+        append_diff = rate_diffs.append
+        diff_cache = {}
+        for w, l, c, d in zip(
+            matches.winners.tolist(),
+            matches.losers.tolist(),
+            scale_codes.tolist(),
+            self.get_draws(matches).tolist(),
+        ):
+            rating_gap = rates[l] - rates[w]
+            key = (rating_gap * n_scales + c) * 2 + d
+            diff_r = diff_cache.get(key)
+            if diff_r is None:
+                expect = 1 / (1 + 10 ** (rating_gap / 400))
+                score = 0.5 if d else 1
+                diff_r = diff_cache[key] = round(scale_values[c] * (score - expect))
+            rates[w] += diff_r
+            rates[l] -= diff_r
+            append_diff(diff_r)
+
+        ratings[:] = rates
+        rate_diffs = np.array(rate_diffs, dtype=np.int64)
+        return rate_diffs, -rate_diffs
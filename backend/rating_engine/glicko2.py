@@ -0,0 +1,165 @@
+import numpy as np
+
+from .core import MatchArray, RatingModel
+
+# Glicko-2の内部スケールと表示用スケールの変換係数
+GLICKO2_SCALE = 173.7178
+CONVERGENCE_TOLERANCE = 1e-6
+
+
+class Glicko2Model(RatingModel):
+    """Glicko-2
+    http://www.glicko.net/glicko/glicko2.pdf
+
+    期間内の試合は期間開始時点のレートを使ってまとめて計算する。
+    試合の無かった期間はRDの増加だけを行うため、次に試合をした期間にまとめて反映する
+    """
+
+    name = "glicko2"
+    uses_periods = True
+    state_columns = {
+        "rating": "Rating",
+        "rd": "RD",
+        "volatility": "Volatility",
+        "last_period": "LastPeriod",
+    }
+
+    def __init__(
+        self,
+        initial_rating=1500,
+        initial_rd=350,
+        initial_volatility=0.06,
+        tau=0.5,
+        allow_draws=False,
+    ):
+        super().__init__(initial_rating, allow_draws)
+        self.initial_rd = initial_rd
+        self.initial_volatility = initial_volatility
+        # 期間毎のボラティリティの変化を制限する定数。0.3から1.2程度
+        self.tau = tau
+
+    def create_state(self, n_players: int) -> dict:
+        return {
+            "rating": np.full(n_players, self.initial_rating, dtype=np.float64),
+            "rd": np.full(n_players, self.initial_rd, dtype=np.float64),
+            "volatility": np.full(n_players, self.initial_volatility, dtype=np.float64),
+            # 最後に試合をした期間。-1は未対戦
+            "last_period": np.full(n_players, -1, dtype=np.int64),
+        }
+
+    def get_ratings(self, state: dict) -> np.ndarray:
+        return np.round(state["rating"]).astype(np.int64)
+
+    def get_outputs(self, state: dict) -> dict:
+        return {
+            "Rating": self.get_ratings(state),
+            "RD": np.round(state["rd"]).astype(np.int64),
+            "Volatility": np.round(state["volatility"], 6),
+        }
+
+    def replay(self, state: dict, matches: MatchArray):
+        winner_diffs = np.zeros(len(matches), dtype=np.int64)
+        loser_diffs = np.zeros(len(matches), dtype=np.int64)
+        draws = self.get_draws(matches)
+        for start, end in matches.get_period_bounds():
+            self.update_period(
+                state,
+                matches.winners[start:end],
+                matches.losers[start:end],
+                draws[start:end],
+                matches.periods[start],
+                winner_diffs[start:end],
+                loser_diffs[start:end],
+            )
+        return winner_diffs, loser_diffs
+
+    def update_period(
+        self, state, winners, losers, draws, period, winner_diffs, loser_diffs
+    ):
+        """1期間分の試合を適用する。変動量はwinner_diffs, loser_diffsに書き込む"""
+        # 各試合を勝者側・敗者側の2つの記録として扱う
+        n_matches = len(winners)
+        targets, codes = np.unique(
+            np.concatenate([winners, losers]), return_inverse=True
+        )
+        opponent_codes = np.concatenate([codes[n_matches:], codes[:n_matches]])
+        winner_scores = np.where(draws, 0.5, 1.0)
+        scores = np.concatenate([winner_scores, 1 - winner_scores])
+        n = len(targets)
+
+        mu = (state["rating"][targets] - self.initial_rating) / GLICKO2_SCALE
+        phi = self.get_period_rd(state, targets, period) / GLICKO2_SCALE
+        sigma = state["volatility"][targets]
+
+        g = 1 / np.sqrt(1 + 3 * phi[opponent_codes] ** 2 / np.pi**2)
+        expect = 1 / (1 + np.exp(-g * (mu[codes] - mu[opponent_codes])))
+        v = 1 / np.bincount(codes, g**2 * expect * (1 - expect), minlength=n)
+        score_sum = np.bincount(codes, g * (scores - expect), minlength=n)
+        delta = v * score_sum
+
+        new_sigma = self.calc_volatility(phi, sigma, v, delta)
+        phi_star = np.sqrt(phi**2 + new_sigma**2)
+        new_phi = 1 / np.sqrt(1 / phi_star**2 + 1 / v)
+        new_mu = mu + new_phi**2 * score_sum
+
+        before = np.round(state["rating"][targets]).astype(np.int64)
+        state["rating"][targets] = new_mu * GLICKO2_SCALE + self.initial_rating
+        state["rd"][targets] = new_phi * GLICKO2_SCALE
+        state["volatility"][targets] = new_sigma
+        state["last_period"][targets] = period
+        diffs = np.round(state["rating"][targets]).astype(np.int64) - before
+
+        # 期間中の変動量は各プレイヤーの期間内で最後の試合に計上する
+        last_match = np.full(n, -1, dtype=np.int64)
+        np.maximum.at(last_match, codes, np.tile(np.arange(n_matches), 2))
+        is_winner = winners[last_match] == targets
+        winner_diffs[last_match[is_winner]] = diffs[is_winner]
+        loser_diffs[last_match[~is_winner]] = diffs[~is_winner]
+
+    def get_period_rd(self, state, targets, period) -> np.ndarray:
+        """試合の無かった期間の分だけ増加させたRDを返す。初期値を上限とする"""
+        last_period = state["last_period"][targets]
+        skipped = np.where(last_period >= 0, period - last_period - 1, 0)
+        rd = np.sqrt(
+            state["rd"][targets] ** 2
+            + skipped * (state["volatility"][targets] * GLICKO2_SCALE) ** 2
+        )
+        return np.minimum(rd, self.initial_rd)
+
+    def calc_volatility(self, phi, sigma, v, delta) -> np.ndarray:
+        """新しいボラティリティを求める (Illinois法, 全プレイヤー分をまとめて計算)"""
+        tau = self.tau
+        a = np.log(sigma**2)
+
+        def f(x):
+            ex = np.exp(x)
+            return (
+                ex * (delta**2 - phi**2 - v - ex) / (2 * (phi**2 + v + ex) ** 2)
+                - (x - a) / tau**2
+            )
+
+        big_a = a.copy()
+        big_b = np.empty_like(a)
+        is_large = delta**2 > phi**2 + v
+        big_b[is_large] = np.log((delta**2 - phi**2 - v)[is_large])
+        k = np.ones_like(a)
+        searching = ~is_large
+        while searching.any():
+            searching &= f(a - k * tau) < 0
+            k[searching] += 1
+        big_b[~is_large] = (a - k * tau)[~is_large]
+
+        f_a = f(big_a)
+        f_b = f(big_b)
+        active = np.abs(big_b - big_a) > CONVERGENCE_TOLERANCE
+        while active.any():
+            big_c = big_a + (big_a - big_b) * f_a / (f_b - f_a)
+            f_c = f(big_c)
+            swap = active & (f_c * f_b <= 0)
+            keep = active & ~swap
+            big_a = np.where(swap, big_b, big_a)
+            f_a = np.where(swap, f_b, np.where(keep, f_a / 2, f_a))
+            big_b = np.where(active, big_c, big_b)
+            f_b = np.where(active, f_c, f_b)
+            active &= np.abs(big_b - big_a) > CONVERGENCE_TOLERANCE
+        return np.exp(big_a / 2)
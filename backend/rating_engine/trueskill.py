@@ -0,0 +1,108 @@
+import math
+
+import numpy as np
+
+from .core import MatchArray, RatingModel
+
+
+def norm_pdf(x):
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def norm_cdf(x):
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+class TrueSkillModel(RatingModel):
+    """1対1の試合に限定したTrueSkill
+    https://www.microsoft.com/en-us/research/publication/trueskilltm-a-bayesian-skill-rating-system/
+
+    既定値は元論文の値 (mu=25, sigma=25/3, beta=25/6, tau=25/300) を
+    初期レートに合わせて60倍したもの。表示用のレートはmuとする
+    """
+
+    name = "trueskill"
+    state_columns = {"rating": "Rating", "sigma": "Sigma"}
+
+    def __init__(
+        self,
+        initial_rating=1500,
+        sigma=500,
+        beta=250,
+        tau=5,
+        draw_margin=0,
+        allow_draws=False,
+    ):
+        super().__init__(initial_rating, allow_draws)
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+        # 引き分けとみなす実力差。allow_draws=Trueの場合は0より大きくする
+        self.draw_margin = draw_margin
+
+    def create_state(self, n_players: int) -> dict:
+        return {
+            "rating": np.full(n_players, self.initial_rating, dtype=np.float64),
+            "sigma": np.full(n_players, self.sigma, dtype=np.float64),
+        }
+
+    def get_ratings(self, state: dict) -> np.ndarray:
+        return np.round(state["rating"]).astype(np.int64)
+
+    def get_outputs(self, state: dict) -> dict:
+        return {
+            "Rating": self.get_ratings(state),
+            "Sigma": np.round(state["sigma"]).astype(np.int64),
+        }
+
+    def calc_update(self, t, eps, draw):
+        """勝敗(または引き分け)に応じたmu, sigmaの補正係数(v, w)を返す"""
+        if draw:
+            denom = norm_cdf(eps - t) - norm_cdf(-eps - t)
+            if denom < 1e-12:
+                return 0.0, 1.0
+            v = (norm_pdf(-eps - t) - norm_pdf(eps - t)) / denom
+            w = (
+                v * v
+                + ((eps - t) * norm_pdf(eps - t) + (eps + t) * norm_pdf(eps + t))
+                / denom
+            )
+            return v, w
+        x = t - eps
+        denom = norm_cdf(x)
+        if denom < 1e-12:
+            return -x, 1.0
+        v = norm_pdf(x) / denom
+        return v, v * (v + x)
+
+    def replay(self, state: dict, matches: MatchArray):
+        mus = state["rating"].tolist()
+        sigmas = state["sigma"].tolist()
+        tau2 = self.tau**2
+        beta2 = self.beta**2
+        winner_diffs = []
+        loser_diffs = []
+        for w, l, d in zip(
+            matches.winners.tolist(),
+            matches.losers.tolist(),
+            self.get_draws(matches).tolist(),
+        ):
+            var_w = sigmas[w] ** 2 + tau2
+            var_l = sigmas[l] ** 2 + tau2
+            c = math.sqrt(2 * beta2 + var_w + var_l)
+            v, k = self.calc_update((mus[w] - mus[l]) / c, self.draw_margin / c, d)
+
+            before_w, before_l = round(mus[w]), round(mus[l])
+            mus[w] += var_w / c * v
+            mus[l] -= var_l / c * v
+            sigmas[w] = math.sqrt(var_w * max(1 - var_w / c**2 * k, 1e-9))
+            sigmas[l] = math.sqrt(var_l * max(1 - var_l / c**2 * k, 1e-9))
+            winner_diffs.append(round(mus[w]) - before_w)
+            loser_diffs.append(round(mus[l]) - before_l)
+
+        state["rating"][:] = mus
+        state["sigma"][:] = sigmas
+        return (
+            np.array(winner_diffs, dtype=np.int64),
+            np.array(loser_diffs, dtype=np.int64),
+        )
@@ -1,5 +1,8 @@
-K = 32  # SFLだけだと試合数が少ないため大きめを設定
-INITIAL_RATING = 1500
+import rating_engine
+
+# レーティングのモデルと定数はrating_engine.CIRCUITSで設定する
+RATING_MODEL = rating_engine.create_model("sfl_2023")
+INITIAL_RATING = RATING_MODEL.initial_rating
 
 PLAYER_TSV_PATH = "./data/sfl_2023/players.tsv"
 RESULTS_TSV_PATH = "./data/sfl_2023/results.tsv"
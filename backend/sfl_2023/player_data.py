@@ -1,93 +1,13 @@
 import conf
 import pandas as pd
+import player_stats
 
 
 def calc_ratings(player_df, ratings_df):
-    # latest
-    latest_ratings = (
-        ratings_df.sort_values(by="date", ascending=False)
-        .groupby("name")
-        .nth(0)
-        .reset_index()
-    )
-    player_df["name"] = latest_ratings["name"]
-    player_df["last_game_date"] = latest_ratings["date"]
-    player_df["latest_rating"] = latest_ratings["rating"]
-
-    # best
-    best_ratings = (
-        ratings_df.sort_values(by="rating", ascending=False)
-        .groupby("name")
-        .nth(0)
-        .reset_index()
-    )
-    player_df["best_rating"] = player_df.merge(
-        best_ratings[["name", "rating"]], on="name", how="left"
-    )["rating"]
-
-    # worst
-    worst_ratings = (
-        ratings_df.sort_values(by="rating", ascending=True)
-        .groupby("name")
-        .nth(0)
-        .reset_index()
-    )
-    player_df["worst_rating"] = player_df.merge(
-        worst_ratings[["name", "rating"]], on="name", how="left"
-    )["rating"]
-
-    # diff
-    tmp_df = (
-        ratings_df.sort_values(by="date", ascending=False)
-        .groupby(by="name")
-        .nth(0)
-        .reset_index()
-    )
-    player_df["diff_rating"] = player_df[["name"]].merge(
-        tmp_df[["name", "diff_from_last"]], on="name", how="left"
-    )["diff_from_last"]
-    player_df.loc[
-        player_df["last_game_date"] != max(player_df["last_game_date"]), "diff_rating"
-    ] = 0
-
-    return player_df
-
-
-def calc_rank(player_df, ratings_df):
-    latest_ratings = (
-        ratings_df.sort_values(by="date", ascending=False)
-        .groupby("name")
-        .nth(0)
-        .reset_index()
-    )
-    latest_ratings["rank"] = (
-        latest_ratings["rating"].rank(ascending=False, method="min").astype(int)
-    )
-
-    latest_date = ratings_df["date"].max()
-    second_latest_ratings = (
-        ratings_df[ratings_df["date"] != latest_date]
-        .sort_values(by="date", ascending=False)
-        .groupby("name")
-        .nth(0)
-        .reset_index()
-    )
-    second_latest_ratings["rank"] = (
-        second_latest_ratings["rating"].rank(ascending=False, method="min").astype(int)
-    )
-
-    merged_df = latest_ratings.merge(second_latest_ratings, on="name", how="left")
-    merged_df["diff_rank"] = merged_df["rank_y"] - merged_df["rank_x"]
-    merged_df["diff_rank"] = merged_df["diff_rank"].fillna(0)
-
-    player_df["rank"] = player_df[["name"]].merge(
-        latest_ratings[["name", "rank"]], on="name", how="left"
-    )["rank"]
-    player_df["diff_rank"] = player_df[["name"]].merge(
-        merged_df[["name", "diff_rank"]], on="name", how="left"
-    )["diff_rank"]
-
-    player_df.loc[player_df["diff_rating"] == 0, "diff_rank"] = 0
+    # 最新・最高・最低のレートと順位をプレイヤー毎にまとめて求める
+    summary_df = player_stats.summarize_ratings(ratings_df, "name")
+    for column in summary_df.columns:
+        player_df[column] = summary_df[column]
 
     return player_df
 
@@ -95,26 +15,14 @@ def calc_rank(player_df, ratings_df):
 def calc_win_rate(player_df):
     results_df = pd.read_csv(conf.RESULTS_TSV_PATH, sep="\t")
 
-    win_df = results_df.groupby("winner").count().reset_index()[["winner", "stage"]]
-    win_df = win_df.rename(columns={"stage": "win_n"})
-
-    lose_df = results_df.groupby("loser").count().reset_index()[["loser", "stage"]]
-    lose_df = lose_df.rename(columns={"stage": "lose_n"})
-
-    tmp_df = win_df.merge(lose_df, left_on="winner", right_on="loser", how="outer")
-    tmp_df["winner"] = tmp_df["winner"].combine_first(tmp_df["loser"])
-    tmp_df = tmp_df.fillna(0)
-    tmp_df["game_n"] = tmp_df["win_n"] + tmp_df["lose_n"]
-    tmp_df["win_rate"] = tmp_df["win_n"] / tmp_df["game_n"]
+    stats_df = player_stats.summarize_results(
+        player_df["name"], results_df["winner"], results_df["loser"]
+    )
 
+    # 勝敗数も従来の出力と同じく実数で出力する
     player_df = player_df.drop(columns=["win_rate", "game_n", "win_n", "lose_n"])
-    player_df = player_df.merge(
-        tmp_df[["winner", "win_rate", "game_n", "win_n", "lose_n"]],
-        left_on="name",
-        right_on="winner",
-        how="left",
-    )
-    player_df = player_df.drop(columns=["winner"])
+    for column in stats_df.columns:
+        player_df[column] = stats_df[column].to_numpy(dtype=float)
 
     player_df = player_df.fillna(0)
 
@@ -154,13 +62,13 @@ def create_player_data(ratings_df):
 
     player_df = calc_ratings(player_df, ratings_df)
 
-    player_df = calc_rank(player_df, ratings_df)
-
     player_df = calc_win_rate(player_df)
 
     player_df = set_update(player_df)
 
-    player_df = player_df.sort_values(by="latest_rating", ascending=False)
+    player_df = player_df.sort_values(
+        by="latest_rating", ascending=False, kind="stable"
+    )
 
     player_df.to_csv(
         conf.PLAYER_DATA_TSV_PATH, index=False, sep="\t", lineterminator="\n"
@@ -1,85 +1,81 @@
-"""全プレイヤー全試合のレーティングを計算
-"""
+"""全プレイヤー全試合のレーティングを計算"""
 
 import conf
+import numpy as np
 import pandas as pd
+import rating_engine
 
+RATING_COLUMNS = ["date", "battle", "name", "rating", "diff_from_last"]
 
-def init_ratings():
-    df = pd.read_csv(conf.PLAYER_TSV_PATH, sep="\t")
-    player_ratings = {name: conf.INITIAL_RATING for name in df.name.tolist()}
-
-    data = []
-    for name in df.name.tolist():
-        data.append(
-            {
-                "date": "2023-07-01",
-                "name": name,
-                "rating": conf.INITIAL_RATING,
-                "diff_from_last": 0,
-            }
-        )
-    ratings_df = pd.DataFrame(
-        data, columns=["date", "battle", "name", "rating", "diff_from_last"]
-    )
-
-    return player_ratings, ratings_df
-
-
-def get_scale_factor(n: int) -> float:
-    if n == 0 or n == 1:
-        return 1
-    if n == 2:
-        return 1.5
-    return (n + 11) / 8
 
+def init_ratings():
+    """初期レートと、レート履歴を列ごとに保持する辞書を返す
 
-def calc_diff_rating(winner_rating, loser_rating, winner_sets, loser_sets):
-    """
-    得失点差を考慮できるWorld Football Elo Ratingを参考
-    https://en.wikipedia.org/wiki/World_Football_Elo_Ratings
+    履歴は1試合ごとに各列のリストへ追加し、最後に一度だけDataFrameに変換する
     """
-    s = get_scale_factor(abs(winner_sets - loser_sets))
-    expect = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
-    if winner_sets == loser_sets:
-        return round(conf.K * s * (0.5 - expect))
-    return round(conf.K * s * (1 - expect))
+    df = pd.read_csv(conf.PLAYER_TSV_PATH, sep="\t")
+    names = df.name.tolist()
+    player_ratings = {name: conf.INITIAL_RATING for name in names}
+
+    history = {
+        "date": ["2023-07-01"] * len(names),
+        "battle": [None] * len(names),
+        "name": list(names),
+        "rating": [conf.INITIAL_RATING] * len(names),
+        "diff_from_last": [0] * len(names),
+    }
+
+    return player_ratings, history
+
+
+def to_player_index(player_index: pd.Index, names) -> np.ndarray:
+    idx = player_index.get_indexer(names)
+    if (idx < 0).any():
+        unknown = pd.unique(np.asarray(names)[idx < 0])
+        raise Exception(f"playersに無いプレイヤーです。{list(unknown)}")
+    return idx
+
+
+def replay_results(player_index: pd.Index, winners, losers, winner_sets, loser_sets):
+    """試合結果を順番に適用し、各試合の(勝者, 敗者)のレート変動量と適用後のレートを返す"""
+    model = conf.RATING_MODEL
+    state = model.create_state(len(player_index))
+    initial_ratings = model.get_ratings(state).copy()
+    matches = rating_engine.MatchArray(
+        to_player_index(player_index, winners),
+        to_player_index(player_index, losers),
+        np.abs(np.asarray(winner_sets) - np.asarray(loser_sets)),
+    )
+    winner_diffs, loser_diffs = model.replay(state, matches)
+    winner_ratings, loser_ratings = rating_engine.calc_rating_history(
+        initial_ratings, matches, winner_diffs, loser_diffs
+    )
+    return winner_diffs, loser_diffs, winner_ratings, loser_ratings
 
 
 def create_rating_data():
-    player_ratings, ratings_df = init_ratings()
+    player_ratings, history = init_ratings()
 
     results_df = pd.read_csv(conf.RESULTS_TSV_PATH, sep="\t")
-    for i, row in enumerate(results_df.itertuples()):
-        diff_r = calc_diff_rating(
-            player_ratings[row.winner],
-            player_ratings[row.loser],
-            row.winner_sets,
-            row.loser_sets,
-        )
+    winner_diffs, loser_diffs, winner_ratings, loser_ratings = replay_results(
+        pd.Index(list(player_ratings.keys())),
+        results_df["winner"],
+        results_df["loser"],
+        results_df["winner_sets"],
+        results_df["loser_sets"],
+    )
+
+    # 1試合につきwinner, loserの順に追加
+    def interleave(winner_values, loser_values):
+        return np.stack([winner_values, loser_values], axis=1).ravel().tolist()
+
+    history["date"] += np.repeat(results_df["date"].to_numpy(), 2).tolist()
+    history["battle"] += np.repeat(results_df["battle"].to_numpy(), 2).tolist()
+    history["name"] += interleave(results_df["winner"], results_df["loser"])
+    history["rating"] += interleave(winner_ratings, loser_ratings)
+    history["diff_from_last"] += interleave(winner_diffs, loser_diffs)
 
-        player_ratings[row.winner] += diff_r
-        player_ratings[row.loser] -= diff_r
-
-        # winner
-        new_row = {
-            "date": row.date,
-            "battle": row.battle,
-            "name": row.winner,
-            "rating": player_ratings[row.winner],
-            "diff_from_last": diff_r,
-        }
-        ratings_df.loc[len(ratings_df)] = new_row
-
-        # loser
-        new_row = {
-            "date": row.date,
-            "battle": row.battle,
-            "name": row.loser,
-            "rating": player_ratings[row.loser],
-            "diff_from_last": -diff_r,
-        }
-        ratings_df.loc[len(ratings_df)] = new_row
+    ratings_df = pd.DataFrame(history, columns=RATING_COLUMNS)
 
     def max_battle(values):
         return values.iloc[0]
@@ -1,25 +1,34 @@
 import conf
+import pandas as pd
 
 
 def add_initial_rating(team_results_df):
     team_set = set(team_results_df.name.unique())
+    rows = []
     for team in team_set:
-        row = {
-            "date": "2023-07-01",
-            "sfl_stage": 0,
-            "sfl_quarter": 0,
-            "sfl_match": 0,
-            "name": team,
-            "opponent": "",
-            "game_n": 0,
-            "win_n": 0,
-            "lose_n": 0,
-            "points": 0,
-            "rating": 1500,
-            "rate_diff": 0,
-        }
-        team_results_df.loc[len(team_results_df)] = row
-    return team_results_df
+        rows.append(
+            {
+                "date": "2023-07-01",
+                "sfl_stage": 0,
+                "sfl_quarter": 0,
+                "sfl_match": 0,
+                "name": team,
+                "opponent": "",
+                "game_n": 0,
+                "win_n": 0,
+                "lose_n": 0,
+                "points": 0,
+                "rating": 1500,
+                "rate_diff": 0,
+            }
+        )
+    # 行ごとに追加すると毎回DataFrameが再確保されるため、まとめて結合する
+    initial_df = pd.DataFrame(
+        rows,
+        columns=team_results_df.columns,
+        index=range(len(team_results_df), len(team_results_df) + len(rows)),
+    )
+    return pd.concat([team_results_df, initial_df])
 
 
 def calc_rank(team_results_df):
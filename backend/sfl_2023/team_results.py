@@ -1,4 +1,5 @@
 import conf
+import numpy as np
 import pandas as pd
 import ratings
 
@@ -69,31 +70,31 @@ def calc_ratings(team_results_df):
 
     team_results_df = team_results_df.sort_values(["date", "sfl_match"], ascending=True)
 
-    ratings_ = []
-    rate_diff = []
-    for i, row in enumerate(team_results_df.itertuples()):
-        if i % 2 != 0:
-            continue
-        win = True
-        w_n, l_n = row.win_n, row.lose_n
-        w_r, l_r = team2rating[row.name], team2rating[row.opponent]
-        if row.win_n < row.lose_n:
-            w_n, l_n = l_n, w_n
-            w_r, l_r = l_r, w_r
-            win = False
-        r = ratings.calc_diff_rating(w_r, l_r, w_n, l_n)
-        if not win:
-            r = -r
-
-        team2rating[row.name] += r
-        team2rating[row.opponent] += -r
-        ratings_.append(team2rating[row.name])
-        ratings_.append(team2rating[row.opponent])
-        rate_diff.append(r)
-        rate_diff.append(-r)
-
-    team_results_df["rating"] = ratings_
-    team_results_df["rate_diff"] = rate_diff
+    # 2行で1試合 (偶数行のチームから見た結果)。勝ち数が同じ場合は偶数行のチームを勝者とする
+    match_df = team_results_df.iloc[::2]
+    win = (match_df["win_n"] >= match_df["lose_n"]).to_numpy()
+    names = match_df["name"].to_numpy()
+    opponents = match_df["opponent"].to_numpy()
+    win_n = match_df["win_n"].to_numpy()
+    lose_n = match_df["lose_n"].to_numpy()
+    winner_diffs, loser_diffs, winner_ratings, loser_ratings = ratings.replay_results(
+        pd.Index(list(team2rating.keys())),
+        np.where(win, names, opponents),
+        np.where(win, opponents, names),
+        np.where(win, win_n, lose_n),
+        np.where(win, lose_n, win_n),
+    )
+
+    name_ratings = np.where(win, winner_ratings, loser_ratings)
+    opponent_ratings = np.where(win, loser_ratings, winner_ratings)
+    name_diffs = np.where(win, winner_diffs, loser_diffs)
+    opponent_diffs = np.where(win, loser_diffs, winner_diffs)
+    team_results_df["rating"] = np.stack(
+        [name_ratings, opponent_ratings], axis=1
+    ).ravel()
+    team_results_df["rate_diff"] = np.stack(
+        [name_diffs, opponent_diffs], axis=1
+    ).ravel()
 
     return team_results_df
 
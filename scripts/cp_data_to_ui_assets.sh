@@ -4,3 +4,6 @@ set -xeu
 
 mkdir -p ui/src/assets/sfl_2023/
 cp data/sfl_2023/*.tsv ui/src/assets/sfl_2023/
+
+# backend/cpt_2025/export_ui_data.py で出力したプレイヤー毎のデータ (data/cpt_2025/ui) は、
+# cpt2025のページがまだTSVを読み込んでいるため、ページを切り替えるまではコピーしない
@@ -0,0 +1,122 @@
+"""cpt_2025のテスト用の合成した大会データ
+
+cpt_2025のスクリプトはカレントディレクトリからの相対パス (data/cpt_2025/...) で
+読み書きするため、tmp_pathをカレントディレクトリにしてデータを書き込む
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import storage
+
+EVENTS_DIR = "data/cpt_2025/events"
+
+PLAYER_IDS = list(range(1001, 1041))
+BRACKETS = ["Round 1", "Pools", "Top 24", "Top 8"]
+ROUNDS = [
+    "Winners Round 1",
+    "Winners Semi-Final",
+    "Losers Round 2",
+    "Losers Final",
+    "Grand Final",
+]
+PLACE_TO_POINT = {1: 500, 2: 300, 3: 200, 4: 100}
+
+
+def make_event_matches(rng, event_name, start, n_matches, missing_datetimes=0):
+    """1イベント分の試合結果を、collect_match_dataの出力と同じく新しい順に並べて返す
+
+    同時刻の試合が多くなるよう、日時は30分刻みから選ぶ
+    """
+    entrants = rng.choice(PLAYER_IDS, 16, replace=False)
+    offsets = rng.integers(0, 96, n_matches) * pd.Timedelta(minutes=30)
+    records = []
+    for offset in offsets:
+        player1, player2 = rng.choice(entrants, 2, replace=False)
+        winner_score = int(rng.integers(2, 4))
+        if rng.random() < 0.05:
+            scores = ["W", "L"]
+        else:
+            scores = [winner_score, int(rng.integers(0, winner_score))]
+        records.append(
+            {
+                "Datetime(UTC)": start + offset,
+                "Event": event_name,
+                "Bracket": rng.choice(BRACKETS),
+                "Round": rng.choice(ROUNDS),
+                "Player1": int(player1),
+                "Player2": int(player2),
+                "Player1Score": scores[0],
+                "Player2Score": scores[1],
+                "Player1Chars": "Ryu",
+                "Player2Chars": "Ken, Akuma",
+            }
+        )
+    df = pd.DataFrame(records).sort_values(
+        by="Datetime(UTC)", ascending=False, kind="stable"
+    )
+    df["Datetime(UTC)"] = df["Datetime(UTC)"].dt.strftime(storage.DATETIME_FORMAT)
+    df.iloc[:missing_datetimes, 0] = storage.MISSING_DATETIME
+    return df, entrants
+
+
+def make_event_placements(rng, event_name, entrants):
+    places = rng.permutation(len(entrants)) + 1
+    return pd.DataFrame(
+        {
+            "Event": event_name,
+            "FinalPlacement": places,
+            "CPTPoint": [PLACE_TO_POINT.get(place, 0) for place in places],
+            "PlayerId": entrants,
+        }
+    ).sort_values(by="FinalPlacement")
+
+
+def write_tsv(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, sep="\t", index=False, encoding="utf-8", lineterminator="\n")
+
+
+@pytest.fixture
+def write_season(tmp_path, monkeypatch):
+    """tmp_pathをカレントディレクトリにし、プレイヤー一覧とn_events個のイベントを書き込む関数
+
+    イベントは開催日の古い順に"Event 0", "Event 1", ...とし、
+    Event 1はEvent 0と開催期間が重なるようにする。イベント名のリストを返す
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(EVENTS_DIR)
+
+    def write(n_events=4, n_matches=60, missing_datetimes=0, seed=0):
+        rng = np.random.default_rng(seed)
+        players_df = pd.DataFrame(
+            {
+                "PlayerId": PLAYER_IDS,
+                "GamerTag": [f"Player {player_id}" for player_id in PLAYER_IDS],
+                "CountryCode": rng.choice(["jp", "us", "fr"], len(PLAYER_IDS)),
+                "Birthday": "",
+            }
+        )
+        storage.write_table("players", players_df)
+
+        event_names = []
+        for i in range(n_events):
+            event_name = f"Event {i}"
+            start = pd.Timestamp("2025-03-01") + pd.Timedelta(days=10 * i)
+            if i == 1:
+                start -= pd.Timedelta(days=9)
+            matches_df, entrants = make_event_matches(
+                rng, event_name, start, n_matches, missing_datetimes
+            )
+            event_dir = os.path.join(EVENTS_DIR, event_name)
+            write_tsv(matches_df, os.path.join(event_dir, "matches.tsv"))
+            write_tsv(
+                make_event_placements(rng, event_name, entrants),
+                os.path.join(event_dir, "placements.tsv"),
+            )
+            event_names.append(event_name)
+        return event_names
+
+    return write
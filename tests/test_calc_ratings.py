@@ -0,0 +1,73 @@
+import os
+import shutil
+
+import calc_ratings
+import collect_startgg_data
+import pytest
+import rating_engine
+import rating_history
+from conftest import EVENTS_DIR
+
+OUTPUT_PATHS = [
+    "data/cpt_2025/player_ratings.tsv",
+    "data/cpt_2025/all_matches.tsv",
+    os.path.join(calc_ratings.CHECKPOINT_DIR, "players.tsv"),
+    os.path.join(calc_ratings.CHECKPOINT_DIR, "matches.tsv"),
+]
+
+
+@pytest.fixture(params=sorted(rating_engine.MODELS))
+def model(request, monkeypatch):
+    monkeypatch.setattr(
+        calc_ratings, "MODEL", rating_engine.create_model("cpt_2025", request.param)
+    )
+    return request.param
+
+
+def read_outputs() -> dict:
+    outputs = {}
+    for path in OUTPUT_PATHS:
+        with open(path, encoding="utf-8") as f:
+            outputs[path] = f.read()
+    history = rating_history.RatingHistory.load()
+    for name in ["player_ids", "offsets", "timestamps", "ratings"]:
+        outputs[name] = getattr(history, name).tolist()
+    return outputs
+
+
+def test_incremental_update_equals_full_replay(write_season, model, capsys):
+    event_names = write_season()
+    collect_startgg_data.merge_all_events_data()
+    calc_ratings.create_rating_data()
+    expected = read_outputs()
+
+    # 最後のイベントを除いて計算した後、そのイベントを追加して未適用の試合だけを適用する
+    last_event_dir = os.path.join(EVENTS_DIR, event_names[-1])
+    shutil.move(last_event_dir, "last_event")
+    collect_startgg_data.merge_all_events_data()
+    calc_ratings.create_rating_data()
+    shutil.move("last_event", last_event_dir)
+    collect_startgg_data.merge_all_events_data()
+    capsys.readouterr()
+    calc_ratings.update_rating_data()
+
+    assert "全試合から" not in capsys.readouterr().out
+    assert read_outputs() == expected
+
+
+def test_stream_replay_equals_batch(write_season, model):
+    write_season(missing_datetimes=2)
+    collect_startgg_data.merge_all_events_data()
+    calc_ratings.create_rating_data()
+    expected = read_outputs()
+
+    calc_ratings.create_rating_data(stream=True, verify=True)
+
+    # 同時刻の試合の行の並びはまとめ方によって異なるため、行の集合と日時の並びを比べる
+    actual = read_outputs()
+    matches_path = OUTPUT_PATHS[1]
+    for outputs in [expected, actual]:
+        lines = outputs.pop(matches_path).splitlines()
+        outputs["match_rows"] = sorted(lines)
+        outputs["match_datetimes"] = [line.split("\t")[0] for line in lines]
+    assert actual == expected
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from rating_engine import Glicko2Model, MatchArray
+from rating_engine.glicko2 import GLICKO2_SCALE
+
+
+def create_example_state(model):
+    """Glickman, "Example of the Glicko-2 system" の例のプレイヤー
+
+    プレイヤー0 (1500, RD 200) が 1400 (RD 30) に勝ち、1550 (RD 100) と 1700 (RD 300) に負ける
+    """
+    state = model.create_state(4)
+    state["rating"][:] = [1500, 1400, 1550, 1700]
+    state["rd"][:] = [200, 30, 100, 300]
+    return state
+
+
+def test_period_update_matches_glickman_example():
+    model = Glicko2Model(tau=0.5)
+    state = create_example_state(model)
+    matches = MatchArray([0, 2, 3], [1, 0, 0], [1, 1, 1], [0, 0, 0])
+
+    winner_diffs, loser_diffs = model.replay(state, matches)
+
+    assert state["rating"][0] == pytest.approx(1464.06, abs=0.01)
+    assert state["rd"][0] == pytest.approx(151.52, abs=0.01)
+    assert state["volatility"][0] == pytest.approx(0.05999, abs=1e-5)
+    # 期間中の変動量はプレイヤー0の期間内で最後の試合 (敗戦) に計上する
+    assert winner_diffs[0] == 0 and loser_diffs[1] == 0
+    assert loser_diffs[2] == round(1464.06) - 1500
+
+
+def test_period_update_does_not_depend_on_match_order():
+    model = Glicko2Model()
+    winners, losers = np.array([0, 2, 3, 1]), np.array([1, 0, 0, 3])
+    results = []
+    for order in [[0, 1, 2, 3], [3, 2, 1, 0]]:
+        state = create_example_state(model)
+        matches = MatchArray(winners[order], losers[order], [1] * 4, [0] * 4)
+        model.replay(state, matches)
+        results.append({key: values.copy() for key, values in state.items()})
+
+    for key in results[0]:
+        np.testing.assert_allclose(results[0][key], results[1][key])
+
+
+def test_skipped_periods_increase_rd():
+    model = Glicko2Model()
+    state = create_example_state(model)
+    state["last_period"][:] = 0
+
+    rd = model.get_period_rd(state, np.array([0, 1]), 3)
+
+    # 試合の無かった2期間分だけRDが増える
+    expected = np.sqrt(np.array([200, 30]) ** 2 + 2 * (0.06 * GLICKO2_SCALE) ** 2)
+    np.testing.assert_allclose(rd, expected)
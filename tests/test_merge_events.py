@@ -0,0 +1,55 @@
+import os
+import shutil
+
+import collect_startgg_data
+import storage
+from conftest import EVENTS_DIR
+
+
+def read_merged() -> dict:
+    matches_path, _ = storage.TABLES["matches"]
+    placements_path, _ = storage.TABLES["placements"]
+    with open(matches_path, encoding="utf-8") as f:
+        matches = f.read()
+    # 順位はイベントの読み込み順に並ぶため、行の集合で比べる
+    with open(placements_path, encoding="utf-8") as f:
+        placements = sorted(f.read().splitlines())
+    return {"matches": matches, "placements": placements}
+
+
+def test_insert_merge_equals_rebuild(write_season, capsys):
+    event_names = write_season()
+    collect_startgg_data.merge_all_events_data()
+    expected = read_merged()
+    shutil.rmtree(collect_startgg_data.MERGE_CACHE_DIR)
+
+    # 開催期間が他のイベントの間にあるイベントを後から追加する
+    event_dir = os.path.join(EVENTS_DIR, event_names[2])
+    shutil.move(event_dir, "added_event")
+    collect_startgg_data.merge_all_events_data()
+    shutil.move("added_event", event_dir)
+    capsys.readouterr()
+    collect_startgg_data.merge_all_events_data()
+
+    out = capsys.readouterr().out
+    assert "追加されたイベントファイル" in out
+    assert "'Event 0/matches.tsv'" not in out
+    assert read_merged() == expected
+
+
+def test_changed_event_rebuilds(write_season):
+    event_names = write_season()
+    collect_startgg_data.merge_all_events_data()
+
+    # 既存のイベントの試合を減らした場合は全イベントから作り直す
+    matches_path = os.path.join(EVENTS_DIR, event_names[1], "matches.tsv")
+    with open(matches_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    with open(matches_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines[:-5]) + "\n")
+    collect_startgg_data.merge_all_events_data()
+    actual = read_merged()
+
+    shutil.rmtree(collect_startgg_data.MERGE_CACHE_DIR)
+    collect_startgg_data.merge_all_events_data()
+    assert actual == read_merged()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from player_stats import RankIndex
+
+
+def expected_ranks(ratings: dict) -> dict:
+    """rank(method="min")で求めた、レートの高い順の順位"""
+    series = pd.Series(ratings)
+    return series.rank(ascending=False, method="min").astype(int).to_dict()
+
+
+def test_ranks_match_pandas_rank_min():
+    rng = np.random.default_rng(0)
+    player_cnt = 200
+    index = RankIndex(player_cnt)
+    ratings = {}
+    for step in range(200):
+        players = rng.choice(player_cnt, int(rng.integers(1, 10)), replace=False)
+        # 範囲を広げながら更新し、作り直しと同じレートの重複を含める
+        new_ratings = rng.integers(1400 - step * 3, 1600 + step * 3, len(players))
+        index.update(players, new_ratings)
+        ratings.update(zip(players.tolist(), new_ratings.tolist()))
+
+        players = np.array(list(ratings))
+        expected = expected_ranks(ratings)
+        assert index.get_ranks(players).tolist() == [expected[p] for p in players]
+
+        # 上位k人はレートの高い順 (同じレートはインデックスの小さい順)
+        current = np.array([ratings[p] for p in players])
+        k = int(rng.integers(1, len(players) + 1))
+        order = np.lexsort((players, -current))
+        assert index.top(k).tolist() == players[order][:k].tolist()
+
+
+def test_ranks_at_snapshot():
+    index = RankIndex(4)
+    index.update([0, 1, 2], [1500, 1600, 1500])
+    index.save_snapshot("prev")
+    index.update([0, 3], [1700, 1550])
+
+    assert index.get_ranks([0, 1, 2, 3]).tolist() == [1, 2, 4, 3]
+    # 保存した時点では1600が1位、1500が2位
+    assert index.get_ranks_at("prev", [1600, 1500, 1550]).tolist() == [1, 2, 2]
+
+
+def test_fractional_rating_is_rejected():
+    index = RankIndex(2)
+    with pytest.raises(Exception):
+        index.update([0], [1500.5])